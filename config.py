@@ -1,3 +1,5 @@
+import os
+
 #DB_URL = "postgresql+psycopg2:///abdulahsecibovic@localhost:5432/auto_deals"
 
 #EMAIL_HOST = "smtp.gmail.com"
@@ -14,7 +16,22 @@ DB_HOST = "localhost"
 DB_PORT = 5432
 DB_NAME = "auto_deals"
 
-DATABASE_URL = "sqlite:///auto_deal.db"
+POSTGRES_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+# Standard ist SQLite; mehrere Scraper-Rechner schreiben gemeinsam über PostgreSQL:
+#   DATABASE_URL=postgresql+psycopg2://user:pw@host/auto_deals   (oder DATABASE_URL=postgres für POSTGRES_URL)
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///auto_deal.db")
+if DATABASE_URL == "postgres":
+    DATABASE_URL = POSTGRES_URL
+
+
+# Grenzen für die adaptive Zahl paralleler Detail-Worker (async scraper)
+SCRAPE_MIN_WORKERS = 1
+SCRAPE_MAX_WORKERS = 12
 
+# Dead-Letter (scrape_failures): aufgeben nach so vielen Versuchen über alle
+# Läufe (4 pro Lauf) oder wenn der letzte Fehlschlag so viele Tage zurückliegt
+FAILURE_MAX_ATTEMPTS = 12
+FAILURE_MAX_AGE_DAYS = 14
 
 WILLHABEN_SFID = "7d36a787-9d02-45d9-9141-81ad3b805c2b"  # nimm einen, der bei dir funktioniert
@@ -0,0 +1,44 @@
+import os
+import tempfile
+
+import pytest
+
+# Die alten test_*.py sind Skripte gegen echte DB/Website (laufen beim Import):
+# nicht von pytest einsammeln lassen.
+collect_ignore = ["test_db.py", "test_insert.py", "test_run.py", "test_url.py"]
+
+# db.engine wird beim Import gebaut: Tests schreiben nie in auto_deal.db
+# (und nie in snapshots/cars.arrow)
+TEST_DIR = tempfile.mkdtemp(prefix="auto_deal_test_")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(TEST_DIR, "test.db")
+os.environ["CARS_SNAPSHOT"] = os.path.join(TEST_DIR, "snapshots", "cars.arrow")
+
+TABLES = ["price_history", "search_listings", "scrape_failures", "market_stats_members", "market_stats",
+          "market_stats_state", "price_models", "cars"]
+
+
+@pytest.fixture
+def engine():
+    """db.engine auf einer Wegwerf-SQLite mit aktuellem Schema, leer."""
+    from sqlalchemy import text
+
+    import db
+    import migrations
+
+    migrations.migrate(db.engine, log=lambda msg: None)
+    with db.engine.begin() as conn:
+        for table in TABLES:
+            conn.execute(text(f"DELETE FROM {table}"))
+    return db.engine
+
+
+def make_car(i, **kw):
+    car = {
+        "platform": "willhaben", "external_id": str(100000 + i),
+        "url": f"https://www.willhaben.at/iad/gebrauchtwagen/d/auto/test-{100000 + i}/",
+        "title": f"VW Golf {i}", "brand": "VW", "model": "Golf", "year": 2018, "km": 80000 + i,
+        "price": 15000 + 10 * i, "power_ps": 115, "fuel_type": "Diesel", "transmission": "Schaltgetriebe",
+        "drive": "Front", "description": None, "features_raw": [],
+    }
+    car.update(kw)
+    return car
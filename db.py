@@ -1,80 +1,201 @@
+import io
 import json
-from sqlalchemy import create_engine, text
-from config import DATABASE_URL
+from datetime import datetime, timedelta
+from functools import lru_cache
+from sqlalchemy import text, bindparam
+from storage import get_engine
+from config import FAILURE_MAX_ATTEMPTS, FAILURE_MAX_AGE_DAYS
+from features import FEATURE_BITS, FEATURE_NAMES, features_to_mask, mask_from_raw
 
-engine = create_engine(DATABASE_URL, future=True)
+engine = get_engine()
 
-def insert_car(car: dict):
+def utc_now() -> str:
+    # gleiches Format wie SQLite datetime('now')
+    return datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+CAR_DEFAULTS = {
+    "seller_type": None,
+    "location": None,
+    "variant": None,
+    "body_type": None,
+    "features_raw": "[]",
+    "description": None,
+    "fuel_type": None,
+    "transmission": None,
+    "drive": None,
+    "power_ps": None,
+}
+
+CAR_COLUMNS = [
+    "platform", "external_id", "url", "title",
+    "brand", "model", "variant", "body_type",
+    "year", "km", "price", "power_ps",
+    "fuel_type", "transmission", "drive",
+    "seller_type", "location", "features_raw", "features_mask", "description",
+]
+
+# Zeilen pro Upsert-Statement (20 Parameter pro Zeile, SQLite-Limit 32766)
+UPSERT_CHUNK = 500
+
+def upsert_set_sql(greatest: str = "MAX") -> str:
+    """SET-Teil des Upserts; SQLite kennt skalares MAX, PostgreSQL GREATEST."""
+    return f"""
+            -- Karten aus der Ergebnisliste haben nicht alle Attribute (und keine
+            -- Beschreibung): fehlende Werte überschreiben keine Detaildaten
+            external_id=COALESCE(excluded.external_id, cars.external_id),
+            title=COALESCE(excluded.title, cars.title),
+            brand=COALESCE(excluded.brand, cars.brand),
+            model=COALESCE(excluded.model, cars.model),
+            variant=COALESCE(excluded.variant, cars.variant),
+            body_type=COALESCE(excluded.body_type, cars.body_type),
+            year=COALESCE(excluded.year, cars.year),
+            km=COALESCE(excluded.km, cars.km),
+            price=excluded.price,
+            power_ps=COALESCE(excluded.power_ps, cars.power_ps),
+            fuel_type=COALESCE(excluded.fuel_type, cars.fuel_type),
+            transmission=COALESCE(excluded.transmission, cars.transmission),
+            drive=COALESCE(excluded.drive, cars.drive),
+            seller_type=COALESCE(excluded.seller_type, cars.seller_type),
+            location=COALESCE(excluded.location, cars.location),
+            features_raw=COALESCE(excluded.features_raw, cars.features_raw),
+            features_mask=COALESCE(excluded.features_mask, cars.features_mask),
+            description=COALESCE(excluded.description, cars.description),
+            last_seen={greatest}(COALESCE(cars.last_seen, ''), excluded.last_seen),
+            -- wieder aufgetaucht; ein Re-Parse mit älterem seen_at reaktiviert nicht
+            active=CASE WHEN cars.delisted_at IS NULL OR excluded.last_seen > cars.delisted_at
+                        THEN 1 ELSE cars.active END,
+            delisted_at=CASE WHEN cars.delisted_at IS NULL OR excluded.last_seen > cars.delisted_at
+                             THEN NULL ELSE cars.delisted_at END"""
+
+@lru_cache(maxsize=8)
+def upsert_cars_sql(n_rows: int):
+    """Mehrzeiliges Upsert mit RETURNING. current_price wird hier bewusst nicht
+    angefasst: RETURNING liefert damit den zuletzt protokollierten Preis, und
+    Preisänderungen lassen sich ohne weitere Abfrage erkennen."""
+    values = ",\n".join(
+        "(" + ", ".join(f":{c}_{i}" for c in CAR_COLUMNS) + ", :seen_at, :seen_at)"
+        for i in range(n_rows)
+    )
+    return text(f"""
+        INSERT INTO cars ({", ".join(CAR_COLUMNS)}, first_seen, last_seen)
+        VALUES {values}
+        ON CONFLICT(url) DO UPDATE SET{upsert_set_sql()}
+        RETURNING id, url, current_price
+    """)
+
+# PostgreSQL: Batch per COPY in eine Staging-Tabelle, dann ein Merge. Das Upsert
+# schreibt die geänderten Preise (alter Wert aus RETURNING, wie oben) in
+# cars_changed; Historie und current_price folgen daraus mengenbasiert.
+# ORDER BY url: parallele Scraper sperren Zeilen in gleicher Reihenfolge (keine Deadlocks).
+PG_STAGE_SQL = f"""
+    CREATE TEMP TABLE cars_stage ON COMMIT DROP AS
+        SELECT {", ".join(CAR_COLUMNS)} FROM cars WITH NO DATA;
+    CREATE TEMP TABLE cars_changed (id BIGINT, price INTEGER) ON COMMIT DROP;
+"""
+PG_MERGE_SQL = text(f"""
+    WITH up AS (
+        INSERT INTO cars ({", ".join(CAR_COLUMNS)}, first_seen, last_seen)
+        SELECT {", ".join(CAR_COLUMNS)}, :seen_at, :seen_at FROM cars_stage ORDER BY url
+        ON CONFLICT(url) DO UPDATE SET{upsert_set_sql("GREATEST")}
+        RETURNING id, url, current_price
+    )
+    INSERT INTO cars_changed (id, price)
+    SELECT up.id, s.price FROM up JOIN cars_stage s ON s.url = up.url
+    WHERE s.price IS NOT NULL AND up.current_price IS DISTINCT FROM s.price
+""")
+PG_HISTORY_SQL = text("""
+    INSERT INTO price_history (car_id, price, seen_at)
+    SELECT id, price, :seen_at FROM cars_changed ORDER BY id
+""")
+PG_CURRENT_SQL = text("""
+    UPDATE cars SET current_price = ch.price, price_changed_at = :seen_at
+    FROM cars_changed ch WHERE cars.id = ch.id
+""")
+
+def copy_field(value) -> str:
+    """Ein Feld für COPY ... (FORMAT csv): leer ohne Quotes = NULL, Text immer gequotet."""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+def car_params(car: dict) -> dict:
+    """car-Dict -> Upsert-Parameter (Defaults, JSON, Bitmaske)."""
+    row = {**CAR_DEFAULTS, **car}
     # features_raw als JSON-Text
-    if isinstance(car.get("features_raw"), (list, dict)):
-        car["features_raw"] = json.dumps(car["features_raw"], ensure_ascii=False)
+    if isinstance(row["features_raw"], (list, dict)):
+        row["features_raw"] = json.dumps(row["features_raw"], ensure_ascii=False)
+    # Bitmaske passend zu features_raw, für Feature-Filter in SQL
+    if row.get("features_mask") is None:
+        row["features_mask"] = mask_from_raw(row["features_raw"])
+    return row
+
+def insert_car(car: dict, seen_at: str | None = None):
+    """Upsert eines Inserats. seen_at (UTC, "YYYY-MM-DD HH:MM:SS") setzt den
+    Zeitpunkt für first/last_seen, z.B. beim Re-Parse aus dem Archiv; last_seen
+    geht dabei nie zurück."""
+    insert_cars([car], seen_at=seen_at)
 
+def insert_cars(cars: list, seen_at: str | None = None) -> int:
+    """Upsert vieler Inserate in einer Transaktion, danach Preisänderungen
+    (price_history + cars.current_price/price_changed_at). SQLite: mehrzeiliges
+    INSERT ... ON CONFLICT ... RETURNING pro Block; PostgreSQL: COPY + Merge.
+    Kommt eine URL mehrfach vor, zählt der letzte Stand."""
+    if not cars:
+        return 0
+    seen_at = seen_at or utc_now()
+    rows = list({r["url"]: r for r in (car_params(car) for car in cars)}.values())
+    if engine.dialect.name == "postgresql":
+        _insert_cars_copy(rows, seen_at)
+    else:
+        _insert_cars_returning(rows, seen_at)
+    return len(rows)
+
+def _insert_cars_returning(rows: list, seen_at: str):
+    history, current = [], []
     with engine.begin() as conn:
-        # 1) Upsert cars (SQLite)
-        car.setdefault("seller_type", None)
-        car.setdefault("location", None)
-        car.setdefault("variant", None)
-        car.setdefault("body_type", None)
-        car.setdefault("features_raw", "[]")
-        car.setdefault("description", None)
-        car.setdefault("fuel_type", None)
-        car.setdefault("transmission", None)
-        car.setdefault("drive", None)
-        car.setdefault("power_ps", None)
+        for start in range(0, len(rows), UPSERT_CHUNK):
+            chunk = rows[start:start + UPSERT_CHUNK]
+            params = {"seen_at": seen_at}
+            for i, r in enumerate(chunk):
+                for c in CAR_COLUMNS:
+                    params[f"{c}_{i}"] = r.get(c)
+            price_by_url = {r["url"]: r["price"] for r in chunk}
 
-        conn.execute(text("""
-            INSERT INTO cars (
-                platform, external_id, url, title,
-                brand, model, variant, body_type,
-                year, km, price, power_ps,
-                fuel_type, transmission, drive,
-                seller_type, location, features_raw, description,
-                first_seen, last_seen
-            )
-            VALUES (
-                :platform, :external_id, :url, :title,
-                :brand, :model, :variant, :body_type,
-                :year, :km, :price, :power_ps,
-                :fuel_type, :transmission, :drive,
-                :seller_type, :location, :features_raw, :description,
-                datetime('now'), datetime('now')
-            )
-            ON CONFLICT(url) DO UPDATE SET
-                external_id=excluded.external_id,
-                title=excluded.title,
-                brand=excluded.brand,
-                model=excluded.model,
-                variant=excluded.variant,
-                body_type=excluded.body_type,
-                year=excluded.year,
-                km=excluded.km,
-                price=excluded.price,
-                power_ps=excluded.power_ps,
-                fuel_type=excluded.fuel_type,
-                transmission=excluded.transmission,
-                drive=excluded.drive,
-                seller_type=excluded.seller_type,
-                location=excluded.location,
-                features_raw=excluded.features_raw,
-                description=excluded.description,
-                last_seen=datetime('now')
-        """), car)
-
-        # 2) car_id holen
-        car_id = conn.execute(text("SELECT id FROM cars WHERE url=:url"), {"url": car["url"]}).scalar_one()
-
-        # 3) letzten Preis holen, nur bei Änderung schreiben
-        last_price = conn.execute(text("""
-            SELECT price FROM price_history WHERE car_id=:car_id
-            ORDER BY seen_at DESC LIMIT 1
-        """), {"car_id": car_id}).scalar()
-
-        if car.get("price") is not None and (last_price is None or int(last_price) != int(car["price"])):
-            conn.execute(text("""
-                INSERT INTO price_history (car_id, price) VALUES (:car_id, :price)
-            """), {"car_id": car_id, "price": car["price"]})
-
-from sqlalchemy import text
+            for car_id, url, last_price in conn.execute(upsert_cars_sql(len(chunk)), params):
+                price = price_by_url[url]
+                if price is not None and (last_price is None or int(last_price) != int(price)):
+                    history.append({"car_id": car_id, "price": price, "seen_at": seen_at})
+                    current.append({"id": car_id, "price": price, "seen_at": seen_at})
+
+        if history:
+            conn.execute(text(
+                "INSERT INTO price_history (car_id, price, seen_at) VALUES (:car_id, :price, :seen_at)"
+            ), history)
+            conn.execute(text(
+                "UPDATE cars SET current_price=:price, price_changed_at=:seen_at WHERE id=:id"
+            ), current)
+
+def _insert_cars_copy(rows: list, seen_at: str):
+    buf = io.StringIO()
+    for r in rows:
+        buf.write(",".join(copy_field(r.get(c)) for c in CAR_COLUMNS))
+        buf.write("\n")
+    buf.seek(0)
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql(PG_STAGE_SQL)
+        cur = conn.connection.cursor()
+        try:
+            cur.copy_expert(f"COPY cars_stage ({', '.join(CAR_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buf)
+        finally:
+            cur.close()
+        conn.execute(PG_MERGE_SQL, {"seen_at": seen_at})
+        conn.execute(PG_HISTORY_SQL, {"seen_at": seen_at})
+        conn.execute(PG_CURRENT_SQL, {"seen_at": seen_at})
 
 def car_exists(url: str) -> bool:
     with engine.begin() as conn:
@@ -83,3 +204,196 @@ def car_exists(url: str) -> bool:
             {"url": url}
         ).first()
         return res is not None
+
+def get_known(urls) -> dict:
+    """url -> (price, last_seen) für alle bereits gespeicherten URLs, in einem Durchgang."""
+    urls = list(urls)
+    known = {}
+    if not urls:
+        return known
+    stmt = text("SELECT url, price, last_seen FROM cars WHERE url IN :urls").bindparams(
+        bindparam("urls", expanding=True)
+    )
+    with engine.connect() as conn:
+        # SQLite-Parameterlimit: in großen Blöcken, aber eine Verbindung
+        for i in range(0, len(urls), 900):
+            for url, price, last_seen in conn.execute(stmt, {"urls": urls[i:i + 900]}):
+                known[url] = (price, last_seen)
+    return known
+
+def touch_last_seen(urls) -> int:
+    """Setzt last_seen für bekannte, unveränderte Inserate (ein UPDATE pro Block);
+    sie sind damit auch wieder aktiv."""
+    urls = list(urls)
+    if not urls:
+        return 0
+    stmt = text("UPDATE cars SET last_seen=:now, active=1, delisted_at=NULL WHERE url IN :urls").bindparams(
+        bindparam("urls", expanding=True)
+    )
+    now = utc_now()
+    n = 0
+    with engine.begin() as conn:
+        for i in range(0, len(urls), 900):
+            n += conn.execute(stmt, {"urls": urls[i:i + 900], "now": now}).rowcount
+    return n
+
+def load_failures(limit: int | None = None) -> list:
+    """URLs aus der Dead-Letter-Tabelle, älteste zuerst."""
+    sql = "SELECT url FROM scrape_failures ORDER BY failed_at"
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    with engine.connect() as conn:
+        return [r[0] for r in conn.execute(text(sql))]
+
+def record_failures(failures: dict):
+    """failures: url -> (attempts, last_error). Versuche werden aufsummiert."""
+    if not failures:
+        return
+    now = utc_now()
+    rows = [{"url": u, "attempts": a, "last_error": e, "now": now} for u, (a, e) in failures.items()]
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO scrape_failures (url, attempts, last_error, failed_at)
+            VALUES (:url, :attempts, :last_error, :now)
+            ON CONFLICT(url) DO UPDATE SET
+                attempts=scrape_failures.attempts + excluded.attempts,
+                last_error=excluded.last_error,
+                failed_at=excluded.failed_at
+        """), rows)
+
+def purge_failures(max_attempts: int = FAILURE_MAX_ATTEMPTS, max_age_days: float = FAILURE_MAX_AGE_DAYS) -> int:
+    """Entfernt hoffnungslose Dead-Letter-Einträge: zu viele Versuche oder
+    seit max_age_days nicht mehr versucht. Sonst wächst die Tabelle mit jedem
+    dauerhaft kaputten Inserat, und jeder Lauf lädt sie zuerst."""
+    cutoff = (datetime.utcnow() - timedelta(days=max_age_days)).strftime("%Y-%m-%d %H:%M:%S")
+    with engine.begin() as conn:
+        return conn.execute(
+            text("DELETE FROM scrape_failures WHERE attempts >= :max_attempts OR failed_at < :cutoff"),
+            {"max_attempts": max_attempts, "cutoff": cutoff},
+        ).rowcount
+
+def clear_failures(urls) -> int:
+    urls = list(urls)
+    if not urls:
+        return 0
+    stmt = text("DELETE FROM scrape_failures WHERE url IN :urls").bindparams(
+        bindparam("urls", expanding=True)
+    )
+    n = 0
+    with engine.begin() as conn:
+        for i in range(0, len(urls), 900):
+            n += conn.execute(stmt, {"urls": urls[i:i + 900]}).rowcount
+    return n
+
+def record_search_listings(search_key: str, urls, run_at: str) -> int:
+    """Merkt sich, dass die Suche search_key diese URLs im Lauf run_at geliefert hat."""
+    rows = [{"key": search_key, "url": u, "run_at": run_at} for u in urls]
+    if not rows:
+        return 0
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO search_listings (search_key, url, first_seen, last_seen)
+            VALUES (:key, :url, :run_at, :run_at)
+            ON CONFLICT(search_key, url) DO UPDATE SET last_seen=excluded.last_seen
+        """), rows)
+    return len(rows)
+
+def mark_delisted(search_key: str, run_at: str) -> int:
+    """Nach einem vollständigen Lauf: Inserate, die die Suche früher geliefert
+    hat, diesmal aber nicht, werden inaktiv (ein UPDATE). Ausgenommen sind
+    Inserate, die in diesem Lauf anderweitig gesehen wurden oder im letzten
+    Ergebnis einer anderen Suche stehen (z.B. aus dem Preisfilter gerutscht)."""
+    with engine.begin() as conn:
+        return conn.execute(text("""
+            UPDATE cars SET active=0, delisted_at=:now
+            WHERE active=1 AND last_seen < :run_at
+              AND url IN (SELECT sl.url FROM search_listings sl
+                          WHERE sl.search_key = :key AND sl.last_seen < :run_at)
+              AND NOT EXISTS (
+                  SELECT 1 FROM search_listings o
+                  WHERE o.url = cars.url AND o.search_key <> :key
+                    AND o.last_seen = (SELECT MAX(m.last_seen) FROM search_listings m
+                                       WHERE m.search_key = o.search_key))
+        """), {"key": search_key, "run_at": run_at, "now": utc_now()}).rowcount
+
+def mark_gone(urls) -> int:
+    """Inserate, deren Detailseite nicht mehr existiert, sofort inaktiv setzen."""
+    urls = list(urls)
+    if not urls:
+        return 0
+    stmt = text("UPDATE cars SET active=0, delisted_at=:now WHERE active=1 AND url IN :urls").bindparams(
+        bindparam("urls", expanding=True)
+    )
+    now = utc_now()
+    n = 0
+    with engine.begin() as conn:
+        for i in range(0, len(urls), 900):
+            n += conn.execute(stmt, {"urls": urls[i:i + 900], "now": now}).rowcount
+    return n
+
+# bis zu so vielen passenden Masken wird als IN-Liste gefiltert (Index-Seek auf
+# idx_cars_features_mask), darüber als Bit-Ausdruck (Scan)
+FEATURE_IN_LIMIT = 256
+
+def feature_mask_sql(required=(), excluded=(), column="features_mask"):
+    """WHERE-Fragment + Parameter für "hat alle required, keins von excluded".
+    Ohne Bedingungen: ("1=1", {})."""
+    req = features_to_mask(required)
+    exc = features_to_mask(excluded)
+    if not req and not exc:
+        return "1=1", {}
+
+    # freie Bits = registrierte Bits, die weder gefordert noch ausgeschlossen sind
+    free = [1 << b for b in sorted(FEATURE_BITS.values()) if not (req | exc) >> b & 1]
+    if 2 ** len(free) <= FEATURE_IN_LIMIT:
+        masks = [req]
+        for bit in free:
+            masks += [m | bit for m in masks]
+        return f"{column} IN ({', '.join(str(m) for m in sorted(masks))})", {}
+
+    parts, params = [], {}
+    if req:
+        parts.append(f"({column} & :fm_req) = :fm_req")
+        params["fm_req"] = req
+    if exc:
+        parts.append(f"({column} & :fm_exc) = 0")
+        params["fm_exc"] = exc
+    return " AND ".join(parts), params
+
+def find_cars_by_features(required=(), excluded=(), columns=("id", "url", "title", "brand", "model", "year", "km", "price"), limit=None) -> list:
+    """Inserate mit/ohne bestimmte Features, z.B. find_cars_by_features(["carplay", "anhängerkupplung"])."""
+    where, params = feature_mask_sql(required, excluded)
+    sql = f"SELECT {', '.join(columns)} FROM cars WHERE {where} ORDER BY price"
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    with engine.connect() as conn:
+        return [dict(r._mapping) for r in conn.execute(text(sql), params)]
+
+def feature_stats(group_by=(), required=(), excluded=()) -> list:
+    """Pro Gruppe (z.B. ("brand", "model")): Anzahl und Ø-Preis insgesamt sowie
+    Anzahl und Ø-Preis der Inserate mit dem jeweiligen Feature; ein Scan."""
+    where, params = feature_mask_sql(required, excluded)
+    cols = list(group_by) + ["COUNT(*) AS n", "AVG(price) AS avg_price"]
+    for name in FEATURE_NAMES:
+        has = f"(features_mask & {1 << FEATURE_BITS[name]}) <> 0"
+        cols.append(f'SUM(CASE WHEN {has} THEN 1 ELSE 0 END) AS "n_{name}"')
+        cols.append(f'AVG(CASE WHEN {has} THEN price END) AS "avg_price_{name}"')
+    sql = f"SELECT {', '.join(cols)} FROM cars WHERE features_mask IS NOT NULL AND {where}"
+    if group_by:
+        sql += f" GROUP BY {', '.join(group_by)}"
+    with engine.connect() as conn:
+        return [dict(r._mapping) for r in conn.execute(text(sql), params)]
+
+def count_by_feature_combo(features, group_by=()) -> list:
+    """Anzahl und Ø-Preis je Kombination der angegebenen Features (features_mask & m)."""
+    m = features_to_mask(features)
+    keys = list(group_by) + ["combo"]
+    sql = f"""
+        SELECT {', '.join(list(group_by) + [f"features_mask & {m} AS combo"])},
+               COUNT(*) AS n, AVG(price) AS avg_price
+        FROM cars WHERE features_mask IS NOT NULL
+        GROUP BY {', '.join(keys)}
+        ORDER BY {', '.join(keys)}
+    """
+    with engine.connect() as conn:
+        return [dict(r._mapping) for r in conn.execute(text(sql))]
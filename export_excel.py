@@ -1,10 +1,9 @@
 # export_excel.py
 import pandas as pd
-from sqlalchemy import create_engine
-from config import DATABASE_URL
+from storage import get_engine
 
 def export_to_excel(out_path: str, where_sql: str = "", params: dict | None = None):
-    engine = create_engine(DATABASE_URL, future=True)
+    engine = get_engine(readonly=True)
     query = "SELECT * FROM cars"
     if where_sql.strip():
         query += f" WHERE {where_sql}"
@@ -0,0 +1,140 @@
+import numpy as np
+import pandas as pd
+
+# Gruppenstatistiken in einem vektorisierten Durchgang: Gruppen einmal als
+# Ganzzahl-Codes faktorisieren, Werte pro Gruppe sortieren (stabile Sortierung
+# nach Wert, dann nach Code) und Quantile per Indexrechnung aus den
+# Gruppengrenzen lesen. Kein Python-Callback pro Gruppe; das Zurückspielen auf
+# die Zeilen ist ein Array-Index statt eines merge.
+
+
+def group_codes(df, cols, dropna=True):
+    """Zeile -> Gruppencode 0..G-1 (-1 bei fehlendem Schlüssel) und die
+    Schlüsselspalten je Code (sortiert wie groupby(sort=True)). Mit
+    dropna=False ist NaN ein eigener Schlüsselwert."""
+    codes = df.groupby(cols, observed=True, sort=True, dropna=dropna).ngroup()
+    codes = codes.fillna(-1).to_numpy(dtype=np.int64)
+    # erste Zeile jeder Gruppe liefert die Schlüsselwerte
+    valid = np.flatnonzero(codes >= 0)
+    first = np.unique(codes[valid], return_index=True)[1]
+    keys = df[cols].iloc[valid[first]].reset_index(drop=True)
+    return codes, keys
+
+
+def grouped_quantiles(codes, values, n_groups, qs, order=None):
+    """Anzahl gültiger Werte je Gruppe und Quantile (lineare Interpolation wie
+    pandas/NumPy) als Array (n_groups, len(qs)); NaN-Werte zählen nicht.
+    order: Indizes von values aufsteigend nach Wert, falls schon bekannt."""
+    values = np.asarray(values, dtype=np.float64)
+    ok = (codes >= 0) & ~np.isnan(values)
+    # nach Wert, dann stabil nach Gruppe (Radix-Sort auf Ganzzahlen)
+    if order is None:
+        order = np.argsort(values, kind="stable")
+    order = order[ok[order]]
+    order = order[np.argsort(codes[order], kind="stable")]
+    v = values[order]
+
+    counts = np.bincount(codes[ok], minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    out = np.full((n_groups, len(qs)), np.nan)
+    has = counts > 0
+    st, n = starts[has], counts[has]
+    for j, q in enumerate(qs):
+        pos = st + q * (n - 1)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.minimum(lo + 1, st + n - 1)
+        out[has, j] = v[lo] + (v[hi] - v[lo]) * (pos - lo)
+    return counts, out
+
+
+def group_stats(df, cols, value="price", quantiles=(("median_price", 0.5), ("q25", 0.25), ("q75", 0.75)),
+                medians=(("median_km", "km"),), count="n"):
+    """Statistik je Gruppe als DataFrame (Index = Gruppencode) plus die Codes
+    je Zeile von df. quantiles: (Spaltenname, q) über `value`; medians:
+    (Spaltenname, Spalte) für weitere Mediane."""
+    codes, keys = group_codes(df, cols)
+    n_groups = len(keys)
+    stats = keys
+    counts, qv = grouped_quantiles(codes, df[value].to_numpy(dtype=np.float64, na_value=np.nan),
+                                   n_groups, [q for _, q in quantiles])
+    stats[count] = counts
+    for j, (name, _) in enumerate(quantiles):
+        stats[name] = qv[:, j]
+    for name, col in medians:
+        _, med = grouped_quantiles(codes, df[col].to_numpy(dtype=np.float64, na_value=np.nan), n_groups, [0.5])
+        stats[name] = med[:, 0]
+    return codes, stats
+
+
+def attach(df, codes, stats, columns, min_n=None, count="n", how="inner"):
+    """Spielt Gruppenspalten per Code auf die Zeilen zurück (ohne merge).
+    how="inner": nur Zeilen mit Gruppe (und count >= min_n);
+    how="left": alle Zeilen, ohne Gruppe NaN."""
+    keep = codes >= 0
+    if min_n is not None:
+        keep &= stats[count].to_numpy()[np.maximum(codes, 0)] >= min_n
+    if how == "left":
+        out = df.copy()
+        for col in columns:
+            vals = stats[col].to_numpy(dtype=np.float64, na_value=np.nan)[np.maximum(codes, 0)]
+            out[col] = np.where(keep, vals, np.nan)
+        return out
+    out = df[keep].copy()
+    idx = codes[keep]
+    for col in columns:
+        out[col] = stats[col].to_numpy()[idx]
+    return out
+
+
+def group_cube(df, levels, value="price", quantiles=(("median_price", 0.5), ("q25", 0.25), ("q75", 0.75)),
+               medians=(("median_km", "km"),), count="n"):
+    """Statistik für mehrere Gruppierungsstufen (levels: feinste zuerst, jede
+    eine Teilmenge der ersten) in einem Durchgang. Die Zeilen werden nur einmal
+    nach der feinsten Stufe faktorisiert (NaN als eigener Wert); gröbere Stufen
+    entstehen auf deren Schlüsseln, dann laufen alle Stufen gestapelt durch
+    eine Sortierung.
+
+    Rückgabe: codes (Zeilen x Stufen, globale Codes, -1 = NaN im Schlüssel der
+    Stufe) und stats (alle Gruppen aller Stufen, Index = globaler Code,
+    Spalte level, nicht benutzte Schlüsselspalten NaN). Stufe 0 hat dieselben
+    Gruppen in derselben Reihenfolge wie group_stats(df, levels[0])."""
+    base, base_keys = group_codes(df, levels[0], dropna=False)
+    codes, keys, offset = [], [], 0
+    for level, cols in enumerate(levels):
+        parent, lkeys = group_codes(base_keys, cols)
+        lcodes = parent[base]
+        codes.append(np.where(lcodes >= 0, lcodes + offset, -1))
+        keys.append(lkeys.assign(level=level))
+        offset += len(lkeys)
+    codes = np.stack(codes, axis=1)
+
+    stats = pd.concat(keys, ignore_index=True)
+    flat = codes.T.ravel()
+    n_rows, n_levels = codes.shape
+
+    def stacked(col):
+        # Wertreihenfolge ist in jeder Stufe gleich: einmal sortieren, für
+        # die gestapelten Kopien nur verschieben
+        vals = df[col].to_numpy(dtype=np.float64, na_value=np.nan)
+        order = np.argsort(vals, kind="stable")
+        return np.tile(vals, n_levels), (order + n_rows * np.arange(n_levels)[:, None]).ravel()
+
+    vals, order = stacked(value)
+    counts, qv = grouped_quantiles(flat, vals, offset, [q for _, q in quantiles], order=order)
+    stats[count] = counts
+    for j, (name, _) in enumerate(quantiles):
+        stats[name] = qv[:, j]
+    for name, col in medians:
+        vals, order = stacked(col)
+        _, med = grouped_quantiles(flat, vals, offset, [0.5], order=order)
+        stats[name] = med[:, 0]
+    return codes, stats
+
+
+def backoff(codes, stats, min_n, count="n"):
+    """Je Zeile der globale Code der feinsten Stufe mit count >= min_n (-1,
+    wenn keine reicht): ein Array-Lookup pro Stufe."""
+    n = stats[count].to_numpy()
+    ok = (codes >= 0) & (n[np.maximum(codes, 0)] >= min_n)
+    chosen = codes[np.arange(len(codes)), ok.argmax(axis=1)]
+    return np.where(ok.any(axis=1), chosen, -1)
@@ -0,0 +1,212 @@
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import inspect, text
+
+from features import FEATURE_BITS
+from storage import get_engine, sqlite_url
+from group_stats import group_codes
+
+# Hedonisches Preismodell je Modellfamilie (brand/model): Ridge-Regression
+#   log(price) ~ 1 + Alter + km + PS + Feature-Bits
+# Alle Familien werden gemeinsam gelöst: Zeilen nach Familie sortieren,
+# X'X und X'y je Familie mit gestapelten matmul-Blöcken bilden (siehe
+# _normal_equations) und die (F, p, p)-Systeme mit einem np.linalg.solve lösen. Die Koeffizienten
+# liegen in price_models (migrations.m010); ein Auto bewerten ist dann ein
+# Skalarprodukt: fair_price = exp(x · coef).
+#
+#   python hedonic.py          # fitten und speichern
+
+FAMILY_COLUMNS = ["brand", "model"]
+FEATURE_ORDER = sorted(FEATURE_BITS, key=FEATURE_BITS.get)
+COLUMNS = ["const", "age", "km_100k", "ps_100"] + [f"f_{name}" for name in FEATURE_ORDER]
+RIDGE_LAMBDA = 1.0      # Schrumpfung Richtung Familienmittel (Achsenabschnitt frei)
+MIN_FAMILY_N = 10
+CHUNK_ROWS = 65536    # aufgefüllte Zeilen je matmul-Block
+
+
+def design_matrix(df, ref_year, ps_fill=None):
+    """Merkmalsmatrix (N, p) in der Reihenfolge COLUMNS. Fehlende PS werden
+    mit ps_fill (in Einheiten von ps_100, z.B. Familienmittel) ersetzt,
+    fehlende Features zählen als nicht vorhanden."""
+    n = len(df)
+    X = np.empty((n, len(COLUMNS)))
+    X[:, 0] = 1.0
+    X[:, 1] = ref_year - pd.to_numeric(df["year"], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+    X[:, 2] = pd.to_numeric(df["km"], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan) / 1e5
+    ps = pd.to_numeric(df["power_ps"], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan) / 100
+    if ps_fill is not None:
+        ps = np.where(np.isnan(ps), ps_fill, ps)
+    X[:, 3] = ps
+    if "features_mask" in df.columns:
+        mask = pd.to_numeric(df["features_mask"], errors="coerce").fillna(0).to_numpy(dtype=np.int64)
+    else:
+        mask = np.zeros(n, dtype=np.int64)
+    for j, name in enumerate(FEATURE_ORDER):
+        X[:, 4 + j] = (mask >> FEATURE_BITS[name]) & 1
+    return X
+
+
+def _normal_equations(codes, X, y, n_families):
+    """X'X (F, p, p) und X'y (F, p) je Familie; codes sortiert. Familien
+    ähnlicher Größe (Zweierpotenzen) werden mit Nullzeilen auf gleiche Länge
+    gebracht und mit einem gestapelten matmul multipliziert: eine Runde je
+    Größenklasse statt je Familie, gerechnet in BLAS."""
+    p = X.shape[1]
+    counts = np.bincount(codes, minlength=n_families)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    # [X | y] plus eine Nullzeile als Füllung
+    Xy = np.vstack([np.hstack([X, y[:, None]]), np.zeros((1, p + 1))])
+    xtx = np.zeros((n_families, p, p))
+    xty = np.zeros((n_families, p))
+    size_class = np.ceil(np.log2(np.maximum(counts, 1))).astype(np.int64)
+    for cls in np.unique(size_class[counts > 0]):
+        length = 1 << int(cls)
+        fams = np.flatnonzero((size_class == cls) & (counts > 0))
+        # Blöcke von höchstens ~CHUNK_ROWS aufgefüllten Zeilen
+        for part in np.array_split(fams, -(-len(fams) * length // CHUNK_ROWS)):
+            pos = np.arange(length)
+            idx = np.where(pos < counts[part][:, None], starts[part][:, None] + pos, len(X))
+            block = Xy[idx]
+            gram = np.matmul(block[:, :, :p].transpose(0, 2, 1), block)
+            xtx[part] = gram[:, :, :p]
+            xty[part] = gram[:, :, p]
+    return xtx, xty
+
+
+def fit(df, ref_year=None, lam=RIDGE_LAMBDA, min_n=MIN_FAMILY_N):
+    """Koeffizienten je Familie mit mindestens min_n Zeilen als DataFrame
+    (brand, model, n, rmse, ps_mean, ref_year, coef)."""
+    ref_year = ref_year or datetime.now().year
+    codes, keys = group_codes(df, FAMILY_COLUMNS)
+    price = pd.to_numeric(df["price"], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+    X = design_matrix(df, ref_year)
+    ok = (codes >= 0) & (price > 0) & ~np.isnan(X[:, 1]) & ~np.isnan(X[:, 2])
+    n_families = len(keys)
+
+    # PS-Lücken mit dem Familienmittel füllen (gespeichert fürs Scoring)
+    has_ps = ok & ~np.isnan(X[:, 3])
+    ps_sum = np.bincount(codes[has_ps], weights=X[has_ps, 3], minlength=n_families)
+    ps_n = np.bincount(codes[has_ps], minlength=n_families)
+    ps_mean = np.divide(ps_sum, ps_n, out=np.full(n_families, np.nan), where=ps_n > 0)
+    X[:, 3] = np.where(np.isnan(X[:, 3]), ps_mean[np.maximum(codes, 0)], X[:, 3])
+    ok &= ~np.isnan(X[:, 3])
+
+    order = np.flatnonzero(ok)
+    order = order[np.argsort(codes[order], kind="stable")]
+    c, X, y = codes[order], X[order], np.log(price[order])
+    counts = np.bincount(c, minlength=n_families)
+
+    xtx, xty = _normal_equations(c, X, y, n_families)
+    penalty = lam * np.eye(X.shape[1])
+    penalty[0, 0] = 0.0
+    fitted = counts >= min_n
+    coef = np.linalg.solve(xtx[fitted] + penalty, xty[fitted][:, :, None])[:, :, 0]
+
+    full = np.full((n_families, X.shape[1]), np.nan)
+    full[fitted] = coef
+    resid = y - np.einsum("ij,ij->i", X, full[c])
+    sse = np.bincount(c, weights=np.nan_to_num(resid) ** 2, minlength=n_families)
+
+    models = keys[fitted].reset_index(drop=True)
+    models["n"] = counts[fitted]
+    models["rmse"] = np.sqrt(sse[fitted] / counts[fitted])
+    models["ps_mean"] = ps_mean[fitted]
+    models["ref_year"] = ref_year
+    models["coef"] = list(coef)
+    return models
+
+
+def predict(df, models):
+    """Fairer Preis je Zeile (NaN ohne Modell für die Familie)."""
+    if models.empty:
+        return pd.Series(np.nan, index=df.index)
+    found = df[FAMILY_COLUMNS].astype(object).merge(
+        models[FAMILY_COLUMNS].astype(object).assign(_m=np.arange(len(models))),
+        on=FAMILY_COLUMNS, how="left",
+    )["_m"].to_numpy()
+    has = ~np.isnan(found)
+    idx = np.where(has, found, 0).astype(np.int64)
+    X = design_matrix(df, int(models["ref_year"].iloc[0]), ps_fill=models["ps_mean"].to_numpy()[idx])
+    coef = np.stack(models["coef"].to_numpy())
+    log_price = np.einsum("ij,ij->i", X, coef[idx])
+    return pd.Series(np.where(has, np.exp(log_price), np.nan), index=df.index)
+
+
+def fair_price(car, model):
+    """Ein Auto (dict mit year, km, power_ps, features_mask) gegen eine Zeile
+    aus load(): ein Skalarprodukt, z.B. direkt beim Einfügen."""
+    x = design_matrix(pd.DataFrame([car]), model["ref_year"], ps_fill=model["ps_mean"])[0]
+    if np.isnan(x).any():
+        return None
+    return float(np.exp(x @ np.asarray(model["coef"])))
+
+
+def summary(models):
+    """Lesbare Effekte je Familie: Preisänderung in % pro Jahr Alter, pro
+    100.000 km und pro 100 PS."""
+    if models.empty:
+        return pd.DataFrame()
+    coef = np.stack(models["coef"].to_numpy())
+    out = models[FAMILY_COLUMNS + ["n", "rmse"]].copy()
+    for name, col in [("pct_per_year", "age"), ("pct_per_100k_km", "km_100k"), ("pct_per_100_ps", "ps_100")]:
+        out[name] = np.expm1(coef[:, COLUMNS.index(col)]) * 100
+    return out.sort_values("n", ascending=False)
+
+
+def save(engine, models):
+    """Ersetzt price_models durch die neu gefitteten Familien."""
+    now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    rows = [
+        {"brand": str(r["brand"]), "model": str(r["model"]), "n": int(r["n"]), "rmse": float(r["rmse"]),
+         "ps_mean": None if np.isnan(r["ps_mean"]) else float(r["ps_mean"]), "ref_year": int(r["ref_year"]),
+         "columns": json.dumps(COLUMNS), "coef": json.dumps([round(float(v), 8) for v in r["coef"]]), "t": now}
+        for r in models.to_dict("records")
+    ]
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM price_models"))
+        if rows:
+            conn.execute(text(
+                "INSERT INTO price_models (brand, model, n, rmse, ps_mean, ref_year, columns, coef, fitted_at) "
+                "VALUES (:brand, :model, :n, :rmse, :ps_mean, :ref_year, :columns, :coef, :t)"
+            ), rows)
+    return len(rows)
+
+
+def load(engine):
+    """Gespeicherte Modelle (nur mit der aktuellen Spaltenreihenfolge)."""
+    models = pd.read_sql_query(
+        text("SELECT brand, model, n, rmse, ps_mean, ref_year, columns, coef FROM price_models"), engine
+    )
+    models = models[models["columns"] == json.dumps(COLUMNS)].reset_index(drop=True)
+    models["coef"] = [np.asarray(json.loads(c)) for c in models["coef"]]
+    models["ps_mean"] = models["ps_mean"].astype(float)
+    return models.drop(columns="columns")
+
+
+def available(engine):
+    return inspect(engine).has_table("price_models")
+
+
+if __name__ == "__main__":
+    from market_analysis import DB_PATH, load_analysis_frame
+
+    ap = argparse.ArgumentParser(description="Preismodell je Modellfamilie fitten")
+    ap.add_argument("db", nargs="?", default=DB_PATH)
+    args = ap.parse_args()
+
+    df = load_analysis_frame(args.db)
+    df = df[df["active"] == 1] if "active" in df.columns else df
+    t0 = time.perf_counter()
+    models = fit(df)
+    print(f"{len(models)} Familien gefittet ({time.perf_counter() - t0:.2f}s), "
+          f"Median-RMSE (log) {models['rmse'].median():.3f}")
+    engine = get_engine(sqlite_url(args.db))
+    if not available(engine):
+        sys.exit("price_models fehlt (python migrations.py ausführen?)")
+    print(f"{save(engine, models)} Modelle gespeichert")
@@ -1,27 +1,12 @@
 # init_db.py
-from sqlalchemy import create_engine, text
 from config import DATABASE_URL
+from storage import get_engine
+from migrations import migrate
 
 def init_db():
-    engine = create_engine(DATABASE_URL, future=True)
-    with engine.begin() as conn:
-        conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS cars (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            platform TEXT,
-            external_id TEXT,
-            title TEXT,
-            brand TEXT,
-            model TEXT,
-            year INTEGER,
-            km INTEGER,
-            price INTEGER,
-            location TEXT,
-            url TEXT UNIQUE,
-            first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        """))
+    # Schema kommt komplett aus migrations.py
+    engine = get_engine(DATABASE_URL)
+    migrate(engine)
     return engine
 
 if __name__ == "__main__":
@@ -0,0 +1,347 @@
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import unicodedata
+
+# Marken/Modelle mit Willhaben-IDs aus den Such-Navigatoren (CAR_MODEL/MAKE,
+# CAR_MODEL/MODEL), als JSON-Datei gecacht. Daraus werden Präfix-Tries über
+# normalisierte Namen gebaut: resolve("Mercedes-Benz C 220 d") läuft einmal
+# über den Titel statt title.split()[0:2] zu raten.
+#
+#   python make_model_catalog.py refresh   # Katalog neu laden
+#   python make_model_catalog.py resolve   # brand/model aller cars neu setzen
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CATALOG_PATH = os.environ.get("MAKE_MODEL_CATALOG", os.path.join(BASE_DIR, "make_model_catalog.json"))
+CATALOG_TTL_HOURS = float(os.environ.get("MAKE_MODEL_TTL_HOURS", str(7 * 24)))
+CATALOG_URL = "https://www.willhaben.at/iad/gebrauchtwagen/auto/gebrauchtwagenboerse?isNavigation=true&CAR_TYPE=6&rows=5"
+
+MAKE_PARAM = "CAR_MODEL/MAKE"
+MODEL_PARAM = "CAR_MODEL/MODEL"
+
+# Schreibweisen in Titeln -> Markenname im Katalog
+BRAND_ALIASES = {
+    "VW": ["volkswagen", "vw"],
+    "Mercedes-Benz": ["mercedes", "mercedes benz", "mb", "daimler benz"],
+    "Alfa Romeo": ["alfa"],
+    "Land Rover": ["landrover"],
+    "Rolls-Royce": ["rolls royce"],
+    "Aston Martin": ["aston"],
+}
+
+# Modellkürzel in Titeln -> Modellname im Katalog (nur wenn es ihn dort gibt)
+MODEL_ALIASES = {
+    "Mercedes-Benz": {f"{c}-Klasse": [c.lower(), f"{c.lower()} klasse"] for c in "ABCEGSVX"},
+    "BMW": {f"{n}er-Reihe": [f"{n}er", f"{n}er reihe"] for n in "12345678"},
+}
+# Typbezeichnung statt Modell, z.B. "BMW 320d" -> 3er-Reihe
+MODEL_PATTERNS = {
+    "BMW": [(re.compile(r"^([1-8])\d\d[a-z]{0,2}$"), "{0}er-Reihe")],
+    "Mercedes-Benz": [(re.compile(r"^([abcegsv])\d{3}[a-z]{0,2}$"), "{0}-Klasse")],
+}
+
+END = "\0"
+
+
+def normalize(text):
+    """Kleinbuchstaben, Akzente weg (Škoda -> skoda), ß -> ss."""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return text.lower().replace("ß", "ss")
+
+
+def tokens(text):
+    """Wörter des Originaltexts + normalisierter, trennerfreier String mit den
+    Wortgrenzen darin: "VW Golf-Plus" -> ["VW", "Golf", "Plus"], "vwgolfplus", {2, 6, 10}."""
+    words = re.findall(r"[^\W_]+", text or "")
+    norm, ends, starts = [], set(), []
+    pos = 0
+    for w in words:
+        starts.append(pos)
+        n = normalize(w)
+        norm.append(n)
+        pos += len(n)
+        ends.add(pos)
+    return words, "".join(norm), starts, ends
+
+
+class Trie:
+    def __init__(self):
+        self.root = {}
+
+    def add(self, name, value):
+        _, key, _, _ = tokens(name)
+        if not key:
+            return
+        node = self.root
+        for c in key:
+            node = node.setdefault(c, {})
+        node.setdefault(END, value)
+
+    def longest(self, s, start, ends):
+        """Längster Eintrag ab s[start], der auf einer Wortgrenze endet -> (value, end)."""
+        node, best = self.root, (None, start)
+        for i in range(start, len(s)):
+            node = node.get(s[i])
+            if node is None:
+                break
+            if END in node and i + 1 in ends:
+                best = (node[END], i + 1)
+        return best
+
+
+class Catalog:
+    def __init__(self, data=None):
+        self.data = data or {"fetched_at": 0, "makes": []}
+        self.brands = Trie()
+        self.models = {}
+        self.make_names = {}
+        self.model_names = {}
+        self.pairs = set()
+
+        for make in self.data.get("makes") or []:
+            name = make["name"]
+            self.make_names[make["id"]] = name
+            self.brands.add(name, name)
+            trie = self.models.setdefault(name, Trie())
+            for model in make.get("models") or []:
+                self.model_names[model["id"]] = model["name"]
+                self.pairs.add((name, model["name"]))
+                trie.add(model["name"], model["name"])
+            for target, aliases in MODEL_ALIASES.get(name, {}).items():
+                if (name, target) in self.pairs:
+                    for alias in aliases:
+                        trie.add(alias, target)
+
+        # ohne Katalog wenigstens die Marken, für die es Modell-Aliase/-Muster
+        # gibt: "BMW 320d" -> BMW/3er-Reihe statt erstes/zweites Wort
+        if not self.make_names:
+            for name in sorted(set(MODEL_ALIASES) | set(MODEL_PATTERNS)):
+                self.brands.add(name, name)
+                trie = self.models.setdefault(name, Trie())
+                for target, aliases in MODEL_ALIASES.get(name, {}).items():
+                    for alias in aliases:
+                        trie.add(alias, target)
+
+        # Aliase auch ohne Katalog, dann mit dem Namen aus BRAND_ALIASES
+        for target, aliases in BRAND_ALIASES.items():
+            if self.make_names and target not in self.models:
+                continue
+            self.brands.add(target, target)
+            for alias in aliases:
+                self.brands.add(alias, target)
+
+    @property
+    def fetched_at(self):
+        return self.data.get("fetched_at") or 0
+
+    def is_stale(self, ttl_hours=CATALOG_TTL_HOURS):
+        return time.time() - self.fetched_at > ttl_hours * 3600
+
+    def _match(self, title, max_skip):
+        words, s, starts, ends = tokens(title)
+        for start in starts[:max_skip + 1]:
+            brand, end = self.brands.longest(s, start, ends)
+            if brand:
+                break
+        else:
+            return None, None, None
+
+        model = None
+        trie = self.models.get(brand)
+        if trie is not None:
+            model, _ = trie.longest(s, end, ends)
+        after = [w for w, st in zip(words, starts) if st >= end]
+        if model is None and after:
+            for pattern, target in MODEL_PATTERNS.get(brand, []):
+                m = pattern.match(normalize(after[0]))
+                name = m and target.format(m.group(1).upper())
+                if name and (not self.pairs or (brand, name) in self.pairs):
+                    model = name
+                    break
+        return brand, model, after
+
+    def resolve(self, title, max_skip=2):
+        """(brand, model) aus dem Titel; None, wo nichts passt. Die Marke darf
+        nach bis zu max_skip Wörtern stehen ("Neuer VW Golf ...")."""
+        brand, model, _ = self._match(title, max_skip)
+        return brand, model
+
+    def split_title(self, title):
+        """Wie resolve, aber mit dem alten Verhalten als Fallback: unbekannte
+        Marke = erstes Wort, unbekanntes Modell = erstes Wort nach der Marke."""
+        brand, model, after = self._match(title, 2)
+        if brand is None:
+            parts = (title or "").split()
+            return (parts[0] if parts else None), (parts[1] if len(parts) > 1 else None)
+        if model is None and after:
+            model = after[0]
+        return brand, model
+
+    def is_canonical(self, brand, model):
+        return (brand, model) in self.pairs
+
+
+_catalog = None
+_last_attempt = 0.0
+# nach einem fehlgeschlagenen Laden nicht bei jedem Lauf erneut versuchen
+RETRY_AFTER_S = 3600
+
+
+def load(path=CATALOG_PATH):
+    if not os.path.exists(path):
+        return Catalog()
+    with open(path, "r", encoding="utf-8") as f:
+        return Catalog(json.load(f))
+
+
+def get_catalog():
+    global _catalog
+    if _catalog is None:
+        _catalog = load()
+    return _catalog
+
+
+def save(data, path=CATALOG_PATH):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def navigator_values(page_props, param):
+    """(id, label) aller Navigator-Werte, deren URL-Parameter `param` ist."""
+    out = {}
+
+    def walk(obj):
+        if isinstance(obj, dict):
+            reps = obj.get("urlParamRepresentationForValue")
+            label = obj.get("label")
+            if isinstance(reps, list) and isinstance(label, str):
+                for r in reps:
+                    if isinstance(r, dict) and r.get("urlParameterName") == param and str(r.get("value", "")).isdigit():
+                        out[int(r["value"])] = label
+            for v in obj.values():
+                walk(v)
+        elif isinstance(obj, list):
+            for v in obj:
+                walk(v)
+
+    walk(page_props)
+    return sorted(out.items())
+
+
+async def fetch(fetcher, log=print):
+    """Marken von der Suchseite, dann pro Marke die Modelle (parallel)."""
+    props = await fetcher.fetch_page_props(CATALOG_URL)
+    makes = navigator_values(props, MAKE_PARAM)
+    if not makes:
+        raise RuntimeError("Keine Marken im Navigator gefunden")
+
+    async def models_for(make_id):
+        try:
+            p = await fetcher.fetch_page_props(f"{CATALOG_URL}&{MAKE_PARAM}={make_id}")
+        except Exception as e:
+            log(f"Modelle für Marke {make_id} nicht geladen: {e}")
+            return []
+        return navigator_values(p, MODEL_PARAM)
+
+    models = await asyncio.gather(*(models_for(i) for i, _ in makes))
+    return {
+        "fetched_at": time.time(),
+        "makes": [
+            {"id": i, "name": name, "models": [{"id": mi, "name": mn} for mi, mn in ms]}
+            for (i, name), ms in zip(makes, models)
+        ],
+    }
+
+
+def refresh(force=False, log=print):
+    """Lädt den Katalog neu, wenn er älter als die TTL ist. Bei Fehlern bleibt
+    der alte Stand (auch abgelaufen) in Gebrauch."""
+    global _catalog, _last_attempt
+    cat = get_catalog()
+    if not force and (not cat.is_stale() or time.time() - _last_attempt < RETRY_AFTER_S):
+        return cat
+    _last_attempt = time.time()
+
+    from scrapers.http_fetch import HttpFetcher
+
+    fetcher = HttpFetcher()
+    try:
+        data = asyncio.run(fetch(fetcher, log))
+    except Exception as e:
+        log(f"Make/Model-Katalog nicht aktualisiert: {e}")
+        if not cat.make_names:
+            log("Kein Make/Model-Katalog: Marke/Modell nur über eingebaute Aliase, sonst erste Titelwörter")
+        return cat
+    finally:
+        fetcher.close()
+
+    save(data)
+    _catalog = Catalog(data)
+    n_models = sum(len(m["models"]) for m in data["makes"])
+    log(f"Make/Model-Katalog: {len(data['makes'])} Marken, {n_models} Modelle")
+    return _catalog
+
+
+def resolve_all(engine=None, chunk_size=50_000, log=print):
+    """Setzt brand/model aller cars neu aus dem Titel. Zeilen, deren Paar schon
+    im Katalog steht (z.B. aus *_RESOLVED der JSON-Daten), bleiben unverändert."""
+    from sqlalchemy import text
+
+    if engine is None:
+        from db import engine
+
+    cat = get_catalog()
+    if not cat.make_names:
+        log(f"Make/Model-Katalog leer ({CATALOG_PATH} fehlt oder refresh fehlgeschlagen): "
+            f"nur eingebaute Aliase für {', '.join(sorted(set(BRAND_ALIASES) | set(MODEL_ALIASES) | set(MODEL_PATTERNS)))}, "
+            f"andere Marken bleiben unverändert")
+    t0 = time.perf_counter()
+    scanned = changed = 0
+    last_id = 0
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(
+                text("SELECT id, title, brand, model FROM cars WHERE id > :last_id ORDER BY id LIMIT :n"),
+                {"last_id": last_id, "n": chunk_size},
+            ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        updates = []
+        for car_id, title, brand, model in rows:
+            if not title or cat.is_canonical(brand, model):
+                continue
+            new_brand, _ = cat.resolve(title)
+            if new_brand is None:
+                continue
+            new_brand, new_model = cat.split_title(title)
+            if (new_brand, new_model) != (brand, model):
+                updates.append({"brand": new_brand, "model": new_model, "id": car_id})
+        if updates:
+            with engine.begin() as conn:
+                conn.execute(text("UPDATE cars SET brand=:brand, model=:model WHERE id=:id"), updates)
+
+        scanned += len(rows)
+        changed += len(updates)
+        log(f"{scanned} Zeilen geprüft, {changed} geändert ({time.perf_counter() - t0:.1f}s)")
+
+    return {"rows": scanned, "changed": changed, "seconds": time.perf_counter() - t0}
+
+
+if __name__ == "__main__":
+    cmd = sys.argv[1] if len(sys.argv) > 1 else ""
+    if cmd == "refresh":
+        refresh(force=True)
+    elif cmd == "resolve":
+        refresh()
+        res = resolve_all()
+        print(f"Fertig: {res['rows']} Zeilen, {res['changed']} geändert in {res['seconds']:.1f}s")
+    else:
+        print("Verwendung: python make_model_catalog.py refresh|resolve")
@@ -1,53 +1,240 @@
-import sqlite3
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import os
 
+from pandas.api.types import union_categoricals
+from sqlalchemy import bindparam, inspect, text
+
+from features import features_to_mask, mask_to_features
+from storage import get_engine, sqlite_url
+import snapshot
+import hedonic
+from group_stats import group_codes, group_stats, group_cube, backoff, attach
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, "auto_deal.db")
 OUT_DIR = "exports"
 
+# Features, die den Preis innerhalb einer Vergleichsgruppe spürbar verschieben.
+# Für den feature-bereinigten Vergleich wird zusätzlich nach dieser Kombination
+# gruppiert (features_mask & KEY_FEATURE_MASK), ohne JSON zu parsen.
+KEY_FEATURES = ["allrad", "led", "navi", "acc", "sportpaket", "anhängerkupplung"]
+KEY_FEATURE_MASK = features_to_mask(KEY_FEATURES)
+MIN_GROUP_N = 8
+MIN_FEATURE_GROUP_N = 5
+# Hat die volle Vergleichsgruppe weniger als MIN_GROUP_N Inserate, wird gegen
+# die erste dieser gröberen Stufen mit genug Daten verglichen
+BACKOFF_LEVELS = [
+    ["brand", "model", "year_bucket", "ps_bucket", "fuel_type"],
+    ["brand", "model", "year_bucket", "fuel_type"],
+    ["brand", "model", "year_bucket"],
+]
+STAT_COLUMNS = ["n", "median_price", "q25", "q75", "median_km"]
+
+# Realistische Werte; dieselben Grenzen gehen als WHERE in die DB bzw. als
+# Arrow-Filter in den Snapshot (analysis_filters)
+PRICE_MIN, PRICE_MAX = 500, 200000  # exklusiv
+KM_MAX = 600000
+YEAR_MIN = 1990
+MAX_AGE_DAYS = 30       # Sicherheitsnetz für Inserate, deren Suche nicht mehr läuft (nie delisted)
+DOM_WINDOW_DAYS = 180   # verschwundene Inserate für die Standzeit-Auswertung
+LOAD_CHUNK_ROWS = 50000
+
+# Nur diese Spalten werden geladen (kein description/features_raw/...);
+# url und title holt main() nachträglich für die exportierten Deals.
+ANALYSIS_COLUMNS = {
+    "id": "int64",
+    "brand": "category",
+    "model": "category",
+    "year": "int16",
+    "km": "int32",
+    "price": "int32",
+    "power_ps": "float32",
+    "fuel_type": "category",
+    "transmission": "category",
+    "drive": "category",
+    "features_mask": "Int64",
+    "active": "int8",
+    "first_seen": "datetime",
+    "last_seen": "datetime",
+    "delisted_at": "datetime",
+}
+
 def load_cars(db_path: str) -> pd.DataFrame:
-    con = sqlite3.connect(db_path)
-    df = pd.read_sql_query("SELECT * FROM cars", con)
-    con.close()
+    # nur lesend und über WAL: blockiert einen laufenden Scraper nicht
+    engine = get_engine(sqlite_url(db_path), readonly=True)
+    return pd.read_sql_query("SELECT * FROM cars", engine)
+
+def utc_text(value) -> str:
+    """datetime (naiv = lokale Zeit) oder Text -> UTC-Text wie in der DB."""
+    if isinstance(value, str):
+        return value
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+def analysis_filters(columns, min_last_seen=None, now=None) -> list:
+    """Zeilenfilter der Analyse als UND-Liste von ODER-Gruppen
+    [(spalte, op, wert), ...]. min_last_seen ersetzt die 30-Tage-Grenze
+    (z.B. nur Inserate des aktuellen Laufs)."""
+    now = now or datetime.now(timezone.utc)
+    filters = [
+        [("price", ">", PRICE_MIN)], [("price", "<", PRICE_MAX)],
+        [("km", ">=", 0)], [("km", "<", KM_MAX)],
+        [("year", ">=", YEAR_MIN)], [("year", "<=", datetime.now().year + 1)],
+        [("brand", "not null", None)], [("model", "not null", None)],
+    ]
+    # verschwundene Inserate bleiben für die Standzeit drin
+    gone = []
+    if "delisted_at" in columns:
+        gone = [("delisted_at", ">=", utc_text(now - timedelta(days=DOM_WINDOW_DAYS)))]
+    if "active" in columns:
+        # Lebenszyklus: aktiv per Index (idx_cars_active_last_seen) oder kürzlich
+        # verschwunden (idx_cars_delisted_at)
+        filters.append([("active", "=", 1)] + gone)
+    if "last_seen" in columns:
+        if min_last_seen is not None:
+            recent = [("last_seen", ">=", utc_text(min_last_seen))]
+        else:
+            # active wird nur nach vollständigen Läufen derselben Suche
+            # zurückgesetzt; Inserate aus Suchen, die nicht mehr laufen, blieben
+            # sonst für immer aktiv
+            recent = [("last_seen", ">=", utc_text(now - timedelta(days=MAX_AGE_DAYS))), ("last_seen", "is null", None)]
+        filters.append(recent + gone)
+    return filters
+
+def filter_sql(filters) -> tuple:
+    """analysis_filters -> (WHERE-Ausdruck, Parameter)."""
+    parts, params = [], {}
+    for i, group in enumerate(filters):
+        alt = []
+        for j, (col, op, value) in enumerate(group):
+            if op == "is null":
+                alt.append(f"{col} IS NULL")
+            elif op == "not null":
+                alt.append(f"{col} IS NOT NULL")
+            else:
+                alt.append(f"{col} {op} :f{i}_{j}")
+                params[f"f{i}_{j}"] = value
+        parts.append("(" + " OR ".join(alt) + ")")
+    return " AND ".join(parts) or "1=1", params
+
+def compact_types(df: pd.DataFrame) -> pd.DataFrame:
+    """Kompakte dtypes laut ANALYSIS_COLUMNS (int32/float32/category statt
+    object/float64). Setzt voraus, dass die Filter NULLs in den
+    Ganzzahl-Spalten ausgeschlossen haben."""
+    for col, typ in ANALYSIS_COLUMNS.items():
+        if col not in df.columns:
+            continue
+        if typ == "datetime":
+            df[col] = pd.to_datetime(df[col], format="ISO8601", errors="coerce")
+        elif typ == "category":
+            if not isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype("category")
+        else:
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype(typ)
     return df
 
-def to_num(series):
-    return pd.to_numeric(series, errors="coerce")
+def concat_chunks(chunks: list, columns: list) -> pd.DataFrame:
+    """Chunks aneinanderhängen; Kategorien werden vereinigt statt zu object
+    zurückzufallen."""
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    if len(chunks) == 1:
+        return chunks[0]
+    cats = [c for c in columns if isinstance(chunks[0][c].dtype, pd.CategoricalDtype)]
+    df = pd.concat([ch.drop(columns=cats) for ch in chunks], ignore_index=True)
+    for col in cats:
+        df[col] = union_categoricals([ch[col] for ch in chunks])
+    return df[columns]
 
-def main():
-    df = load_cars(DB_PATH)
+def load_filtered(engine, min_last_seen=None, chunk_rows=LOAD_CHUNK_ROWS) -> pd.DataFrame:
+    """Analyse-Zeilen direkt aus der DB: Filter als WHERE, nur die benötigten
+    Spalten, chunkweise mit kompakten dtypes. Speicher und Zeit hängen an den
+    gefilterten Zeilen, nicht an der Tabellengröße."""
+    existing = {c["name"] for c in inspect(engine).get_columns("cars")}
+    cols = [c for c in ANALYSIS_COLUMNS if c in existing]
+    where, params = filter_sql(analysis_filters(cols, min_last_seen))
+    sql = text(f"SELECT {', '.join(cols)} FROM cars WHERE {where}")
+    chunks = [
+        compact_types(chunk)
+        for chunk in pd.read_sql_query(sql, engine, params=params, chunksize=chunk_rows)
+    ]
+    return concat_chunks(chunks, cols)
 
-    if df.empty:
-        print("Keine Daten in cars.")
-        return
+def load_analysis_frame(db_path: str, min_last_seen=None) -> pd.DataFrame:
+    """Gefilterte Analyse-Spalten aus dem Snapshot (vorher inkrementell
+    nachgezogen); ohne pyarrow oder bei Fehlern direkt aus der DB."""
+    # nur lesend und über WAL: blockiert einen laufenden Scraper nicht
+    engine = get_engine(sqlite_url(db_path), readonly=True)
+    if snapshot.available():
+        try:
+            if not snapshot.is_current(engine):
+                snapshot.update(engine)
+            cols = [c for c in ANALYSIS_COLUMNS if c in snapshot.read_meta()["columns"]]
+            return compact_types(snapshot.load(columns=cols, filters=analysis_filters(cols, min_last_seen)))
+        except Exception as e:
+            print(f"Snapshot nicht nutzbar ({e}), lese aus der DB")
+    return load_filtered(engine, min_last_seen)
 
-    # Grundreinigung
-    for col in ["price", "km", "year", "power_ps"]:
-        if col in df.columns:
-            df[col] = to_num(df[col])
+def report_texts(db_path: str, ids) -> pd.DataFrame:
+    """url/title per Primärschlüssel, nur für die Zeilen, die exportiert werden."""
+    engine = get_engine(sqlite_url(db_path), readonly=True)
+    stmt = text("SELECT id, url, title FROM cars WHERE id IN :ids").bindparams(
+        bindparam("ids", expanding=True)
+    )
+    ids = [int(i) for i in ids]
+    frames = [
+        pd.read_sql_query(stmt, engine, params={"ids": ids[i:i + 900]})
+        for i in range(0, len(ids), 900)
+    ]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["id", "url", "title"])
 
-    # Nur brauchbare Zeilen für Preis-Analyse
-    need_cols = ["price", "year", "km", "brand", "model"]
-    for c in need_cols:
-        if c not in df.columns:
-            raise RuntimeError(f"Spalte fehlt in cars: {c}")
+def to_num(series):
+    return pd.to_numeric(series, errors="coerce")
 
-    df = df.dropna(subset=["price", "year", "km", "brand", "model"]).copy()
+def feature_premiums(df: pd.DataFrame, group_cols: list) -> pd.DataFrame:
+    """Pro Key-Feature: typischer Preisaufschlag innerhalb der Vergleichsgruppen
+    (Median mit / Median ohne Feature, gemittelt über Gruppen mit je >= 3 Inseraten)."""
+    known = df.dropna(subset=["features_mask"])
+    rows = []
+    for name in KEY_FEATURES:
+        has = (known["features_mask"] & features_to_mask([name])) != 0
+        med = known.groupby(group_cols + [has.rename("has")], observed=True)["price"].agg(["median", "count"]).reset_index()
+        med = med[med["count"] >= 3]
+        wide = med.pivot_table(index=group_cols, columns="has", values="median", observed=True)
+        if True not in wide.columns or False not in wide.columns:
+            continue
+        ratio = (wide[True] / wide[False]).dropna()
+        if ratio.empty:
+            continue
+        rows.append({"feature": name, "groups": len(ratio), "median_premium": ratio.median() - 1})
+    return pd.DataFrame(rows)
 
-    # Optional: nur realistische Werte
-    df = df[(df["price"] > 500) & (df["price"] < 200000)]
-    df = df[(df["km"] >= 0) & (df["km"] < 600000)]
-    df = df[(df["year"] >= 1990) & (df["year"] <= datetime.now().year + 1)]
+def days_on_market(df: pd.DataFrame) -> pd.Series:
+    """Tage von first_seen bis delisted_at, bei aktiven Inseraten bis jetzt (UTC)."""
+    first = pd.to_datetime(df["first_seen"], errors="coerce")
+    end = pd.Series(pd.Timestamp(datetime.utcnow()), index=df.index)
+    if "delisted_at" in df.columns:
+        end = pd.to_datetime(df["delisted_at"], errors="coerce").fillna(end)
+    return (end - first).dt.total_seconds() / 86400
 
-    # Optional: nur neuere Einträge (wenn last_seen existiert)
-    if "last_seen" in df.columns:
-        df["last_seen_dt"] = pd.to_datetime(df["last_seen"], errors="coerce")
-        # zB letzte 30 Tage, kannst du ändern
-        cutoff = datetime.now() - timedelta(days=30)
-        df = df[df["last_seen_dt"].isna() | (df["last_seen_dt"] >= cutoff)].copy()
+def market_time_summary(df: pd.DataFrame) -> pd.DataFrame:
+    """Pro Marke/Modell: wie schnell verschwinden Inserate (verkauft/offline)."""
+    gone = df[(df["active"] == 0) & df["days_on_market"].notna()]
+    if gone.empty:
+        return pd.DataFrame()
+    out = gone.groupby(["brand", "model"], observed=True).agg(
+        n_delisted=("days_on_market", "count"),
+        median_days_on_market=("days_on_market", "median"),
+        median_price=("price", "median"),
+    ).reset_index()
+    active = df[df["active"] == 1].groupby(["brand", "model"], observed=True).size().rename("n_active").reset_index()
+    out = out.merge(active, on=["brand", "model"], how="left")
+    return out[out["n_delisted"] >= 3].sort_values("median_days_on_market")
 
+def add_group_columns(df: pd.DataFrame) -> list:
+    """Bucket-Spalten anlegen; gibt die Gruppierungsspalten zurück (fehlende
+    optionale Spalten fallen weg)."""
     # Analyse-Gruppierung: so findest du faire Vergleichsgruppen
     # Transmission, fuel_type, drive, power_ps sind optional, wenn vorhanden.
     group_cols = ["brand", "model"]
@@ -65,25 +252,117 @@ def main():
     for optional in ["transmission", "fuel_type", "drive"]:
         if optional in df.columns:
             group_cols.append(optional)
+    return group_cols
 
-    # Marktstatistiken pro Gruppe
-    agg = df.groupby(group_cols).agg(
-        n=("price", "count"),
-        median_price=("price", "median"),
-        q25=("price", lambda s: s.quantile(0.25)),
-        q75=("price", lambda s: s.quantile(0.75)),
-        median_km=("km", "median"),
-    ).reset_index()
+def backoff_levels(group_cols: list) -> list:
+    """Volle Gruppierung plus die gröberen Stufen (nur vorhandene Spalten)."""
+    levels = [group_cols]
+    for cols in BACKOFF_LEVELS:
+        cols = [c for c in cols if c in group_cols]
+        if cols != levels[-1]:
+            levels.append(cols)
+    return levels
+
+def fill_level0(cube: pd.DataFrame, agg: pd.DataFrame, group_cols: list) -> pd.DataFrame:
+    """Stufe 0 des Cubes mit den Werten aus agg überschreiben, über die
+    Gruppenschlüssel gejoint (nicht über die Zeilenreihenfolge). Gruppen, die
+    agg nicht kennt, bekommen n = 0 und fallen damit beim Backoff durch."""
+    level0 = cube["level"] == 0
+    keys = cube.loc[level0, group_cols].astype(object)
+    found = keys.merge(agg[group_cols].astype(object).join(agg[STAT_COLUMNS]), on=group_cols,
+                       how="left", validate="one_to_one")
+    cube.loc[level0, "n"] = found["n"].fillna(0).to_numpy(dtype=np.int64)
+    for col in STAT_COLUMNS[1:]:
+        cube.loc[level0, col] = found[col].to_numpy(dtype=np.float64, na_value=np.nan)
+    return cube
+
+def main(min_last_seen=None):
+    """min_last_seen: nur Inserate, die seitdem gesehen wurden (datetime lokal
+    oder UTC-Text), statt der 30-Tage-Grenze."""
+    # Filter (Preis, km, Jahr, last_seen) laufen schon beim Laden
+    df = load_analysis_frame(DB_PATH, min_last_seen)
+
+    if df.empty:
+        print("Keine Daten in cars.")
+        return
+
+    # Grundreinigung
+    for col in ["price", "km", "year", "power_ps"]:
+        if col in df.columns:
+            df[col] = to_num(df[col])
+
+    # Nur brauchbare Zeilen für Preis-Analyse
+    need_cols = ["price", "year", "km", "brand", "model"]
+    for c in need_cols:
+        if c not in df.columns:
+            raise RuntimeError(f"Spalte fehlt in cars: {c}")
+
+    df = df.dropna(subset=["price", "year", "km", "brand", "model"]).copy()
+
+    # Lebenszyklus: verschwundene Inserate raus aus den Vergleichsmedianen,
+    # ihre Standzeit getrennt auswerten
+    market_time = pd.DataFrame()
+    if "first_seen" in df.columns:
+        df["days_on_market"] = days_on_market(df)
+    if "active" in df.columns:
+        market_time = market_time_summary(df)
+        df = df[df["active"] == 1].copy()
+
+    group_cols = add_group_columns(df)
+
+    # Marktstatistiken pro Gruppe (n, Median, Quartile, Median-km): aus dem
+    # inkrementell gepflegten market_stats-Store (O(Gruppen)), sonst in einem
+    # vektorisierten Durchgang über df, siehe group_stats.py
+    import market_stats  # importiert selbst market_analysis
+
+    engine = get_engine(sqlite_url(DB_PATH))
+    stored = None
+    if min_last_seen is None:
+        stored = market_stats.load_current(engine, group_cols)
+    if stored is not None:
+        codes, keys = group_codes(df, group_cols)
+        agg = market_stats.join_keys(keys, stored)
+    else:
+        codes, agg = group_stats(df, group_cols)
+
+    # Preismodell je Modellfamilie: berücksichtigt km/PS/Features und bewertet
+    # auch Autos ohne Vergleichsgruppe. Mit min_last_seen ist df nur ein
+    # Ausschnitt, dann gelten die zuletzt gespeicherten Koeffizienten.
+    if min_last_seen is not None and hedonic.available(engine):
+        models = hedonic.load(engine)
+    else:
+        models = hedonic.fit(df)
+        if hedonic.available(engine):
+            hedonic.save(engine, models)
+    df["fair_price"] = hedonic.predict(df, models)
 
-    # Nur Gruppen mit genug Daten, sonst wird Median wackelig
-    agg = agg[agg["n"] >= 8].copy()
+    # Alle Vergleichsstufen in einem Durchgang; Stufe 0 sind dieselben Gruppen
+    # wie agg (ggf. mit den Werten aus market_stats). Jede Zeile bekommt die
+    # feinste Stufe mit genug Daten, sonst wird der Median wackelig.
+    levels = backoff_levels(group_cols)
+    cube_codes, cube = group_cube(df, levels)
+    cube = fill_level0(cube, agg, group_cols)
+    cube["group_level"] = np.array(["/".join(cols) for cols in levels])[cube["level"].to_numpy()]
+    merged = attach(df, backoff(cube_codes, cube, MIN_GROUP_N), cube, STAT_COLUMNS + ["group_level"])
+    agg = agg[agg["n"] >= MIN_GROUP_N].copy()
 
-    # Daten zurück mergen
-    merged = df.merge(agg, on=group_cols, how="inner")
+    # Feature-bereinigt: gleiche Gruppe UND gleiche Kombination der Key-Features
+    feature_premium = pd.DataFrame()
+    if "features_mask" in merged.columns:
+        merged["features_mask"] = to_num(merged["features_mask"]).astype("Int64")
+        merged["feature_key"] = merged["features_mask"] & KEY_FEATURE_MASK
+        feat_cols = group_cols + ["feature_key"]
+        fcodes, agg_feat = group_stats(merged, feat_cols, quantiles=(("median_price_feat", 0.5),),
+                                       medians=(), count="n_feat")
+        merged = attach(merged, fcodes, agg_feat, ["n_feat", "median_price_feat"],
+                        min_n=MIN_FEATURE_GROUP_N, count="n_feat", how="left")
+        merged["deal_ratio_feat"] = merged["price"] / merged["median_price_feat"]
+        feature_premium = feature_premiums(merged, group_cols)
 
     # Deal Score
     merged["price_delta"] = merged["price"] - merged["median_price"]
     merged["deal_ratio"] = merged["price"] / merged["median_price"]
+    merged["deal_ratio_model"] = merged["price"] / merged["fair_price"]
 
     # optional: IQR-based "sehr günstig"
     merged["iqr"] = merged["q75"] - merged["q25"]
@@ -102,12 +381,25 @@ def main():
         "fuel_type", "transmission", "drive",
         "price",
         "median_price", "price_delta", "deal_ratio",
-        "n", "median_km",
+        "median_price_feat", "deal_ratio_feat", "n_feat",
+        "fair_price", "deal_ratio_model", "features",
+        "n", "group_level", "median_km", "days_on_market",
         "url", "title",
     ]
+    if "features_mask" in deals.columns:
+        deals["features"] = deals["features_mask"].map(
+            lambda m: ", ".join(mask_to_features(int(m))) if pd.notna(m) else ""
+        )
     cols = [c for c in cols if c in deals.columns]
 
     deals_report = deals[cols].copy()
+    # url/title nicht mitgeladen: nur für die exportierten Zeilen nachholen
+    top_deals = deals_report.head(200)
+    if "id" in deals.columns:
+        texts = report_texts(DB_PATH, deals["id"].head(200)).set_index("id")
+        ids = deals["id"].head(200).to_numpy()
+        top_deals = top_deals.assign(url=texts["url"].reindex(ids).to_numpy(),
+                                     title=texts["title"].reindex(ids).to_numpy())
     summary_report = agg.sort_values(["n", "median_price"], ascending=[False, True]).copy()
 
     # Ausgabe
@@ -117,8 +409,15 @@ def main():
     out_path = os.path.join(OUT_DIR, f"market_deals_{ts}.xlsx")
 
     with pd.ExcelWriter(out_path, engine="openpyxl") as writer:
-        deals_report.head(200).to_excel(writer, index=False, sheet_name="TopDeals")
+        top_deals.to_excel(writer, index=False, sheet_name="TopDeals")
         summary_report.to_excel(writer, index=False, sheet_name="MarketSummary")
+        if not feature_premium.empty:
+            feature_premium.to_excel(writer, index=False, sheet_name="FeaturePremium")
+        if not market_time.empty:
+            market_time.to_excel(writer, index=False, sheet_name="DaysOnMarket")
+        model_report = hedonic.summary(models)
+        if not model_report.empty:
+            model_report.to_excel(writer, index=False, sheet_name="PriceModels")
 
     print(f"Fertig. Export: {out_path}")
     print(f"Deals gefunden: {len(deals_report)}")
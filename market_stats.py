@@ -0,0 +1,385 @@
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, inspect, text
+
+from storage import get_engine, sqlite_url
+from group_stats import group_codes, grouped_quantiles
+from quantile_sketch import KLLSketch
+from snapshot import db_state
+from market_analysis import (
+    DB_PATH, MAX_AGE_DAYS, add_group_columns, analysis_filters, filter_sql, utc_text,
+)
+
+# Persistente Vergleichsgruppen der Marktanalyse (Tabelle market_stats, siehe
+# migrations.m009): je Gruppe n, Median/Quartile von price, Median von km und
+# je ein KLL-Sketch (quantile_sketch.py) für price und km.
+#
+# Population wie in market_analysis.main: Analysefilter (Preis, km, Jahr,
+# 30 Tage last_seen) und active = 1. market_stats_members merkt sich, mit
+# welchem Preis/km jedes Auto in welcher Gruppe steckt. update() liest nur
+# Zeilen seit dem Wasserstand (last_seen/delisted_at/neue id) plus die aus
+# dem 30-Tage-Fenster gefallenen, vergleicht sie mit members und
+#   - mergt neue Autos in den Sketch ihrer Gruppe,
+#   - baut Gruppen, aus denen etwas verschwindet (Preis geändert, inaktiv,
+#     Fenster), aus den members-Werten neu -- Sketches können nichts löschen.
+# Änderungen ohne last_seen-Update (features.py retag, make_model_catalog.py
+# resolve, reparse_archive.py mit altem seen_at) brauchen wie beim Snapshot
+# --full. Nur ein Schreiber gleichzeitig (Gruppen-ids werden hochgezählt).
+#
+#   python market_stats.py            # inkrementell
+#   python market_stats.py --full     # komplett neu
+#   python market_stats.py --check    # Store gegen exakte Neuberechnung prüfen
+
+KEY_COLUMNS = ["brand", "model", "year_bucket", "ps_bucket", "transmission", "fuel_type", "drive"]
+BUCKET_COLUMNS = ("year_bucket", "ps_bucket")
+STAT_COLUMNS = ["n", "median_price", "q25", "q75", "median_km"]
+PRICE_QUANTILES = (("median_price", 0.5), ("q25", 0.25), ("q75", 0.75))
+LOAD_COLUMNS = ["id", "brand", "model", "year", "power_ps", "transmission", "fuel_type", "drive", "price", "km"]
+
+
+def available(engine):
+    return inspect(engine).has_table("market_stats")
+
+
+def _normalize(keys):
+    """Schlüssel vergleichbar machen: Buckets als Int64, Text als object."""
+    out = pd.DataFrame(index=keys.index)
+    for col in KEY_COLUMNS:
+        if col in BUCKET_COLUMNS:
+            out[col] = pd.to_numeric(keys[col], errors="coerce").round().astype("Int64")
+        else:
+            out[col] = keys[col].astype(object)
+    return out
+
+
+def _group_keys(df):
+    """Gruppenschlüssel wie in market_analysis.add_group_columns plus Maske der
+    Zeilen mit vollständigem Schlüssel (groupby lässt die anderen weg)."""
+    work = df[["brand", "model", "year", "power_ps", "transmission", "fuel_type", "drive"]].copy()
+    for col in ("year", "power_ps"):
+        work[col] = pd.to_numeric(work[col], errors="coerce")
+    add_group_columns(work)
+    keys = _normalize(work[KEY_COLUMNS])
+    return keys, keys.notna().all(axis=1).to_numpy()
+
+
+def _population_sql(now):
+    where, params = filter_sql(analysis_filters(LOAD_COLUMNS + ["last_seen", "delisted_at"], now=now))
+    return f"{where} AND active = 1", params
+
+
+def _stats_from_sketches(price_sk, km_sk):
+    row = dict(zip([name for name, _ in PRICE_QUANTILES], price_sk.quantiles([q for _, q in PRICE_QUANTILES])))
+    row["n"] = price_sk.n
+    row["median_km"] = km_sk.quantiles([0.5])[0]
+    return row
+
+
+def _state(conn):
+    row = conn.execute(text(
+        "SELECT watermark, max_id, cutoff FROM market_stats_state WHERE id = 1"
+    )).mappings().first()
+    return dict(row) if row else None
+
+
+def _write_state(conn, watermark, max_id, cutoff, now, rebuilt=False):
+    params = {"w": watermark, "max_id": int(max_id), "cutoff": cutoff, "now": now}
+    if rebuilt:
+        conn.execute(text("DELETE FROM market_stats_state"))
+        conn.execute(text(
+            "INSERT INTO market_stats_state (id, watermark, max_id, cutoff, updated_at, rebuilt_at) "
+            "VALUES (1, :w, :max_id, :cutoff, :now, :now)"
+        ), params)
+    else:
+        conn.execute(text(
+            "UPDATE market_stats_state SET watermark = :w, max_id = :max_id, cutoff = :cutoff, "
+            "updated_at = :now WHERE id = 1"
+        ), params)
+
+
+def _in_chunks(conn, sql, name, values, fetch=True):
+    """Anweisung mit IN-Liste in Blöcken (SQLite-Parameterlimit); gibt die
+    Zeilen aller Blöcke zurück."""
+    stmt = text(sql).bindparams(bindparam(name, expanding=True))
+    values = [int(v) for v in values]
+    rows = []
+    for i in range(0, len(values), 900):
+        res = conn.execute(stmt, {name: values[i:i + 900]})
+        if fetch:
+            rows.extend(res.fetchall())
+    return rows
+
+
+def population(engine, now=None):
+    """Zeilen der Population mit Gruppenschlüssel (nur vollständige Schlüssel)."""
+    now = now or datetime.now(timezone.utc)
+    where, params = _population_sql(now)
+    df = pd.read_sql_query(text(f"SELECT {', '.join(LOAD_COLUMNS)} FROM cars WHERE {where}"), engine, params=params)
+    keys, ok = _group_keys(df)
+    return df[ok].reset_index(drop=True), keys[ok].reset_index(drop=True)
+
+
+def exact_stats(df, keys):
+    """Exakte Gruppenstatistik (wie market_analysis ohne Store) plus Codes."""
+    codes, stats = group_codes(keys, KEY_COLUMNS)
+    counts, pq = grouped_quantiles(codes, df["price"].to_numpy(dtype=np.float64), len(stats),
+                                   [q for _, q in PRICE_QUANTILES])
+    _, kq = grouped_quantiles(codes, df["km"].to_numpy(dtype=np.float64), len(stats), [0.5])
+    stats["n"] = counts
+    for j, (name, _) in enumerate(PRICE_QUANTILES):
+        stats[name] = pq[:, j]
+    stats["median_km"] = kq[:, 0]
+    return codes, stats
+
+
+def rebuild(engine, log=print):
+    """Store komplett aus cars neu aufbauen (exakte Quantile). Gibt die Zahl
+    der Gruppen zurück."""
+    t0 = time.perf_counter()
+    now = datetime.now(timezone.utc)
+    watermark, max_id = db_state(engine, ["last_seen", "delisted_at"])
+    df, keys = population(engine, now)
+    codes, stats = exact_stats(df, keys)
+
+    # Werte je Gruppe zusammenhängend für die Sketches
+    order = np.argsort(codes, kind="stable")
+    bounds = np.cumsum(stats["n"].to_numpy())[:-1]
+    prices = np.split(df["price"].to_numpy(dtype=np.float64)[order], bounds)
+    kms = np.split(df["km"].to_numpy(dtype=np.float64)[order], bounds)
+    ts = utc_text(now)
+    groups = [
+        {**{c: _py(row[c]) for c in KEY_COLUMNS + STAT_COLUMNS}, "id": gid + 1,
+         "ps": KLLSketch.from_values(p).to_bytes(), "ks": KLLSketch.from_values(k).to_bytes(), "t": ts}
+        for gid, (row, p, k) in enumerate(zip(stats.to_dict("records"), prices, kms))
+    ]
+    members = [
+        {"car_id": int(c), "gid": int(g) + 1, "price": float(p), "km": float(k)}
+        for c, g, p, k in zip(df["id"], codes, df["price"], df["km"])
+    ]
+    with engine.begin() as conn:
+        conn.execute(text("DELETE FROM market_stats_members"))
+        conn.execute(text("DELETE FROM market_stats"))
+        if groups:
+            conn.execute(_insert_group_sql(), groups)
+        if members:
+            conn.execute(text(
+                "INSERT INTO market_stats_members (car_id, group_id, price, km) VALUES (:car_id, :gid, :price, :km)"
+            ), members)
+        _write_state(conn, watermark, max_id, utc_text(now - timedelta(days=MAX_AGE_DAYS)), ts, rebuilt=True)
+    log(f"market_stats neu: {len(df)} Inserate in {len(groups)} Gruppen ({time.perf_counter() - t0:.1f}s)")
+    return len(groups)
+
+
+def _py(value):
+    """NumPy-/pandas-Skalare -> Python für die DB-Parameter."""
+    if value is None or value is pd.NA or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return value.item() if hasattr(value, "item") else value
+
+
+def _insert_group_sql():
+    cols = ", ".join(["id"] + KEY_COLUMNS + STAT_COLUMNS + ["price_sketch", "km_sketch", "updated_at"])
+    vals = ", ".join(f":{c}" for c in ["id"] + KEY_COLUMNS + STAT_COLUMNS + ["ps", "ks", "t"])
+    return text(f"INSERT INTO market_stats ({cols}) VALUES ({vals})")
+
+
+def update(engine=None, full=False, log=print):
+    """Store auf den Stand der DB bringen; ohne Stand oder mit full=True neu
+    aufbauen. Gibt die Zahl der geänderten Gruppen zurück."""
+    engine = engine or get_engine()
+    with engine.connect() as conn:
+        state = _state(conn)
+    if full or state is None:
+        return rebuild(engine, log)
+
+    t0 = time.perf_counter()
+    now = datetime.now(timezone.utc)
+    ts, cutoff = utc_text(now), utc_text(now - timedelta(days=MAX_AGE_DAYS))
+    watermark, max_id = db_state(engine, ["last_seen", "delisted_at"])
+    where, params = _population_sql(now)
+    # >= beim Wasserstand: Zeilen aus derselben Sekunde kommen lieber doppelt.
+    # UNION statt OR, damit jeder Teil seinen Index nutzt (OR = Scan über cars)
+    delta = pd.read_sql_query(text(f"""
+        SELECT d.*, m.group_id AS old_group, m.price AS old_price, m.km AS old_km FROM (
+            SELECT {', '.join(LOAD_COLUMNS)}, CASE WHEN {where} THEN 1 ELSE 0 END AS qualifies
+            FROM cars
+            WHERE id IN (
+                SELECT id FROM cars WHERE last_seen >= :w
+                UNION SELECT id FROM cars WHERE delisted_at >= :w
+                UNION SELECT id FROM cars WHERE id > :max_id
+                UNION SELECT id FROM cars WHERE last_seen >= :old_cutoff AND last_seen < :cutoff
+            )
+        ) d LEFT JOIN market_stats_members m ON m.car_id = d.id
+    """), engine, params={**params, "w": state["watermark"] or "", "max_id": state["max_id"] or 0,
+                          "old_cutoff": state["cutoff"], "cutoff": cutoff})
+
+    keys, ok = _group_keys(delta)
+    ok = ok & (delta["qualifies"].to_numpy() == 1)
+    price = pd.to_numeric(delta["price"], errors="coerce").to_numpy(dtype=np.float64)
+    km = pd.to_numeric(delta["km"], errors="coerce").to_numpy(dtype=np.float64)
+    old = delta["old_group"].to_numpy(dtype=np.float64)
+
+    with engine.begin() as conn:
+        # Zielgruppe je Zeile; neue Schlüssel bekommen eine neue id
+        existing = pd.read_sql_query(text(f"SELECT id, {', '.join(KEY_COLUMNS)} FROM market_stats"), conn)
+        lookup = _normalize(existing[KEY_COLUMNS]).assign(id=existing["id"].to_numpy())
+        target = np.full(len(delta), np.nan)
+        if ok.any():
+            hit = keys[ok].merge(lookup, on=KEY_COLUMNS, how="left")["id"].to_numpy(dtype=np.float64)
+            fresh = keys[ok][np.isnan(hit)].drop_duplicates()
+            if len(fresh):
+                next_id = int(existing["id"].max()) + 1 if len(existing) else 1
+                fresh = fresh.assign(id=np.arange(next_id, next_id + len(fresh)))
+                conn.execute(_insert_group_sql(), [
+                    {**{c: _py(r[c]) for c in KEY_COLUMNS}, "id": int(r["id"]), "n": 0, "median_price": None,
+                     "q25": None, "q75": None, "median_km": None, "ps": None, "ks": None, "t": ts}
+                    for r in fresh.to_dict("records")
+                ])
+                hit = keys[ok].merge(pd.concat([lookup, fresh]), on=KEY_COLUMNS, how="left")["id"].to_numpy(np.float64)
+            target[ok] = hit
+
+        is_member, in_group = ~np.isnan(old), ~np.isnan(target)
+        added = in_group & ~is_member
+        removed = is_member & ~in_group
+        moved = in_group & is_member & (
+            (target != old)
+            | (price != delta["old_price"].to_numpy(np.float64))
+            | (km != delta["old_km"].to_numpy(np.float64))
+        )
+        dirty = set(old[removed | moved].astype(int)) | set(target[moved].astype(int))
+        grow = set(target[added].astype(int)) - dirty
+
+        ids = delta["id"].to_numpy()
+        _in_chunks(conn, "DELETE FROM market_stats_members WHERE car_id IN :ids", "ids",
+                   ids[removed | moved], fetch=False)
+        ins = added | moved
+        if ins.any():
+            conn.execute(text(
+                "INSERT INTO market_stats_members (car_id, group_id, price, km) VALUES (:car_id, :gid, :price, :km)"
+            ), [{"car_id": int(c), "gid": int(g), "price": float(p), "km": float(k)}
+                for c, g, p, k in zip(ids[ins], target[ins], price[ins], km[ins])])
+
+        rows = []
+        # Gruppen mit Abgängen: aus den Rohwerten neu (exakt bis k Werte)
+        values = {}
+        for gid, p, k in _in_chunks(conn, "SELECT group_id, price, km FROM market_stats_members "
+                                          "WHERE group_id IN :g", "g", sorted(dirty)):
+            values.setdefault(gid, ([], []))
+            values[gid][0].append(p)
+            values[gid][1].append(k)
+        for gid in dirty:
+            p, k = values.get(gid, ([], []))
+            rows.append((gid, KLLSketch.from_values(p), KLLSketch.from_values(k)))
+        # nur Zugänge: in den gespeicherten Sketch mergen
+        add = pd.DataFrame({"gid": target[added], "price": price[added], "km": km[added]}).groupby("gid")
+        for gid, ps, ks in _in_chunks(conn, "SELECT id, price_sketch, km_sketch FROM market_stats WHERE id IN :g",
+                                      "g", sorted(grow)):
+            new = add.get_group(float(gid))
+            price_sk = KLLSketch.from_bytes(ps) if ps is not None else KLLSketch()
+            km_sk = KLLSketch.from_bytes(ks) if ks is not None else KLLSketch()
+            price_sk.merge(KLLSketch.from_values(new["price"]))
+            km_sk.merge(KLLSketch.from_values(new["km"]))
+            rows.append((gid, price_sk, km_sk))
+
+        if rows:
+            conn.execute(text(
+                "UPDATE market_stats SET n = :n, median_price = :median_price, q25 = :q25, q75 = :q75, "
+                "median_km = :median_km, price_sketch = :ps, km_sketch = :ks, updated_at = :t WHERE id = :id"
+            ), [{**{c: _py(v) for c, v in _stats_from_sketches(p, k).items()},
+                 "id": int(gid), "ps": p.to_bytes(), "ks": k.to_bytes(), "t": ts} for gid, p, k in rows])
+        conn.execute(text("DELETE FROM market_stats WHERE n = 0"))
+        _write_state(conn, watermark, max_id, cutoff, ts)
+
+    log(f"market_stats: {len(delta)} Zeilen geprüft, {int(added.sum())} neu, {int(removed.sum())} raus, "
+        f"{int(moved.sum())} geändert, {len(rows)} Gruppen aktualisiert ({time.perf_counter() - t0:.2f}s)")
+    return len(rows)
+
+
+def _typed(stats):
+    """Statistikspalten mit festen dtypes: n int64 (fehlend 0), Quantile
+    float64. read_sql liefert bei leerer Tabelle object-Spalten."""
+    stats["n"] = pd.to_numeric(stats["n"], errors="coerce").fillna(0).astype(np.int64)
+    for col in STAT_COLUMNS[1:]:
+        stats[col] = pd.to_numeric(stats[col], errors="coerce").astype(np.float64)
+    return stats
+
+
+def read_stats(engine):
+    """Alle Gruppen mit Statistik (O(Gruppen), ohne Sketches)."""
+    return _typed(pd.read_sql_query(
+        text(f"SELECT {', '.join(KEY_COLUMNS + STAT_COLUMNS)} FROM market_stats"), engine
+    ))
+
+
+def load_current(engine, group_cols, log=print):
+    """Store nachziehen und lesen; None, wenn er für diese Gruppierung nicht
+    passt oder (noch) nicht nutzbar ist."""
+    if list(group_cols) != KEY_COLUMNS:
+        return None
+    try:
+        if not available(engine):
+            log("market_stats fehlt (python migrations.py ausführen?), rechne Gruppen direkt")
+            return None
+        update(engine, log=log)
+        stored = read_stats(engine)
+    except Exception as e:
+        log(f"market_stats nicht nutzbar ({e}), rechne Gruppen direkt")
+        return None
+    if stored.empty:
+        log("market_stats ist leer, rechne Gruppen direkt")
+        return None
+    return stored
+
+
+def join_keys(keys, stored):
+    """Gespeicherte Statistik an die Gruppenschlüssel (Index = Gruppencode)
+    hängen; Gruppen ohne Eintrag bekommen n = 0."""
+    found = _normalize(keys).merge(
+        _normalize(stored).join(stored[STAT_COLUMNS]), on=KEY_COLUMNS, how="left"
+    )
+    out = keys.copy()
+    for col in STAT_COLUMNS:
+        out[col] = found[col].to_numpy()
+    return _typed(out)
+
+
+def check(engine, log=print, rtol=0.02):
+    """Store gegen eine exakte Neuberechnung vergleichen. Quantile großer
+    Gruppen sind nach inkrementellen Updates Näherungen (rtol)."""
+    df, keys = population(engine)
+    _, exact = exact_stats(df, keys)
+    stored = read_stats(engine)
+    both = _normalize(exact).join(exact[STAT_COLUMNS]).merge(
+        _normalize(stored).join(stored[STAT_COLUMNS]), on=KEY_COLUMNS, how="outer",
+        suffixes=("", "_store"), indicator=True,
+    )
+    missing = int((both["_merge"] == "left_only").sum())
+    extra = int((both["_merge"] == "right_only").sum())
+    common = both[both["_merge"] == "both"]
+    bad_n = int((common["n"] != common["n_store"]).sum())
+    worst = {
+        col: float(np.nanmax(np.abs(common[f"{col}_store"] / common[col] - 1), initial=0))
+        for col in STAT_COLUMNS[1:]
+    }
+    log(f"market_stats: {len(exact)} Gruppen exakt, {len(stored)} im Store, {missing} fehlen, "
+        f"{extra} zu viel, {bad_n} mit falschem n; max. Abweichung "
+        + ", ".join(f"{c} {v:.2%}" for c, v in worst.items()))
+    return not missing and not extra and not bad_n and all(v <= rtol for v in worst.values())
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Vergleichsgruppen der Marktanalyse pflegen")
+    ap.add_argument("db", nargs="?", default=DB_PATH)
+    ap.add_argument("--full", action="store_true", help="komplett neu aufbauen")
+    ap.add_argument("--check", action="store_true", help="gegen exakte Neuberechnung prüfen")
+    args = ap.parse_args()
+
+    engine = get_engine(sqlite_url(args.db))
+    if args.check:
+        sys.exit(0 if check(engine) else 1)
+    update(engine, full=args.full)
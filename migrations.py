@@ -0,0 +1,349 @@
+import sys
+import argparse
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from config import DATABASE_URL
+from features import mask_from_raw
+from storage import get_engine, sqlite_url
+
+# Versionierte Schema-Migrationen. Jede Stufe läuft in einer eigenen
+# Transaktion, ist idempotent (auch auf Datenbanken, die schon mit dem alten
+# init_db.py/migrate_db_sqlite.py angelegt wurden) und wird in schema_version
+# eingetragen. Neue Änderungen nur als neue Stufe anhängen, nie alte ändern.
+# Die Stufen laufen auf SQLite und PostgreSQL; Zeitstempel sind in beiden
+# Text im Format von SQLite datetime('now'), damit Vergleiche gleich bleiben.
+#
+#   python migrations.py            # auf aktuellen Stand bringen
+#   python migrations.py --plans    # nur Query-Pläne der heißen Abfragen zeigen
+
+
+def is_postgres(conn):
+    return conn.dialect.name == "postgresql"
+
+
+def serial_pk(conn):
+    return "BIGSERIAL PRIMARY KEY" if is_postgres(conn) else "INTEGER PRIMARY KEY AUTOINCREMENT"
+
+
+def now_sql(conn):
+    """Default-Ausdruck für "jetzt" als UTC-Text wie datetime('now')."""
+    if is_postgres(conn):
+        return "(to_char(now() AT TIME ZONE 'utc', 'YYYY-MM-DD HH24:MI:SS'))"
+    return "(datetime('now'))"
+
+
+def columns(conn, table):
+    return {c["name"] for c in inspect(conn).get_columns(table)}
+
+
+def add_col(conn, table, col, coltype):
+    if col not in columns(conn, table):
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {col} {coltype}")
+
+
+def index_columns(conn, table):
+    """Indexname -> Spaltentupel aller Indizes der Tabelle."""
+    return {ix["name"]: tuple(ix["column_names"]) for ix in inspect(conn).get_indexes(table)}
+
+
+def ensure_index(conn, name, table, cols, replaces=()):
+    """Legt den Index an, außer es gibt schon einen mit genau diesen Spalten
+    (ältere DBs haben z.B. idx_price_history_carid_seenat). `replaces` sind
+    Indizes, die der neue überflüssig macht (Präfix) und die gelöscht werden."""
+    existing = index_columns(conn, table)
+    if tuple(cols) not in existing.values():
+        conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {name} ON {table}({', '.join(cols)})")
+    for old in replaces:
+        if old in existing and old != name:
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {old}")
+
+
+def m001_cars(conn):
+    ts = "TEXT" if is_postgres(conn) else "TIMESTAMP DEFAULT CURRENT_TIMESTAMP"
+    conn.exec_driver_sql(f"""
+    CREATE TABLE IF NOT EXISTS cars (
+        id {serial_pk(conn)},
+        platform TEXT,
+        external_id TEXT,
+        title TEXT,
+        brand TEXT,
+        model TEXT,
+        year INTEGER,
+        km INTEGER,
+        price INTEGER,
+        location TEXT,
+        url TEXT UNIQUE,
+        first_seen {ts},
+        last_seen {ts}
+    )
+    """)
+
+
+def m002_detail_columns(conn):
+    for col, typ in [
+        ("first_seen", "TEXT"),
+        ("last_seen", "TEXT"),
+        ("power_ps", "INTEGER"),
+        ("fuel_type", "TEXT"),
+        ("transmission", "TEXT"),
+        ("drive", "TEXT"),
+        ("body_type", "TEXT"),
+        ("variant", "TEXT"),
+        ("seller_type", "TEXT"),
+        ("features_raw", "TEXT"),
+        ("description", "TEXT"),
+    ]:
+        add_col(conn, "cars", col, typ)
+
+
+def m003_price_history(conn):
+    conn.exec_driver_sql(f"""
+    CREATE TABLE IF NOT EXISTS price_history (
+        id {serial_pk(conn)},
+        car_id BIGINT NOT NULL,
+        price INTEGER,
+        seen_at TEXT NOT NULL DEFAULT {now_sql(conn)},
+        FOREIGN KEY (car_id) REFERENCES cars(id)
+    )
+    """)
+
+
+def m004_features_mask(conn):
+    # Bits siehe features.FEATURE_BITS; ohne features_raw: python features.py retag
+    add_col(conn, "cars", "features_mask", "BIGINT")
+    rows = conn.execute(text("SELECT id, features_raw FROM cars WHERE features_mask IS NULL")).fetchall()
+    updates = [{"mask": mask_from_raw(raw), "id": car_id} for car_id, raw in rows]
+    updates = [u for u in updates if u["mask"] is not None]
+    if updates:
+        conn.execute(text("UPDATE cars SET features_mask=:mask WHERE id=:id"), updates)
+    ensure_index(conn, "idx_cars_features_mask", "cars", ["features_mask", "price"])
+
+
+def m005_current_price(conn):
+    # letzter protokollierter Preis direkt in cars, damit insert_cars keine
+    # price_history-Abfrage braucht
+    add_col(conn, "cars", "current_price", "INTEGER")
+    add_col(conn, "cars", "price_changed_at", "TEXT")
+    ensure_index(conn, "idx_price_history_car_seen", "price_history", ["car_id", "seen_at"])
+    conn.exec_driver_sql("""
+    UPDATE cars SET
+        current_price = (SELECT ph.price FROM price_history ph WHERE ph.car_id = cars.id
+                         ORDER BY ph.seen_at DESC, ph.id DESC LIMIT 1),
+        price_changed_at = (SELECT ph.seen_at FROM price_history ph WHERE ph.car_id = cars.id
+                            ORDER BY ph.seen_at DESC, ph.id DESC LIMIT 1)
+    WHERE current_price IS NULL AND EXISTS (SELECT 1 FROM price_history ph WHERE ph.car_id = cars.id)
+    """)
+
+
+def m006_scrape_failures(conn):
+    # Dead-Letter für Detail-URLs, die alle Versuche eines Laufs verbraucht haben
+    conn.exec_driver_sql(f"""
+    CREATE TABLE IF NOT EXISTS scrape_failures (
+        url TEXT PRIMARY KEY,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        failed_at TEXT NOT NULL DEFAULT {now_sql(conn)}
+    )
+    """)
+
+
+def m007_hot_indexes(conn):
+    ensure_index(conn, "idx_price_history_car_seen", "price_history", ["car_id", "seen_at"])
+    ensure_index(conn, "idx_cars_last_seen", "cars", ["last_seen"])
+    ensure_index(conn, "idx_cars_brand_model_year", "cars", ["brand", "model", "year"],
+                 replaces=["idx_cars_brand_model"])
+    ensure_index(conn, "idx_cars_external_id", "cars", ["external_id"])
+    # Statistiken für den Planer (sqlite_stat1 bzw. pg_statistic)
+    conn.exec_driver_sql("ANALYZE")
+
+
+def m008_listing_lifecycle(conn):
+    # aktiv = in der letzten vollständigen Suche noch gefunden; delisted_at =
+    # Ende des Laufs, in dem das Inserat fehlte (bzw. Detailseite weg)
+    add_col(conn, "cars", "active", "INTEGER NOT NULL DEFAULT 1")
+    add_col(conn, "cars", "delisted_at", "TEXT")
+    conn.exec_driver_sql("""
+    CREATE TABLE IF NOT EXISTS search_listings (
+        search_key TEXT NOT NULL,
+        url TEXT NOT NULL,
+        first_seen TEXT NOT NULL,
+        last_seen TEXT NOT NULL,
+        PRIMARY KEY (search_key, url)
+    )
+    """)
+    ensure_index(conn, "idx_search_listings_key_seen", "search_listings", ["search_key", "last_seen"])
+    ensure_index(conn, "idx_search_listings_url", "search_listings", ["url"])
+    ensure_index(conn, "idx_cars_active_last_seen", "cars", ["active", "last_seen"])
+    ensure_index(conn, "idx_cars_delisted_at", "cars", ["delisted_at"])
+
+
+def m009_market_stats(conn):
+    # Vergleichsgruppen der Marktanalyse, inkrementell gepflegt (market_stats.py)
+    blob = "BYTEA" if is_postgres(conn) else "BLOB"
+    conn.exec_driver_sql(f"""
+    CREATE TABLE IF NOT EXISTS market_stats (
+        id BIGINT PRIMARY KEY,
+        brand TEXT,
+        model TEXT,
+        year_bucket INTEGER,
+        ps_bucket INTEGER,
+        transmission TEXT,
+        fuel_type TEXT,
+        drive TEXT,
+        n INTEGER NOT NULL,
+        median_price REAL,
+        q25 REAL,
+        q75 REAL,
+        median_km REAL,
+        price_sketch {blob},
+        km_sketch {blob},
+        updated_at TEXT NOT NULL
+    )
+    """)
+    conn.exec_driver_sql("""
+    CREATE UNIQUE INDEX IF NOT EXISTS uq_market_stats_key ON market_stats
+        (brand, model, year_bucket, ps_bucket, transmission, fuel_type, drive)
+    """)
+    conn.exec_driver_sql("""
+    CREATE TABLE IF NOT EXISTS market_stats_members (
+        car_id BIGINT PRIMARY KEY,
+        group_id BIGINT NOT NULL,
+        price REAL NOT NULL,
+        km REAL
+    )
+    """)
+    ensure_index(conn, "idx_market_stats_members_group", "market_stats_members", ["group_id"])
+    conn.exec_driver_sql("""
+    CREATE TABLE IF NOT EXISTS market_stats_state (
+        id INTEGER PRIMARY KEY,
+        watermark TEXT,
+        max_id BIGINT,
+        cutoff TEXT,
+        updated_at TEXT,
+        rebuilt_at TEXT
+    )
+    """)
+
+
+def m010_price_models(conn):
+    # Koeffizienten des Preismodells je brand/model (hedonic.py); coef als
+    # JSON-Liste in der Reihenfolge von columns
+    conn.exec_driver_sql("""
+    CREATE TABLE IF NOT EXISTS price_models (
+        brand TEXT NOT NULL,
+        model TEXT NOT NULL,
+        n INTEGER NOT NULL,
+        rmse REAL,
+        ps_mean REAL,
+        ref_year INTEGER NOT NULL,
+        columns TEXT NOT NULL,
+        coef TEXT NOT NULL,
+        fitted_at TEXT NOT NULL,
+        PRIMARY KEY (brand, model)
+    )
+    """)
+
+
+MIGRATIONS = [
+    (1, "cars", m001_cars),
+    (2, "Detailspalten", m002_detail_columns),
+    (3, "price_history", m003_price_history),
+    (4, "features_mask + Index", m004_features_mask),
+    (5, "current_price/price_changed_at", m005_current_price),
+    (6, "scrape_failures", m006_scrape_failures),
+    (7, "Indizes für last_seen, brand/model/year, external_id", m007_hot_indexes),
+    (8, "active/delisted_at + search_listings", m008_listing_lifecycle),
+    (9, "market_stats", m009_market_stats),
+    (10, "price_models", m010_price_models),
+]
+
+LATEST = MIGRATIONS[-1][0]
+
+# Abfragen, deren Plan sich durch Indizes ändern soll (Werte nur als Beispiel)
+HOT_QUERIES = {
+    "letzter Preis je Auto": "SELECT price, seen_at FROM price_history WHERE car_id = 1 ORDER BY seen_at DESC LIMIT 1",
+    "Analyse ab last_seen": "SELECT * FROM cars WHERE last_seen >= '2024-01-01 00:00:00'",
+    "aktive Inserate": "SELECT * FROM cars WHERE active = 1 AND last_seen >= '2024-01-01 00:00:00'",
+    "Vergleichsgruppe": "SELECT price, km FROM cars WHERE brand = 'VW' AND model = 'Golf' AND year BETWEEN 2015 AND 2018",
+    "Inserat per external_id": "SELECT id, url FROM cars WHERE external_id = '123456789'",
+    "bekannte URLs": "SELECT url, price, last_seen FROM cars WHERE url IN ('a', 'b')",
+    "Feature-Filter": "SELECT id, price FROM cars WHERE features_mask IN (3, 7) ORDER BY price",
+}
+
+
+def schema_version(conn):
+    conn.exec_driver_sql("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TEXT NOT NULL
+    )
+    """)
+    return conn.exec_driver_sql("SELECT COALESCE(MAX(version), 0) FROM schema_version").scalar()
+
+
+def query_plans(conn):
+    """Name -> EXPLAIN QUERY PLAN als Text (oder Fehlermeldung, z.B. bei fehlender Spalte)."""
+    explain = "EXPLAIN (COSTS OFF)" if is_postgres(conn) else "EXPLAIN QUERY PLAN"
+    plans = {}
+    for name, sql in HOT_QUERIES.items():
+        try:
+            if is_postgres(conn):
+                # Savepoint, damit ein Fehler nicht die ganze Transaktion abbricht
+                with conn.begin_nested():
+                    rows = conn.exec_driver_sql(f"{explain} {sql}").fetchall()
+            else:
+                rows = conn.exec_driver_sql(f"{explain} {sql}").fetchall()
+            plans[name] = "; ".join(r[-1].strip() for r in rows)
+        except Exception as e:
+            plans[name] = f"Fehler: {getattr(e, 'orig', e)}"
+    return plans
+
+
+def migrate(engine=None, log=print):
+    """Bringt die DB auf LATEST und meldet, welche Query-Pläne sich geändert
+    haben. Gibt die neue Version zurück."""
+    engine = engine or get_engine()
+    with engine.begin() as conn:
+        current = schema_version(conn)
+        before = query_plans(conn) if current < LATEST else None
+
+    for version, name, step in MIGRATIONS:
+        if version <= current:
+            continue
+        with engine.begin() as conn:
+            step(conn)
+            conn.execute(
+                text("INSERT INTO schema_version (version, name, applied_at) VALUES (:v, :n, :t)"),
+                {"v": version, "n": name, "t": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")},
+            )
+        log(f"Migration {version:03d} ({name}) angewendet")
+
+    if before is None:
+        log(f"Schema aktuell (Version {current})")
+        return current
+
+    with engine.connect() as conn:
+        after = query_plans(conn)
+    for name in HOT_QUERIES:
+        if before[name] != after[name]:
+            log(f"Plan geändert: {name}\n  vorher:  {before[name]}\n  nachher: {after[name]}")
+    log(f"Schema auf Version {LATEST}")
+    return LATEST
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Schema-Migrationen")
+    ap.add_argument("--db", help="SQLite-Datei statt DATABASE_URL")
+    ap.add_argument("--plans", action="store_true", help="nur Query-Pläne anzeigen")
+    args = ap.parse_args()
+
+    engine = get_engine(sqlite_url(args.db) if args.db else DATABASE_URL)
+    if args.plans:
+        with engine.connect() as conn:
+            for name, plan in query_plans(conn).items():
+                print(f"{name}: {plan}")
+        sys.exit(0)
+    migrate(engine)
@@ -0,0 +1,108 @@
+import os
+import sys
+import json
+import argparse
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+from scrapers import archive
+from scrapers.http_fetch import page_props_from_html
+from scrapers.willhaben_json import car_from_page_props
+
+# Backfill ohne Browser: lässt den aktuellen Parser (JSON-Mapping + Features)
+# über das Seitenarchiv laufen und schreibt über db.insert_car.
+#
+# Archivstände, die älter als cars.last_seen sind, werden übersprungen: das
+# Inserat wurde danach noch gesehen (Detailseite oder inkrementell nur per
+# last_seen), der Archivstand kann Preis und Titel also zurücksetzen. Für
+# Features und Marke/Modell solcher Zeilen: python features.py retag bzw.
+# python make_model_catalog.py resolve.
+#
+#   PAGE_ARCHIVE_DIR=archive python reparse_archive.py [--all] [--workers 8]
+
+# insert_car setzt last_seen erst beim Schreiben (DbWriter-Batch), etwas
+# nach fetched_at des Archivs: so viel Abstand gilt noch als derselbe Abruf
+SAME_FETCH_SLACK = timedelta(minutes=30)
+
+
+def parse_file(path):
+    """Läuft im Worker-Prozess. Gibt (car, seen_at) oder (None, grund) zurück."""
+    from features import extract_features
+    from scrapers.scrape_willhaben_async import extract_external_id
+
+    try:
+        rec = archive.load_record(path)
+    except Exception as e:
+        return None, f"unlesbar: {e}"
+
+    data = rec.get("data")
+    if rec.get("kind") == "html":
+        data = page_props_from_html(data)
+        if data is None:
+            return None, "html ohne __NEXT_DATA__"
+
+    url = rec["url"]
+    car = car_from_page_props(data, url)
+    if car is None:
+        return None, "kein advertDetails"
+    if not car.get("external_id"):
+        car["external_id"] = extract_external_id(url)
+    car["features_raw"] = json.dumps(extract_features(car["title"], car["description"]), ensure_ascii=False)
+
+    # letzter Abruf mit diesem Inhalt (Dateiname), nicht der erste (fetched_at)
+    m = archive.FILE_RE.match(os.path.basename(path))
+    fetched = m.group(1) if m else rec["fetched_at"]
+    seen_at = datetime.strptime(fetched, "%Y%m%dT%H%M%S").strftime("%Y-%m-%d %H:%M:%S")
+    return car, seen_at
+
+
+def is_stale(seen_at, last_seen, slack=SAME_FETCH_SLACK):
+    """True, wenn der Archivstand (seen_at) vor dem letzten Sehen des
+    Inserats liegt; beides UTC-Text wie datetime('now')."""
+    if not last_seen:
+        return False
+    try:
+        last = datetime.fromisoformat(str(last_seen))
+    except ValueError:
+        return False
+    return datetime.fromisoformat(seen_at) < last - slack
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Archivierte Detailseiten neu parsen und upserten")
+    ap.add_argument("--dir", default=archive.PAGE_ARCHIVE_DIR or "archive")
+    ap.add_argument("--all", action="store_true", help="alle Stände statt nur des jüngsten pro Inserat")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    ap.add_argument("--dry-run", action="store_true")
+    args = ap.parse_args()
+
+    from db import insert_car, get_known
+
+    paths = list(archive.iter_archive(args.dir, latest_only=not args.all))
+    if not paths:
+        print(f"Keine Archivdateien in {args.dir}")
+        return
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        parsed = list(pool.map(parse_file, paths, chunksize=64))
+    known = get_known({car["url"] for car, _ in parsed if car is not None})
+
+    ok, skipped = 0, {}
+    # --all: ältere Stände zuerst, damit die Preis-Historie in Reihenfolge bleibt
+    for car, info in sorted(parsed, key=lambda r: r[1] if r[0] is not None else ""):
+        if car is not None and is_stale(info, known.get(car["url"], (None, None))[1]):
+            car, info = None, "älter als cars.last_seen"
+        if car is None:
+            skipped[info] = skipped.get(info, 0) + 1
+            continue
+        if not args.dry_run:
+            insert_car(car, seen_at=info)
+        ok += 1
+
+    print(f"Re-Parse fertig: {ok}/{len(paths)} Seiten übernommen" + (" (dry-run)" if args.dry_run else ""))
+    for reason, n in sorted(skipped.items()):
+        print(f"  übersprungen ({reason}): {n}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import asyncio
+import statistics
+
+
+class AdaptiveLimiter:
+    """AIMD-Regler für die Zahl aktiver Detail-Worker.
+
+    Es laufen immer max_workers Worker-Tasks, aber nur `limit` davon dürfen
+    gleichzeitig eine Seite laden. Nach jedem Fenster von `window` Ergebnissen
+    wird entschieden:
+
+    - Challenge (403/429/503), Timeout-Rate > max_timeout_rate oder
+      Fehler-Rate > max_error_rate -> limit halbieren (multiplicative decrease)
+    - Median-Latenz > latency_factor * beste bisherige Median-Latenz
+      -> limit * 0.75
+    - sonst -> limit + 1 (additive increase)
+    """
+
+    def __init__(self, start, min_workers, max_workers, log, window=8,
+                 max_timeout_rate=0.1, max_error_rate=0.2, latency_factor=2.0):
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        self.limit = min(max(start, self.min_workers), self.max_workers)
+        self.log = log
+        self.window = window
+        self.max_timeout_rate = max_timeout_rate
+        self.max_error_rate = max_error_rate
+        self.latency_factor = latency_factor
+
+        self.active = 0
+        self.samples = []
+        self.best_latency = None
+        self.history = [self.limit]
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            while self.active >= self.limit:
+                await self._cond.wait()
+            self.active += 1
+
+    async def release(self, latency, outcome):
+        """outcome: "ok", "timeout", "error" oder "challenge"."""
+        async with self._cond:
+            self.active -= 1
+            self.samples.append((latency, outcome))
+            if len(self.samples) >= self.window:
+                self._adjust()
+            self._cond.notify_all()
+
+    def _adjust(self):
+        samples, self.samples = self.samples, []
+        n = len(samples)
+        timeouts = sum(1 for _, o in samples if o == "timeout")
+        errors = sum(1 for _, o in samples if o == "error")
+        challenges = sum(1 for _, o in samples if o == "challenge")
+        ok_latencies = [lat for lat, o in samples if o == "ok"]
+        median = statistics.median(ok_latencies) if ok_latencies else None
+
+        old = self.limit
+        if challenges or timeouts / n > self.max_timeout_rate or errors / n > self.max_error_rate:
+            self.limit = max(self.min_workers, self.limit // 2)
+            reason = f"Rückgang: {challenges} Challenges, {timeouts} Timeouts, {errors} Fehler von {n}"
+        elif median is not None and self.best_latency is not None and median > self.latency_factor * self.best_latency:
+            self.limit = max(self.min_workers, int(self.limit * 0.75))
+            reason = f"Latenz {median:.1f}s > {self.latency_factor:g}x Bestwert {self.best_latency:.1f}s"
+        else:
+            self.limit = min(self.max_workers, self.limit + 1)
+            reason = f"stabil (Median {median:.1f}s)" if median is not None else "stabil"
+
+        if median is not None and (self.best_latency is None or median < self.best_latency):
+            self.best_latency = median
+
+        self.history.append(self.limit)
+        if self.limit != old:
+            self.log(f"[AIMD] Worker {old} -> {self.limit} ({reason})")
+        else:
+            self.log(f"[AIMD] Worker bleiben bei {self.limit} ({reason})")
+
+    def summary(self):
+        return (
+            f"[AIMD] Worker-Limit: Start {self.history[0]}, Ende {self.limit}, "
+            f"Max {max(self.history)}, Grenzen {self.min_workers}-{self.max_workers}"
+        )
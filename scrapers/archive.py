@@ -0,0 +1,85 @@
+import os
+import re
+import gzip
+import json
+import hashlib
+from datetime import datetime
+
+# Optionales Rohdaten-Archiv der Detailseiten. Aktiv, wenn PAGE_ARCHIVE_DIR
+# gesetzt ist. Ablage: <dir>/<listing_id>/<fetch_time>-<sha1>.json.gz
+# fetch_time im Namen ist der letzte Abruf mit diesem Inhalt, fetched_at im
+# Datensatz der erste.
+PAGE_ARCHIVE_DIR = os.environ.get("PAGE_ARCHIVE_DIR") or None
+
+FILE_RE = re.compile(r"^(\d{8}T\d{6})-([0-9a-f]{12})\.json\.gz$")
+
+
+def enabled():
+    return PAGE_ARCHIVE_DIR is not None
+
+
+def listing_id(url):
+    m = re.search(r"-([0-9]{6,})/?$", url) or re.search(r"/([0-9]{6,})/?$", url)
+    if m:
+        return m.group(1)
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+
+
+def archive_payload(url, kind, data, archive_dir=None, fetched_at=None):
+    """Speichert eine Detailseite komprimiert. kind: "next_data" (pageProps) oder "html".
+
+    Ist der Inhalt gleich dem jüngsten Stand des Inserats, wird nichts
+    geschrieben, die Datei aber auf den neuen Abrufzeitpunkt umbenannt: sonst
+    gilt der Stand beim Re-Parse als älter als cars.last_seen. Verglichen wird
+    nur mit dem jüngsten: nach A -> B -> A muss A wieder als neuester Stand im
+    Archiv liegen, sonst liefert iter_archive(latest_only=True) das veraltete B.
+    Gibt den Pfad zurück (oder None, wenn das Archiv aus ist).
+    """
+    archive_dir = archive_dir or PAGE_ARCHIVE_DIR
+    if not archive_dir or data is None:
+        return None
+
+    body = json.dumps(data, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    digest = hashlib.sha1(body).hexdigest()[:12]
+    folder = os.path.join(archive_dir, listing_id(url))
+    os.makedirs(folder, exist_ok=True)
+    names = sorted(n for n in os.listdir(folder) if FILE_RE.match(n))
+    ts = (fetched_at or datetime.utcnow()).strftime("%Y%m%dT%H%M%S")
+    path = os.path.join(folder, f"{ts}-{digest}.json.gz")
+    if names and FILE_RE.match(names[-1]).group(2) == digest:
+        latest = os.path.join(folder, names[-1])
+        if FILE_RE.match(names[-1]).group(1) >= ts:
+            return latest
+        try:
+            os.replace(latest, path)
+        except FileNotFoundError:
+            # paralleler Abruf hat schon umbenannt
+            pass
+        return path
+    record = {"url": url, "fetched_at": ts, "kind": kind, "data": data}
+    tmp = path + ".tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        json.dump(record, f, ensure_ascii=False)
+    os.replace(tmp, path)
+    return path
+
+
+def iter_archive(archive_dir=None, latest_only=True):
+    """Pfade der archivierten Seiten; latest_only: nur der jüngste Stand pro Inserat."""
+    archive_dir = archive_dir or PAGE_ARCHIVE_DIR
+    if not archive_dir or not os.path.isdir(archive_dir):
+        return
+    for lid in sorted(os.listdir(archive_dir)):
+        folder = os.path.join(archive_dir, lid)
+        if not os.path.isdir(folder):
+            continue
+        names = sorted(n for n in os.listdir(folder) if FILE_RE.match(n))
+        if latest_only:
+            names = names[-1:]
+        for name in names:
+            yield os.path.join(folder, name)
+
+
+def load_record(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
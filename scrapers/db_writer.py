@@ -0,0 +1,160 @@
+import os
+import time
+import queue
+import asyncio
+import threading
+
+from db import engine, insert_cars
+from storage import checkpoint
+
+# Autos werden in Blöcken geschrieben: sobald WRITE_BATCH_SIZE beisammen sind
+# oder das älteste WRITE_FLUSH_MS wartet. Die Queue ist begrenzt, damit ein
+# langsamer DB-Writer die Scraper bremst statt den Speicher zu füllen.
+WRITE_BATCH_SIZE = int(os.environ.get("DB_WRITE_BATCH", "200"))
+WRITE_FLUSH_MS = int(os.environ.get("DB_WRITE_FLUSH_MS", "500"))
+WRITE_QUEUE_MAX = int(os.environ.get("DB_WRITE_QUEUE", "2000"))
+
+_STOP = object()
+
+
+class DbWriter:
+    """Eigener Thread, der Autos aus einer begrenzten Queue in Batches per
+    insert_cars (executemany) schreibt. Als sink nutzbar: writer(car) oder
+    await writer.submit(car); close() schreibt den Rest und beendet den Thread.
+    Nach close() oder einem Abbruch des Threads lehnen beide neue Autos mit
+    RuntimeError ab, statt sie in eine Queue zu legen, die niemand mehr leert.
+    """
+
+    def __init__(self, log, write=insert_cars, batch_size=WRITE_BATCH_SIZE,
+                 flush_ms=WRITE_FLUSH_MS, max_queue=WRITE_QUEUE_MAX):
+        self.log = log
+        self.write = write
+        self.batch_size = batch_size
+        self.flush_s = flush_ms / 1000
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        self.full_waits = 0
+        self.max_depth = 0
+        self.write_s = 0.0
+        self.failed = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    @property
+    def depth(self):
+        return self.queue.qsize()
+
+    def _note_depth(self):
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def _check(self):
+        if self._closed:
+            raise RuntimeError("DbWriter ist geschlossen")
+        if self.failed is not None:
+            raise RuntimeError(f"DbWriter-Thread abgebrochen: {self.failed}") from self.failed
+
+    def __call__(self, car):
+        """Synchroner sink; blockiert nur, wenn die Queue voll ist."""
+        self._check()
+        try:
+            self.queue.put_nowait(car)
+        except queue.Full:
+            self.full_waits += 1
+            self.queue.put(car)
+        self._note_depth()
+
+    async def submit(self, car):
+        """Wie writer(car), wartet bei voller Queue aber außerhalb des Event-Loops."""
+        self._check()
+        try:
+            self.queue.put_nowait(car)
+        except queue.Full:
+            self.full_waits += 1
+            await asyncio.to_thread(self.queue.put, car)
+        self._note_depth()
+
+    def _run(self):
+        try:
+            self._loop()
+        except Exception as e:
+            # nicht still sterben: Fehler merken und melden, sink lehnt ab jetzt ab
+            self.failed = e
+            self.log(f"[DB] Writer-Thread abgebrochen: {e!r}")
+
+    def _loop(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if not batch else max(0.0, deadline - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is not None and item is not _STOP:
+                batch.append(item)
+                if len(batch) == 1:
+                    deadline = time.monotonic() + self.flush_s
+            due = item is None or item is _STOP or len(batch) >= self.batch_size
+            if batch and (due or time.monotonic() >= deadline):
+                self._flush(batch)
+                batch = []
+            if item is _STOP:
+                return
+
+    def _flush(self, batch):
+        t0 = time.perf_counter()
+        try:
+            self.write(batch)
+            self.written += len(batch)
+        except Exception as e:
+            # einzeln nachschreiben, damit ein kaputtes Inserat nicht den Block kostet
+            self.log(f"[DB] Batch mit {len(batch)} Inseraten fehlgeschlagen ({e}), schreibe einzeln")
+            for car in batch:
+                try:
+                    self.write([car])
+                    self.written += 1
+                except Exception as e2:
+                    self.errors += 1
+                    self.log(f"[DB] Fehler bei {car.get('url')}: {e2}")
+        dt = time.perf_counter() - t0
+        self.batches += 1
+        self.write_s += dt
+        depth = self.queue.qsize()
+        if dt > 1.0 or depth > self.queue.maxsize // 2:
+            self.log(f"[DB] {len(batch)} Inserate in {dt * 1000:.0f} ms geschrieben, Queue {depth}/{self.queue.maxsize}")
+
+    def close(self):
+        """Restliche Autos schreiben und auf den Thread warten."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread.is_alive():
+            self.queue.put(_STOP)
+            self._thread.join()
+        if self.failed is not None:
+            self.log(f"[DB] {self.depth} Inserate nach dem Abbruch nicht geschrieben")
+        self.log(self.summary())
+        # WAL nach dem Lauf zurückschreiben, ohne auf Leser zu warten
+        try:
+            busy, wal_pages, done = checkpoint(engine) or (0, 0, 0)
+            if busy or done < wal_pages:
+                self.log(f"[DB] Checkpoint unvollständig: {done}/{wal_pages} WAL-Seiten (Leser aktiv)")
+        except Exception as e:
+            self.log(f"[DB] Checkpoint fehlgeschlagen: {e}")
+
+    def summary(self):
+        avg = self.written / self.batches if self.batches else 0.0
+        return (
+            f"[DB] {self.written} Inserate in {self.batches} Batches (Ø {avg:.0f}), "
+            f"{self.write_s:.1f}s DB-Zeit, Queue max. {self.max_depth}/{self.queue.maxsize}, "
+            f"{self.full_waits}x voll, {self.errors} Fehler"
+        )
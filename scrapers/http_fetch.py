@@ -0,0 +1,115 @@
+import os
+import re
+import json
+import asyncio
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from scrapers.willhaben_json import BASE_URL
+
+REAL_UA = (
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/120.0.0.0 Safari/537.36"
+)
+
+HTTP_CONCURRENCY = int(os.environ.get("HTTP_CONCURRENCY", "8"))
+# z.B. http://127.0.0.1:8765 für tools/replay_server.py
+HTTP_BASE_URL = os.environ.get("WILLHABEN_BASE_URL") or None
+
+NEXT_DATA_RE = re.compile(
+    r'<script[^>]+id="__NEXT_DATA__"[^>]*>(.*?)</script>',
+    re.S,
+)
+
+CHALLENGE_MARKERS = (
+    "captcha",
+    "challenge-platform",
+    "cf-chl",
+    "_incapsula_resource",
+    "px-captcha",
+    "access denied",
+    "please enable javascript",
+    "bitte aktivieren sie javascript",
+)
+
+
+class BotChallenge(Exception):
+    """Antwort sieht nach Bot-Schutz aus -> Seite über Playwright laden."""
+
+
+class ListingGone(Exception):
+    """404/410: Inserat existiert nicht mehr, kein Retry."""
+
+
+def page_props_from_html(html):
+    m = NEXT_DATA_RE.search(html or "")
+    if not m:
+        return None
+    try:
+        data = json.loads(m.group(1))
+    except ValueError:
+        return None
+    return (data.get("props") or {}).get("pageProps")
+
+
+def looks_like_challenge(status, html):
+    if status in (403, 429, 503):
+        return True
+    if NEXT_DATA_RE.search(html or ""):
+        return False
+    head = (html or "")[:20000].lower()
+    return any(m in head for m in CHALLENGE_MARKERS)
+
+
+class HttpFetcher:
+    """Keep-Alive Session mit Connection-Pool; Requests laufen im Thread-Pool,
+    begrenzt durch eine Semaphore."""
+
+    def __init__(self, concurrency=HTTP_CONCURRENCY, base_url=HTTP_BASE_URL, timeout=20):
+        self.concurrency = concurrency
+        self.base_url = base_url.rstrip("/") if base_url else None
+        self.timeout = timeout
+        self.requests = 0
+        self._sem = None
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=concurrency, max_retries=1)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "User-Agent": REAL_UA,
+            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+            "Accept-Language": "de-AT,de;q=0.9,en;q=0.6",
+        })
+
+    def rewrite(self, url):
+        if self.base_url and url.startswith(BASE_URL):
+            return self.base_url + url[len(BASE_URL):]
+        return url
+
+    def get(self, url):
+        resp = self.session.get(self.rewrite(url), timeout=self.timeout)
+        self.requests += 1
+        return resp.status_code, resp.text
+
+    async def fetch_html(self, url):
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.concurrency)
+        async with self._sem:
+            return await asyncio.to_thread(self.get, url)
+
+    async def fetch_page_props(self, url):
+        """pageProps aus dem eingebetteten __NEXT_DATA__; BotChallenge bei Bot-Schutz."""
+        status, html = await self.fetch_html(url)
+        if looks_like_challenge(status, html):
+            raise BotChallenge(f"HTTP {status}: {url}")
+        if status in (404, 410):
+            raise ListingGone(f"HTTP {status}: {url}")
+        if status >= 400:
+            raise requests.HTTPError(f"HTTP {status}: {url}")
+        return page_props_from_html(html)
+
+    def close(self):
+        self.session.close()
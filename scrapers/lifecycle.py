@@ -0,0 +1,62 @@
+from db import utc_now, record_search_listings, mark_delisted, mark_gone
+from willhaben_url import search_key
+
+# so viele URLs dürfen gegenüber rowsFound fehlen (Inserate, die während des
+# Laufs verschwinden oder zwischen zwei Seiten verrutschen), sonst unvollständig
+MISSING_TOLERANCE = 0.01
+MISSING_MIN = 2
+
+
+class SearchRun:
+    """Welche Inserate eine Suche in diesem Lauf geliefert hat. Am Ende des
+    Laufs werden die URLs in search_listings vermerkt und fehlende Inserate
+    mit einem UPDATE inaktiv gesetzt, aber nur, wenn alle Suchseiten gelesen
+    wurden: ein abgebrochener Lauf darf nichts "verkaufen".
+    """
+
+    def __init__(self, start_url, log):
+        self.log = log
+        self.key = search_key(start_url)
+        self.started_at = utc_now()
+        self.urls = set()
+        self.collected = False
+        self.failed_pages = 0
+        self.complete = True
+        self.rows_found = None
+
+    def expect(self, rows_found):
+        """Trefferzahl laut Suchseite 1."""
+        self.rows_found = rows_found
+
+    def missing(self):
+        """Wie viele URLs gegenüber rowsFound über die Toleranz hinaus fehlen."""
+        if not self.rows_found:
+            return 0
+        allowed = max(MISSING_MIN, int(self.rows_found * MISSING_TOLERANCE))
+        return max(0, self.rows_found - len(self.urls) - allowed)
+
+    def page_failed(self):
+        self.failed_pages += 1
+
+    def add(self, urls, complete=True):
+        """Gesammelte Links der Suche; complete=False z.B. beim Scroll-Fallback."""
+        self.urls.update(urls)
+        self.collected = True
+        self.complete = self.complete and complete
+
+    def finish(self, gone=()):
+        n_gone = mark_gone(gone)
+        if not self.collected:
+            if n_gone:
+                self.log(f"Lebenszyklus: {n_gone} Inserate nicht mehr vorhanden")
+            return
+        record_search_listings(self.key, self.urls, self.started_at)
+        if self.failed_pages or not self.complete or not self.urls or self.missing():
+            self.log(
+                f"Lebenszyklus: Suche unvollständig ({self.failed_pages} Seiten fehlgeschlagen, "
+                f"{len(self.urls)} von {self.rows_found if self.rows_found is not None else '?'} Treffern), "
+                f"{n_gone} Inserate nicht mehr vorhanden, sonst nichts als inaktiv markiert"
+            )
+            return
+        n = mark_delisted(self.key, self.started_at)
+        self.log(f"Lebenszyklus: {len(self.urls)} Inserate in der Suche, {n + n_gone} als inaktiv markiert")
@@ -0,0 +1,82 @@
+import os
+import random
+import asyncio
+import itertools
+
+MAX_ATTEMPTS = int(os.environ.get("SCRAPE_MAX_ATTEMPTS", "4"))
+RETRY_BASE_S = float(os.environ.get("SCRAPE_RETRY_BASE_S", "2"))
+RETRY_MAX_S = 60.0
+
+# Priorität: Dead-Letter aus dem letzten Lauf zuerst, Wiederholungen zuletzt
+PRIO_DEAD_LETTER = -1
+PRIO_NEW = 0
+PRIO_STOP = float("inf")
+
+
+def backoff_delay(attempt, base=RETRY_BASE_S, cap=RETRY_MAX_S):
+    """Exponentielles Backoff mit Jitter: base * 2^attempt, +-50 %, gedeckelt."""
+    return min(cap, base * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+
+class RetryQueue:
+    """PriorityQueue für Detail-URLs mit Wiederholung im selben Lauf.
+
+    Fehlgeschlagene URLs werden nach backoff_delay mit niedrigerer Priorität
+    (= Versuchsnummer) wieder eingereiht. task_done der ursprünglichen
+    Eintragung kommt erst nach dem Wiedereinreihen, join() wartet also auch
+    auf die Wiederholungen. URLs ohne Versuche mehr landen in `dead`.
+    """
+
+    def __init__(self, log, max_attempts=MAX_ATTEMPTS):
+        self.log = log
+        self.max_attempts = max_attempts
+        self.queue = asyncio.PriorityQueue()
+        self.dead = {}
+        self.succeeded = set()
+        self.gone = set()
+        self.retries = 0
+        self._seq = itertools.count()
+        self._tasks = set()
+
+    def put(self, url, priority=PRIO_NEW, attempt=0):
+        self.queue.put_nowait((priority, next(self._seq), url, attempt))
+
+    async def get(self):
+        return await self.queue.get()
+
+    def done(self, url):
+        self.succeeded.add(url)
+        self.queue.task_done()
+
+    def drop(self, url):
+        """Inserat gibt es nicht mehr: nicht wiederholen, nicht in Dead-Letter."""
+        self.gone.add(url)
+        self.queue.task_done()
+
+    def failed(self, url, attempt, error):
+        attempt += 1
+        if attempt >= self.max_attempts:
+            self.log(f"Aufgegeben nach {attempt} Versuchen: {url}")
+            self.dead[url] = (attempt, str(error)[:500])
+            self.queue.task_done()
+            return
+        delay = backoff_delay(attempt - 1)
+        self.retries += 1
+        self.log(f"Retry {attempt}/{self.max_attempts - 1} in {delay:.1f}s: {url}")
+        task = asyncio.create_task(self._requeue(url, attempt, delay))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _requeue(self, url, attempt, delay):
+        try:
+            await asyncio.sleep(delay)
+            self.put(url, priority=attempt, attempt=attempt)
+        finally:
+            self.queue.task_done()
+
+    async def join(self):
+        await self.queue.join()
+
+    def stop(self, n_workers):
+        for _ in range(n_workers):
+            self.put(None, priority=PRIO_STOP)
@@ -1,12 +1,14 @@
 import sys
 import os
 import re
-from db import insert_car, car_exists
+from db import insert_car, get_known
 
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
 from db import insert_car
+from features import extract_features
+from make_model_catalog import get_catalog
 
 MAX_WORKERS = 4
 REAL_UA = (
@@ -154,30 +156,9 @@ def scroll_until_all_loaded(page, log, max_rounds=7):
                     desc_el = page.query_selector('[data-testid="description"]')
                     description = desc_el.inner_text().strip() if desc_el else None
 
-                    features_raw = []
-                    blob = " ".join([t for t in [title, description] if t]).lower()
-
-                    feature_rules = {
-                        "carplay": ["carplay"],
-                        "android_auto": ["android auto"],
-                        "acc": ["acc", "adaptiver tempomat"],
-                        "led": ["led", "matrix", "xenon"],
-                        "sitzheizung": ["sitzheizung"],
-                        "allrad": ["quattro", "xdrive", "4motion", "allrad"],
-                        "navi": ["navi", "navigation"],
-                    }
-
-                    for k, needles in feature_rules.items():
-                        if any(n in blob for n in needles):
-                            features_raw.append(k)
+                    features_raw = extract_features(title, description)
 
-                    brand, model = None, None
-                    if title:
-                        parts = title.split()
-                        if len(parts) > 0:
-                            brand = parts[0]
-                        if len(parts) > 1:
-                            model = parts[1]
+                    brand, model = get_catalog().split_title(title)
 
                     car = {
                         "platform": "willhaben",
@@ -292,10 +273,11 @@ def run_scrape(start_url: str, log_cb=print, headless: bool = False):
             page_number += 1
 
         ad_links = list(all_links)
+        known = get_known(ad_links)
 
         for idx, url in enumerate(ad_links, start=1):
 
-            if car_exists(url):
+            if url in known:
                 log(f"Skip (bereits bekannt): {url}")
                 continue
 
@@ -323,39 +305,13 @@ def run_scrape(start_url: str, log_cb=print, headless: bool = False):
                 desc_el = page.query_selector('[data-testid="description"]')
                 description = desc_el.inner_text().strip() if desc_el else None
 
-                features_raw = []
-                text_blob = " ".join([t for t in [title, description] if t])
-                blob = text_blob.lower()
-
-                feature_rules = {
-                    "carplay": ["carplay", "apple carplay"],
-                    "android_auto": ["android auto"],
-                    "acc": ["acc", "adaptiver tempomat", "abstandsregeltempomat"],
-                    "led": [" led", "matrix", "xenon"],
-                    "sitzheizung": ["sitzheizung"],
-                    "allrad": ["quattro", "xdrive", "4motion", "allrad"],
-                    "navi": ["navi", "navigation", "mmi", "comand"],
-                    "sportpaket": ["s line", "s-line", "m paket", "m-paket", "r-line"],
-                    "anhängerkupplung": ["anhängerkupplung", "ahk"],
-                    "parkassist": ["parkassistent", "einparkhilfe", "pdc", "parkpilot"],
-                }
-
-                for key, needles in feature_rules.items():
-                    if any(n in blob for n in needles):
-                        features_raw.append(key)
+                features_raw = extract_features(title, description)
 
                 km = parse_int(km_raw)
                 year = int(year_raw.split("/")[-1]) if year_raw and "/" in year_raw else None
                 power_ps = parse_power_ps(power_raw)
 
-                brand = None
-                model = None
-                if title:
-                    parts = title.split()
-                    if len(parts) >= 1:
-                        brand = parts[0]
-                    if len(parts) >= 2:
-                        model = parts[1]
+                brand, model = get_catalog().split_title(title)
 
                 car = {
                     "platform": "willhaben",
@@ -2,12 +2,30 @@ import os
 import sys
 import re
 import json
+import math
+import time
+import queue
 import asyncio
+import multiprocessing as mp
+from datetime import datetime, timedelta
 
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
-from db import insert_car
+from db import insert_car, get_known, touch_last_seen, load_failures, record_failures, clear_failures, purge_failures
+from scrapers.willhaben_json import (NEXT_DATA_JS, car_from_page_props, cars_from_search, rows_found, search_result,
+                                     search_urls)
+from scrapers.http_fetch import HttpFetcher, BotChallenge, ListingGone
+from scrapers import archive
+from scrapers.adaptive import AdaptiveLimiter
+from scrapers.retry import RetryQueue, backoff_delay, PRIO_DEAD_LETTER
+from scrapers.db_writer import DbWriter
+from scrapers.lifecycle import SearchRun
+from config import SCRAPE_MIN_WORKERS, SCRAPE_MAX_WORKERS
+from willhaben_url import with_page
+from features import extract_features
+import make_model_catalog
+from make_model_catalog import get_catalog
 
 REAL_UA = (
     "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
@@ -15,7 +33,25 @@ REAL_UA = (
     "Chrome/120.0.0.0 Safari/537.36"
 )
 
+# Startwert für den adaptiven Regler, Grenzen in config.py
 MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "4"))
+# "json" = window.__NEXT_DATA__ mit einem evaluate, "dom" = alter Selector-Pfad
+DETAIL_ENGINE = os.environ.get("DETAIL_ENGINE", "json")
+# "playwright" = alles im Browser, "http" = requests-Session mit Browser-Fallback
+FETCH_BACKEND = os.environ.get("FETCH_BACKEND", "playwright")
+# Detailseiten auf mehrere Prozesse (je eigener Browser) verteilen
+SCRAPE_SHARDS = int(os.environ.get("SCRAPE_SHARDS", "1"))
+# Inkrementell: bekannte Inserate nach so vielen Stunden trotzdem neu laden
+REFRESH_AGE_HOURS = float(os.environ.get("REFRESH_AGE_HOURS", "72"))
+# Paginierung per URL: Ergebnisse pro Seite und parallel geladene Suchseiten
+SEARCH_ROWS = int(os.environ.get("SEARCH_ROWS", "90"))
+PAGE_CONCURRENCY = int(os.environ.get("PAGE_CONCURRENCY", "4"))
+# Cookies + localStorage nach dem Consent, wird von neuen Contexts geladen
+STATE_PATH = os.environ.get(
+    "WILLHABEN_STATE",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "willhaben_state.json"),
+)
+QUICK_CONSENT_SELECTOR = 'button:has-text("Alle akzeptieren")'
 
 
 def parse_int(text):
@@ -60,19 +96,21 @@ def extract_external_id(url):
     m2 = re.search(r"/([0-9]{6,})/?$", url)
     return m2.group(1) if m2 else url
 
+COOKIE_SELECTORS = [
+    'button:has-text("Alle akzeptieren")',
+    'button:has-text("Akzeptieren")',
+    'button:has-text("Zustimmen")',
+    'button:has-text("Einverstanden")',
+    'button:has-text("Alles akzeptieren")',
+    'button:has-text("OK")',
+]
+COOKIE_VISIBLE_TIMEOUT_MS = 800
+
 async def accept_cookies(page):
-    candidates = [
-        'button:has-text("Alle akzeptieren")',
-        'button:has-text("Akzeptieren")',
-        'button:has-text("Zustimmen")',
-        'button:has-text("Einverstanden")',
-        'button:has-text("Alles akzeptieren")',
-        'button:has-text("OK")',
-    ]
-    for sel in candidates:
+    for sel in COOKIE_SELECTORS:
         try:
             loc = page.locator(sel).first
-            if await loc.is_visible(timeout=800):
+            if await loc.is_visible(timeout=COOKIE_VISIBLE_TIMEOUT_MS):
                 await loc.click(timeout=1500)
                 await page.wait_for_timeout(250)
                 return True
@@ -80,6 +118,77 @@ async def accept_cookies(page):
             continue
     return False
 
+class Consent:
+    """Cookie-Consent einmal pro Context; danach nur noch ein Schnellcheck.
+
+    Nach erfolgreichem Klick wird der Storage-State (Cookies + localStorage)
+    nach STATE_PATH geschrieben und von späteren new_context-Aufrufen geladen.
+    """
+
+    def __init__(self, context, state_path=STATE_PATH):
+        self.context = context
+        self.state_path = state_path
+        self.done = False
+        self.full_ms = None
+        # Kosten von accept_cookies ohne Banner (so lief es früher auf jeder Detailseite)
+        self.no_banner_ms = None
+        self.quick_n = 0
+        self.quick_ms = 0.0
+        self._lock = asyncio.Lock()
+
+    async def handle(self, page):
+        if not self.done:
+            async with self._lock:
+                if not self.done:
+                    t0 = time.perf_counter()
+                    clicked = await accept_cookies(page)
+                    self.full_ms = (time.perf_counter() - t0) * 1000
+                    if not clicked:
+                        self.no_banner_ms = self.full_ms
+                    self.done = True
+                    if clicked:
+                        await self.save()
+                    return clicked
+
+        t0 = time.perf_counter()
+        clicked = False
+        try:
+            loc = page.locator(QUICK_CONSENT_SELECTOR).first
+            if await loc.is_visible():
+                await loc.click(timeout=1500)
+                clicked = True
+        except Exception:
+            pass
+        if clicked:
+            await self.save()
+        self.quick_n += 1
+        self.quick_ms += (time.perf_counter() - t0) * 1000
+        return clicked
+
+    async def save(self):
+        try:
+            await self.context.storage_state(path=self.state_path)
+        except Exception:
+            pass
+
+    def report(self, log):
+        """Ersparnis gegenüber accept_cookies ohne Banner: gemessen, wenn der
+        vollständige Check keinen Banner fand, sonst der schlechteste Fall
+        (alle Selektoren bis zum Timeout). Ein Klick-Durchlauf ist kein Maßstab."""
+        if self.full_ms is None or not self.quick_n:
+            return
+        quick_avg = self.quick_ms / self.quick_n
+        if self.no_banner_ms is not None:
+            baseline, how = self.no_banner_ms, "gemessen"
+        else:
+            baseline, how = len(COOKIE_SELECTORS) * COOKIE_VISIBLE_TIMEOUT_MS, "angenommen"
+        saved = max(baseline - quick_avg, 0.0)
+        log(
+            f"Consent: 1x vollständig ({self.full_ms:.0f} ms), {self.quick_n}x Schnellcheck "
+            f"(Ø {quick_avg:.0f} ms) statt Check ohne Banner ({how} {baseline:.0f} ms) "
+            f"-> ca. {saved:.0f} ms/Inserat, {saved * self.quick_n / 1000:.1f}s gespart"
+        )
+
 async def scroll_until_all_loaded(page, log, max_rounds=20):
     last_count = 0
     stable = 0
@@ -120,199 +229,631 @@ async def block_resources(route):
 
     await route.continue_()
 
-def extract_features(title, description):
-    features = []
-    blob = " ".join([t for t in [title, description] if t]).lower()
-
-    rules = {
-        "carplay": ["carplay"],
-        "android_auto": ["android auto"],
-        "acc": ["acc", "adaptiver tempomat", "abstandsregeltempomat"],
-        "led": [" led", "matrix", "xenon"],
-        "sitzheizung": ["sitzheizung"],
-        "allrad": ["quattro", "xdrive", "4motion", "allrad"],
-        "navi": ["navi", "navigation", "mmi", "comand"],
-        "sportpaket": ["s line", "s-line", "m paket", "m-paket", "r-line"],
-        "anhängerkupplung": ["anhängerkupplung", "ahk"],
+async def extract_car_dom(page, url):
+    title_el = await page.query_selector("h1")
+    title = (await title_el.inner_text()).strip() if title_el else None
+
+    price_el = await page.query_selector('span[data-testid^="contact-box-price-box-price-value"]')
+    price = parse_int((await price_el.inner_text()).strip()) if price_el else None
+
+    # attribute items -> build kv list once (faster than querying each time)
+    kv = []
+    items = await page.query_selector_all('li[data-testid="attribute-item"]')
+    for it in items:
+        t = await it.query_selector('[data-testid="attribute-title"]')
+        v = await it.query_selector('[data-testid="attribute-value"]')
+        if t and v:
+            kv.append(((await t.inner_text()).strip(), (await v.inner_text()).strip()))
+
+    km_raw = get_attribute_from_kv(kv, "kilometer")
+    year_raw = get_attribute_from_kv(kv, "erstzulassung")
+    power_raw = get_attribute_from_kv(kv, "leistung")
+    fuel_raw = get_attribute_from_kv(kv, "kraftstoff") or get_attribute_from_kv(kv, "treibstoff")
+    trans_raw = get_attribute_from_kv(kv, "getriebe")
+    drive_raw = get_attribute_from_kv(kv, "antrieb") or get_attribute_from_kv(kv, "allrad")
+    body_raw = get_attribute_from_kv(kv, "karosserie") or get_attribute_from_kv(kv, "bauart")
+
+    km = parse_int(km_raw)
+    year = int(year_raw.split("/")[-1]) if year_raw and "/" in year_raw else None
+    power_ps = parse_power_ps(power_raw)
+
+    desc_el = await page.query_selector('[data-testid="description"]')
+    description = (await desc_el.inner_text()).strip() if desc_el else None
+
+    brand, model = get_catalog().split_title(title)
+
+    return {
+        "platform": "willhaben",
+        "external_id": extract_external_id(url),
+        "url": url,
+        "title": title,
+        "brand": brand,
+        "model": model,
+        "year": year,
+        "km": km,
+        "price": price,
+        "power_ps": power_ps,
+        "fuel_type": fuel_raw,
+        "transmission": trans_raw,
+        "drive": drive_raw,
+        "body_type": body_raw,
+        "variant": None,
+        "seller_type": None,
+        "location": None,
+        "description": description,
     }
-    for k, needles in rules.items():
-        if any(n in blob for n in needles):
-            features.append(k)
-    return features
 
-async def parse_detail(context, url, log):
+async def extract_car_json(page, url):
+    # ein einziger Round-Trip statt einem pro Feld
+    page_props = await page.evaluate(NEXT_DATA_JS)
+    car = car_from_page_props(page_props, url)
+    if car is not None and archive.enabled():
+        await asyncio.to_thread(archive.archive_payload, url, "next_data", page_props)
+    if car and not car.get("external_id"):
+        car["external_id"] = extract_external_id(url)
+    return car
+
+async def save_car(car, log, sink=insert_car):
+    feats = extract_features(car["title"], car["description"])
+    car["features_raw"] = json.dumps(feats, ensure_ascii=False)
+
+    # DbWriter nimmt per Queue an; andere sinks laufen im Thread, nie im Event-Loop
+    submit = getattr(sink, "submit", None)
+    if submit is not None:
+        await submit(car)
+    else:
+        await asyncio.to_thread(sink, car)
+    log(f"Gespeichert: {car['url']}")
+
+async def parse_detail(context, url, log, engine="json", consent=None, sink=insert_car):
     page = await context.new_page()
     try:
-        await page.goto(url, wait_until="commit", timeout=30000)
+        resp = await page.goto(url, wait_until="commit", timeout=30000)
+        if resp is not None and resp.status in (403, 429, 503):
+            raise BotChallenge(f"HTTP {resp.status}: {url}")
+        if resp is not None and resp.status in (404, 410):
+            raise ListingGone(f"HTTP {resp.status}: {url}")
         await page.wait_for_timeout(250)
-        await accept_cookies(page)
-
-        title_el = await page.query_selector("h1")
-        title = (await title_el.inner_text()).strip() if title_el else None
-
-        price_el = await page.query_selector('span[data-testid^="contact-box-price-box-price-value"]')
-        price = parse_int((await price_el.inner_text()).strip()) if price_el else None
-
-        # attribute items -> build kv list once (faster than querying each time)
-        kv = []
-        items = await page.query_selector_all('li[data-testid="attribute-item"]')
-        for it in items:
-            t = await it.query_selector('[data-testid="attribute-title"]')
-            v = await it.query_selector('[data-testid="attribute-value"]')
-            if t and v:
-                kv.append(((await t.inner_text()).strip(), (await v.inner_text()).strip()))
-
-        km_raw = get_attribute_from_kv(kv, "kilometer")
-        year_raw = get_attribute_from_kv(kv, "erstzulassung")
-        power_raw = get_attribute_from_kv(kv, "leistung")
-        fuel_raw = get_attribute_from_kv(kv, "kraftstoff") or get_attribute_from_kv(kv, "treibstoff")
-        trans_raw = get_attribute_from_kv(kv, "getriebe")
-        drive_raw = get_attribute_from_kv(kv, "antrieb") or get_attribute_from_kv(kv, "allrad")
-        body_raw = get_attribute_from_kv(kv, "karosserie") or get_attribute_from_kv(kv, "bauart")
-
-        km = parse_int(km_raw)
-        year = int(year_raw.split("/")[-1]) if year_raw and "/" in year_raw else None
-        power_ps = parse_power_ps(power_raw)
-
-        desc_el = await page.query_selector('[data-testid="description"]')
-        description = (await desc_el.inner_text()).strip() if desc_el else None
-
-        brand, model = None, None
-        if title:
-            parts = title.split()
-            if len(parts) > 0:
-                brand = parts[0]
-            if len(parts) > 1:
-                model = parts[1]
-
-        feats = extract_features(title, description)
-
-        car = {
-            "platform": "willhaben",
-            "external_id": extract_external_id(url),
-            "url": url,
-            "title": title,
-            "brand": brand,
-            "model": model,
-            "year": year,
-            "km": km,
-            "price": price,
-            "power_ps": power_ps,
-            "fuel_type": fuel_raw,
-            "transmission": trans_raw,
-            "drive": drive_raw,
-            "body_type": body_raw,
-            "variant": None,
-            "seller_type": None,
-            "location": None,
-            "features_raw": json.dumps(feats, ensure_ascii=False),
-            "description": description,
-        }
-
-        insert_car(car)
-        log(f"Gespeichert: {url}")
+        if consent is not None:
+            await consent.handle(page)
+        else:
+            await accept_cookies(page)
+
+        car = None
+        if engine == "json":
+            car = await extract_car_json(page, url)
+            if car is None:
+                log(f"Kein __NEXT_DATA__, DOM-Fallback: {url}")
+        if car is None:
+            # nicht archiviert: ohne __NEXT_DATA__ kann reparse_archive.py die Seite nicht lesen
+            car = await extract_car_dom(page, url)
+
+        await save_car(car, log, sink)
 
     finally:
         await page.close()
 
-async def worker(name, context, queue, log):
+async def worker(name, context, retry, log, engine="json", consent=None, limiter=None, sink=insert_car):
     while True:
-        url = await queue.get()
+        _, _, url, attempt = await retry.get()
         if url is None:
-            queue.task_done()
+            retry.queue.task_done()
             return
+        if limiter is not None:
+            await limiter.acquire()
+        t0 = time.perf_counter()
+        outcome = "ok"
+        error = None
+        gone = False
         try:
             log(f"[{name}] {url}")
-            await parse_detail(context, url, log)
+            await parse_detail(context, url, log, engine=engine, consent=consent, sink=sink)
+        except ListingGone as e:
+            gone = True
+            log(f"[{name}] Nicht mehr vorhanden: {e}")
         except PlaywrightTimeoutError as e:
+            outcome, error = "timeout", e
             log(f"[{name}] Timeout: {e}")
+        except BotChallenge as e:
+            outcome, error = "challenge", e
+            log(f"[{name}] Bot-Schutz: {e}")
         except Exception as e:
+            outcome, error = "error", e
             log(f"[{name}] Fehler: {e}")
         finally:
-            queue.task_done()
+            if limiter is not None:
+                await limiter.release(time.perf_counter() - t0, outcome)
+            if gone:
+                retry.drop(url)
+            elif error is None:
+                retry.done(url)
+            else:
+                retry.failed(url, attempt, error)
+
+async def collect_links_dom(page, log):
+    all_links = set()
+    page_number = 1
 
-def run_scrape(start_url: str, log_cb=print, headless: bool = True):
-    def log(msg: str):
-        try:
-            log_cb(str(msg))
-        except Exception:
-            print(str(msg))
+    while True:
+        log(f"Seite {page_number}")
+        await scroll_until_all_loaded(page, log, max_rounds=12)
 
-    async def runner():
-        log(f"run_scrape gestartet: {start_url}")
+        link_elements = await page.query_selector_all('a[href^="/iad/gebrauchtwagen/d/auto/"]')
+        for el in link_elements:
+            href = await el.get_attribute("href")
+            if href:
+                all_links.add("https://www.willhaben.at" + href)
+
+        log(f"Gesammelte Inserate gesamt: {len(all_links)}")
 
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(
-                headless=headless,
-                args=["--disable-blink-features=AutomationControlled"]
-            )
-            context = await browser.new_context(
-                user_agent=REAL_UA,
-                locale="de-AT",
-                timezone_id="Europe/Vienna",
-                viewport={"width": 1280, "height": 800}
-            )
+        next_page = page_number + 1
+        next_btn = await page.query_selector(f'a[aria-label="Zur Seite {next_page}"]')
+        if not next_btn:
+            log("Keine weitere Seite gefunden")
+            break
 
-            await context.route("**/*", block_resources)
+        log(f"Wechsle zu Seite {next_page}")
+        await next_btn.click()
+        await page.wait_for_timeout(1800)
+        page_number += 1
 
-            page = await context.new_page()
+    return all_links
 
-            await page.goto("https://www.willhaben.at", wait_until="domcontentloaded")
-            await page.wait_for_timeout(900)
-            clicked = await accept_cookies(page)
-            log(f"Cookie Accept (home): {'ok' if clicked else 'nicht gefunden/ignoriert'}")
+async def collect_cards(load, start_url, page_props, log, search_run=None):
+    """Liest die Ergebnis-Karten aller Seiten aus __NEXT_DATA__.
 
-            await page.goto(start_url, wait_until="domcontentloaded", timeout=60000)
+    page_props ist Seite 1 (mit rows=SEARCH_ROWS geladen). Aus der Trefferzahl
+    ergibt sich die Seitenzahl, Seite 2..N werden über load(url) parallel per
+    URL geladen. None, wenn die Suchseite keinen eingebetteten State hat.
+    Karten ohne Preis/Titel stehen als url -> None drin (nur Link).
+    Fehlgeschlagene Seiten und die Trefferzahl werden in search_run vermerkt.
+    """
+    if search_result(page_props) is None:
+        return None
+
+    def add_page(props):
+        found = cars_from_search(props)
+        for url in search_urls(props):
+            cards.setdefault(url, None)
+        for car in found:
+            cards[car["url"]] = car
+        return found
+
+    t0 = time.perf_counter()
+    total = rows_found(page_props)
+    if search_run is not None:
+        search_run.expect(total)
+    cards = {}
+    first = add_page(page_props)
+    log(f"Seite 1: {len(first)} Karten, Treffer gesamt: {total if total is not None else '?'}")
+
+    # effektive Seitengröße aus Seite 1, falls die Seite weniger als rows liefert
+    page_size = len(search_urls(page_props))
+    pages = 1
+    if total and page_size and total > page_size:
+        pages = math.ceil(total / page_size)
+
+    if pages > 1:
+        sem = asyncio.Semaphore(PAGE_CONCURRENCY)
+
+        async def one(n):
+            async with sem:
+                return n, await load(with_page(start_url, n, rows=SEARCH_ROWS))
+
+        results = await asyncio.gather(*(one(n) for n in range(2, pages + 1)), return_exceptions=True)
+        for res in results:
+            if isinstance(res, BotChallenge):
+                raise res
+            if isinstance(res, Exception):
+                log(f"Suchseite fehlgeschlagen: {res}")
+                if search_run is not None:
+                    search_run.page_failed()
+                continue
+            n, props = res
+            found = add_page(props)
+            log(f"Seite {n}: {len(found)} Karten")
+
+    log(f"{len(cards)} Inserate von {pages} Seiten in {time.perf_counter() - t0:.1f}s gesammelt")
+    return cards
+
+def is_stale(last_seen, cutoff):
+    if not last_seen:
+        return True
+    try:
+        return datetime.fromisoformat(str(last_seen)) < cutoff
+    except ValueError:
+        return True
+
+def select_for_detail(cards, known, refresh_age_hours=REFRESH_AGE_HOURS):
+    """Teilt die gesammelten Links in "Detailseite laden" und "unverändert".
+
+    cards: url -> Karten-car (Listenmodus) oder None (nur Link, kein Kartenpreis).
+    known: url -> (price, last_seen) aus db.get_known.
+    Geladen werden neue Inserate, Inserate mit geändertem Kartenpreis und
+    Inserate, deren last_seen älter als refresh_age_hours ist.
+    """
+    # last_seen kommt aus datetime('now') -> UTC
+    cutoff = datetime.utcnow() - timedelta(hours=refresh_age_hours)
+    fetch, unchanged = [], []
+    for url, car in cards.items():
+        prev = known.get(url)
+        card_price = car.get("price") if car else None
+        if prev is None:
+            fetch.append(url)
+        elif card_price is not None and (prev[0] is None or int(prev[0]) != int(card_price)):
+            fetch.append(url)
+        elif is_stale(prev[1], cutoff):
+            fetch.append(url)
+        else:
+            unchanged.append(url)
+    return fetch, unchanged
+
+async def scrape_details_http(fetcher, urls, log, retry, sink=insert_car):
+    """Detailseiten per HTTP; gibt die URLs zurück, die einen Browser brauchen."""
+    fallback = []
+    challenged = False
+
+    async def one(url):
+        nonlocal challenged
+        for attempt in range(retry.max_attempts):
+            if challenged:
+                fallback.append(url)
+                return
+            try:
+                page_props = await fetcher.fetch_page_props(url)
+                car = car_from_page_props(page_props, url)
+                if car is None:
+                    log(f"Kein __NEXT_DATA__ per HTTP, Browser-Fallback: {url}")
+                    fallback.append(url)
+                    return
+                if archive.enabled():
+                    await asyncio.to_thread(archive.archive_payload, url, "next_data", page_props)
+                await save_car(car, log, sink)
+                retry.succeeded.add(url)
+                return
+            except ListingGone as e:
+                log(f"[HTTP] Nicht mehr vorhanden: {e}")
+                retry.gone.add(url)
+                return
+            except BotChallenge as e:
+                if not challenged:
+                    log(f"Bot-Schutz erkannt ({e}), restliche Inserate über Playwright")
+                challenged = True
+                fallback.append(url)
+                return
+            except Exception as e:
+                log(f"[HTTP] Fehler (Versuch {attempt + 1}): {url}: {e}")
+                if attempt + 1 >= retry.max_attempts:
+                    retry.dead[url] = (attempt + 1, str(e)[:500])
+                    return
+                retry.retries += 1
+                await asyncio.sleep(backoff_delay(attempt))
+
+    await asyncio.gather(*(one(u) for u in urls))
+    return fallback
+
+async def scrape_http(fetcher, start_url, log, mode, retry, incremental=False, dead=(), sink=insert_car,
+                      search_run=None):
+    """HTTP-Backend. Gibt die URLs für den Playwright-Fallback zurück oder None,
+    wenn schon die Suche nicht per HTTP lesbar war."""
+    try:
+        first = await fetcher.fetch_page_props(with_page(start_url, 1, rows=SEARCH_ROWS))
+        cards = await collect_cards(fetcher.fetch_page_props, start_url, first, log, search_run)
+    except BotChallenge as e:
+        log(f"Bot-Schutz auf der Suchseite ({e}), komplett über Playwright")
+        return None
+    if cards is None:
+        log("Kein __NEXT_DATA__ auf der Suchseite (HTTP), komplett über Playwright")
+        return None
+    if search_run is not None:
+        search_run.add(cards)
+
+    if mode == "list" or incremental:
+        ad_links = await select_and_touch(cards, log, sink if mode == "list" else None)
+    else:
+        ad_links = list(cards)
+
+    ad_links = list(dead) + [u for u in ad_links if u not in set(dead)]
+    log(f"HTTP: {len(ad_links)} Detailseiten ({len(dead)} aus Dead-Letter), max. {fetcher.concurrency} parallel")
+    fallback = await scrape_details_http(fetcher, ad_links, log, retry, sink)
+    log(f"HTTP fertig: {fetcher.requests} Requests, {len(fallback)} für Playwright")
+    return fallback
+
+async def select_and_touch(cards, log, sink=None):
+    """Ein Bulk-Lookup für alle Links, unveränderte Inserate bekommen nur last_seen.
+    Mit sink (Listenmodus) werden die Karten selbst gespeichert: Preis, km,
+    Jahr usw. kommen dann aus der Ergebnisliste, Detailseiten nur für neue oder
+    geänderte Inserate."""
+    known = await asyncio.to_thread(get_known, cards.keys())
+    ad_links, unchanged = select_for_detail(cards, known)
+    saved = 0
+    if sink is not None:
+        # vor den Detailseiten in die Queue: deren Daten überschreiben die Karte
+        submit = getattr(sink, "submit", None)
+        for car in cards.values():
+            if not car:
+                continue
+            if submit is not None:
+                await submit(car)
+            else:
+                await asyncio.to_thread(sink, car)
+            saved += 1
+    # gespeicherte Karten haben schon ein frisches last_seen
+    touched = await asyncio.to_thread(touch_last_seen, [u for u in unchanged if sink is None or not cards[u]])
+    log(
+        f"Inkrementell: {len(cards)} Links, {len(cards) - len(known)} neu, "
+        f"{len(ad_links)} zu laden, {saved} Karten gespeichert, {touched} nur last_seen aktualisiert"
+    )
+    return ad_links
+
+async def scrape_playwright(start_url, log, headless, engine, mode, retry, incremental=False, urls=None, dead=(),
+                            sink=insert_car, collect_only=False, search_run=None):
+    """Browser-Pfad. Mit urls werden nur diese Detailseiten verarbeitet (HTTP-Fallback
+    oder ein Shard). collect_only=True sammelt nur und gibt die Links zurück."""
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(
+            headless=headless,
+            args=["--disable-blink-features=AutomationControlled"]
+        )
+        has_state = os.path.exists(STATE_PATH)
+        context = await browser.new_context(
+            user_agent=REAL_UA,
+            locale="de-AT",
+            timezone_id="Europe/Vienna",
+            viewport={"width": 1280, "height": 800},
+            storage_state=STATE_PATH if has_state else None,
+        )
+        consent = Consent(context)
+
+        await context.route("**/*", block_resources)
+
+        page = await context.new_page()
+
+        if urls is not None:
+            ad_links = list(urls)
+        else:
+            if has_state:
+                log(f"Session-State geladen: {STATE_PATH} (Startseite übersprungen)")
+            else:
+                await page.goto("https://www.willhaben.at", wait_until="domcontentloaded")
+                await page.wait_for_timeout(900)
+                clicked = await consent.handle(page)
+                log(f"Cookie Accept (home): {'ok' if clicked else 'nicht gefunden/ignoriert'}")
+
+            await page.goto(with_page(start_url, 1, rows=SEARCH_ROWS), wait_until="domcontentloaded", timeout=60000)
             await page.wait_for_timeout(900)
-            clicked = await accept_cookies(page)
+            clicked = await consent.handle(page)
             log(f"Cookie Accept (search): {'ok' if clicked else 'nicht gefunden/ignoriert'}")
 
-            all_links = set()
-            page_number = 1
+            async def load(url):
+                search_page = await context.new_page()
+                try:
+                    await search_page.goto(url, wait_until="domcontentloaded", timeout=60000)
+                    return await search_page.evaluate(NEXT_DATA_JS)
+                finally:
+                    await search_page.close()
+
+            cards = await collect_cards(load, start_url, await page.evaluate(NEXT_DATA_JS), log, search_run)
+            complete = cards is not None
+            if cards is None:
+                log("Kein __NEXT_DATA__ auf der Suchseite, Links per Scroll/Klick sammeln")
+                cards = dict.fromkeys(await collect_links_dom(page, log))
+            if search_run is not None:
+                # Scroll/Klick liefert keine Trefferzahl: nicht als vollständig werten
+                search_run.add(cards, complete=complete)
+            if mode == "list" or incremental:
+                ad_links = await select_and_touch(cards, log, sink if mode == "list" else None)
+            else:
+                ad_links = list(cards)
+
+        if collect_only:
+            await page.close()
+            await context.close()
+            await browser.close()
+            dead_set = set(dead)
+            return list(dead) + [u for u in ad_links if u not in dead_set]
+
+        # zur Laufzeit lesen: GUI/Server setzen MAX_WORKERS erst nach dem Import
+        start_workers = int(os.environ.get("MAX_WORKERS", MAX_WORKERS))
+        limiter = AdaptiveLimiter(start_workers, SCRAPE_MIN_WORKERS, SCRAPE_MAX_WORKERS, log)
+        log(
+            f"Starte Parallel-Detailverarbeitung mit {limiter.limit} Workern "
+            f"(adaptiv {limiter.min_workers}-{limiter.max_workers}, Engine: {engine})"
+        )
+
+        dead_set = set(dead)
+        for u in dead:
+            retry.put(u, priority=PRIO_DEAD_LETTER)
+        for u in ad_links:
+            if u not in dead_set:
+                retry.put(u)
+
+        tasks = []
+        for i in range(limiter.max_workers):
+            tasks.append(asyncio.create_task(
+                worker(f"W{i+1}", context, retry, log, engine=engine, consent=consent, limiter=limiter, sink=sink)
+            ))
+
+        await retry.join()
+        retry.stop(len(tasks))
+        await asyncio.gather(*tasks)
+        log(limiter.summary())
+        consent.report(log)
 
-            while True:
-                log(f"Seite {page_number}")
-                await scroll_until_all_loaded(page, log, max_rounds=12)
+        await page.close()
+        await context.close()
+        await browser.close()
+        return ad_links
 
-                link_elements = await page.query_selector_all('a[href^="/iad/gebrauchtwagen/d/auto/"]')
-                for el in link_elements:
-                    href = await el.get_attribute("href")
-                    if href:
-                        all_links.add("https://www.willhaben.at" + href)
+def run_shard(shard_id, urls, out_q, headless, engine):
+    """Läuft in einem eigenen Prozess: eigener Browser, eigener Event-Loop.
+    Autos und Logzeilen gehen über out_q an den Elternprozess (einziger DB-Writer)."""
+    def log(msg):
+        out_q.put(("log", shard_id, str(msg)))
 
-                log(f"Gesammelte Inserate gesamt: {len(all_links)}")
+    def sink(car):
+        out_q.put(("car", shard_id, car))
 
-                next_page = page_number + 1
-                next_btn = await page.query_selector(f'a[aria-label="Zur Seite {next_page}"]')
-                if not next_btn:
-                    log("Keine weitere Seite gefunden")
-                    break
+    async def runner():
+        retry = RetryQueue(log)
+        t0 = time.perf_counter()
+        try:
+            await scrape_playwright(None, log, headless, engine, "detail", retry, urls=urls, sink=sink)
+        except Exception as e:
+            log(f"Shard abgebrochen: {e}")
+        out_q.put(("done", shard_id, {
+            "urls": len(urls),
+            "ok": len(retry.succeeded),
+            "retries": retry.retries,
+            "elapsed": time.perf_counter() - t0,
+            "succeeded": list(retry.succeeded),
+            "gone": list(retry.gone),
+            "dead": retry.dead,
+        }))
 
-                log(f"Wechsle zu Seite {next_page}")
-                await next_btn.click()
-                await page.wait_for_timeout(1800)
-                page_number += 1
+    asyncio.run(runner())
 
-            ad_links = list(all_links)
-            log(f"Starte Parallel-Detailverarbeitung mit {MAX_WORKERS} Workern")
+def run_sharded(urls, shards, log, headless, engine, retry, sink=insert_car, target=run_shard):
+    """Verteilt die URLs reihum auf `shards` Prozesse und schreibt alle Autos
+    hier im Elternprozess über sink in die DB. Stirbt ein Shard-Prozess ohne
+    Abschlussmeldung, landen seine nicht gespeicherten URLs in retry.dead."""
+    ctx = mp.get_context("spawn")
+    out_q = ctx.Queue(maxsize=1000)
+    parts = [urls[i::shards] for i in range(shards)]
+    procs = {}
+    for i, part in enumerate(parts, start=1):
+        if not part:
+            continue
+        proc = ctx.Process(target=target, args=(i, part, out_q, headless, engine), daemon=True)
+        proc.start()
+        procs[i] = proc
+    log(f"{len(procs)} Shards gestartet ({', '.join(str(len(p)) for p in parts if p)} URLs)")
+
+    t0 = time.perf_counter()
+    stats = {}
+    saved = {i: set() for i in procs}
+    written = 0
+    while len(stats) < len(procs):
+        try:
+            kind, shard_id, payload = out_q.get(timeout=1.0)
+        except queue.Empty:
+            if not any(proc.is_alive() for proc in procs.values()):
+                log("Alle Shard-Prozesse beendet, aber nicht alle haben Ergebnisse gemeldet")
+                break
+            continue
+        if kind == "car":
+            saved[shard_id].add(payload["url"])
+            try:
+                sink(payload)
+                written += 1
+            except Exception as e:
+                log(f"[S{shard_id}] DB-Fehler: {e}")
+        elif kind == "log":
+            log(f"[S{shard_id}] {payload}")
+        elif kind == "done":
+            stats[shard_id] = payload
+
+    for proc in procs.values():
+        proc.join(timeout=10)
+
+    for shard_id, proc in procs.items():
+        if shard_id in stats:
+            continue
+        lost = [u for u in parts[shard_id - 1] if u not in saved[shard_id]]
+        log(f"[S{shard_id}] Prozess ohne Ergebnis beendet (Exitcode {proc.exitcode}), "
+            f"{len(lost)} URLs in die Dead-Letter")
+        for u in lost:
+            retry.dead[u] = (1, f"Shard-Prozess beendet (Exitcode {proc.exitcode})")
+
+    elapsed = time.perf_counter() - t0
+    for shard_id in sorted(stats):
+        st = stats[shard_id]
+        rate = st["ok"] / st["elapsed"] * 60 if st["elapsed"] else 0.0
+        log(
+            f"[S{shard_id}] {st['ok']}/{st['urls']} Inserate in {st['elapsed']:.0f}s "
+            f"({rate:.1f}/min, {st['retries']} Retries, {len(st['dead'])} fehlgeschlagen)"
+        )
+        retry.succeeded.update(st["succeeded"])
+        retry.gone.update(st["gone"])
+        retry.dead.update(st["dead"])
+        retry.retries += st["retries"]
+    log(f"Shards gesamt: {written} Inserate in {elapsed:.0f}s ({written / elapsed * 60 if elapsed else 0:.1f}/min)")
+
+def run_scrape(start_url: str, log_cb=print, headless: bool = True, engine: str = DETAIL_ENGINE,
+               mode: str = "detail", backend: str = FETCH_BACKEND, incremental: bool = False,
+               shards: int = SCRAPE_SHARDS):
+    """mode="detail": jede gefundene URL öffnen (bisheriges Verhalten).
+    mode="list": Karten der Ergebnisseiten lesen und speichern, Detailseiten nur für neue
+    oder im Preis geänderte Inserate öffnen.
+    backend="playwright": alles im Browser. backend="http": Such- und
+    Detailseiten per HTTP, Playwright nur bei Bot-Schutz.
+    incremental=True: auch im Detail-Modus nur neue, geänderte oder ältere als
+    REFRESH_AGE_HOURS laden (im Listenmodus immer aktiv).
+    shards > 1: Detailseiten im Browser auf so viele Prozesse verteilen.
+    """
+    def log(msg: str):
+        try:
+            log_cb(str(msg))
+        except Exception:
+            print(str(msg))
 
-            q = asyncio.Queue()
-            for u in ad_links:
-                await q.put(u)
-            for _ in range(MAX_WORKERS):
-                await q.put(None)
+    async def runner():
+        log(f"run_scrape gestartet: {start_url} (Modus: {mode}, Backend: {backend}, Shards: {shards})")
 
-            tasks = []
-            for i in range(MAX_WORKERS):
-                tasks.append(asyncio.create_task(worker(f"W{i+1}", context, q, log)))
+        # Katalog für Marke/Modell aus dem Titel, nur wenn älter als die TTL
+        await asyncio.to_thread(make_model_catalog.refresh, False, log)
 
-            await q.join()
-            await asyncio.gather(*tasks)
+        retry = RetryQueue(log)
+        try:
+            dead = load_failures()
+        except Exception as e:
+            log(f"Dead-Letter-Tabelle nicht lesbar ({e}), python migrations.py ausführen?")
+            dead = []
+        if dead:
+            log(f"{len(dead)} fehlgeschlagene URLs aus dem letzten Lauf werden zuerst geladen")
+
+        # alle Schreibzugriffe laufen gebündelt im Writer-Thread
+        writer = DbWriter(log).start()
+        search_run = SearchRun(start_url, log)
+        try:
+            urls = None
+            if backend == "http":
+                fetcher = HttpFetcher()
+                try:
+                    urls = await scrape_http(fetcher, start_url, log, mode, retry, incremental, dead=dead, sink=writer,
+                                             search_run=search_run)
+                finally:
+                    fetcher.close()
+
+            if shards > 1 and (urls is None or urls):
+                if urls is None:
+                    urls = await scrape_playwright(start_url, log, headless, engine, mode, retry, incremental,
+                                                   dead=dead, sink=writer, collect_only=True, search_run=search_run)
+                await asyncio.to_thread(run_sharded, urls, shards, log, headless, engine, retry, writer)
+            elif urls is None or urls:
+                await scrape_playwright(start_url, log, headless, engine, mode, retry, incremental,
+                                        urls=urls, dead=dead if urls is None else (), sink=writer,
+                                        search_run=search_run if urls is None else None)
+        finally:
+            await asyncio.to_thread(writer.close)
 
-            await page.close()
-            await context.close()
-            await browser.close()
+        # erst nach dem Writer: gerade gespeicherte Inserate haben ein frisches last_seen
+        try:
+            search_run.finish(gone=retry.gone)
+        except Exception as e:
+            log(f"Lebenszyklus nicht aktualisiert: {e}")
+
+        recovered = clear_failures((retry.succeeded | retry.gone) & set(dead)) if dead else 0
+        purged = 0
+        try:
+            record_failures(retry.dead)
+            purged = purge_failures()
+        except Exception as e:
+            log(f"Dead-Letter konnten nicht gespeichert werden: {e}")
+        if purged:
+            log(f"Dead-Letter: {purged} URLs nach zu vielen Versuchen aufgegeben")
+        log(f"Wiederholungen: {retry.retries}, aus Dead-Letter gerettet: {recovered}, endgültig fehlgeschlagen: {len(retry.dead)}")
 
-            log("Alle Inserate gespeichert")
+        log("Alle Inserate gespeichert")
 
     asyncio.run(runner())
@@ -0,0 +1,180 @@
+import re
+
+from make_model_catalog import get_catalog
+
+# Ein einziger evaluate-Call: wartet kurz auf den eingebetteten Next.js-State
+# (bei wait_until="commit" ist das Script evtl. noch nicht geparst) und gibt
+# nur pageProps zurück, damit nicht der ganze State serialisiert wird.
+NEXT_DATA_JS = """
+async () => {
+    for (let i = 0; i < 40; i++) {
+        let d = window.__NEXT_DATA__;
+        if (!d) {
+            const el = document.getElementById("__NEXT_DATA__");
+            if (el && el.textContent) {
+                try { d = JSON.parse(el.textContent); } catch (e) { d = null; }
+            }
+        }
+        if (d) return (d.props && d.props.pageProps) || null;
+        await new Promise(r => setTimeout(r, 100));
+    }
+    return null;
+}
+"""
+
+BASE_URL = "https://www.willhaben.at"
+KW_TO_PS = 1.35962
+
+
+def attribute_map(advert):
+    """Flacht advert["attributes"]["attribute"] zu {NAME: wert} ab (erster Wert)."""
+    attrs = (advert or {}).get("attributes") or {}
+    items = attrs.get("attribute") if isinstance(attrs, dict) else attrs
+    out = {}
+    for a in items or []:
+        name = a.get("name")
+        values = a.get("values") or []
+        if name and values:
+            out[name.upper()] = values[0]
+    return out
+
+
+def first_of(attrs, *keys):
+    for k in keys:
+        v = attrs.get(k)
+        if v not in (None, ""):
+            return v
+    return None
+
+
+def to_int(value):
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    digits = re.sub(r"[^\d]", "", str(value).split(",")[0])
+    return int(digits) if digits else None
+
+
+def strip_html(text):
+    if not text:
+        return None
+    text = re.sub(r"<br\s*/?>", "\n", text, flags=re.I)
+    text = re.sub(r"<[^>]+>", "", text)
+    return text.strip() or None
+
+
+def advert_details(page_props):
+    if not isinstance(page_props, dict):
+        return None
+    return page_props.get("advertDetails")
+
+
+def car_from_advert(advert, url):
+    """Mappt ein Willhaben-Advert (Detail oder Suchergebnis) auf das car-Dict.
+
+    Gibt None zurück, wenn die Pflichtfelder fehlen – dann soll der Aufrufer
+    auf den DOM-Pfad ausweichen.
+    """
+    if not isinstance(advert, dict):
+        return None
+    a = attribute_map(advert)
+
+    title = first_of(a, "HEADING") or advert.get("description")
+    price = to_int(first_of(a, "PRICE", "PRICE/AMOUNT"))
+    if not title or price is None:
+        return None
+
+    kw = to_int(first_of(a, "ENGINE/EFFECT"))
+    brand = first_of(a, "CAR_MODEL/MAKE_RESOLVED", "CAR_MODEL/MAKE")
+    model = first_of(a, "CAR_MODEL/MODEL_RESOLVED", "CAR_MODEL/MODEL")
+    # Make/Model kommen teils nur als ID – dann Name aus dem Katalog, sonst aus dem Titel
+    catalog = get_catalog()
+    if brand and str(brand).isdigit():
+        brand = catalog.make_names.get(int(brand))
+    if model and str(model).isdigit():
+        model = catalog.model_names.get(int(model))
+    if not brand or not model:
+        t_brand, t_model = catalog.split_title(title)
+        brand = brand or t_brand
+        model = model or t_model
+
+    is_private = first_of(a, "ISPRIVATE")
+    seller_type = None
+    if is_private is not None:
+        seller_type = "privat" if str(is_private) == "1" else "händler"
+
+    return {
+        "platform": "willhaben",
+        "external_id": str(advert.get("id") or first_of(a, "ADID") or "") or None,
+        "url": url,
+        "title": title,
+        "brand": brand,
+        "model": model,
+        "year": to_int(first_of(a, "YEAR_MODEL")),
+        "km": to_int(first_of(a, "MILEAGE")),
+        "price": price,
+        "power_ps": int(kw * KW_TO_PS) if kw else None,
+        "fuel_type": first_of(a, "ENGINE/FUEL_RESOLVED", "ENGINE/FUEL"),
+        "transmission": first_of(a, "TRANSMISSION_RESOLVED", "TRANSMISSION"),
+        "drive": first_of(a, "WHEEL_DRIVE_RESOLVED", "WHEEL_DRIVE"),
+        "body_type": first_of(a, "CAR_TYPE_RESOLVED", "BODY_TYPE_RESOLVED"),
+        "variant": first_of(a, "CAR_MODEL/MODEL_SPECIFICATION", "TYPE"),
+        "seller_type": seller_type,
+        "location": first_of(a, "LOCATION", "DISTRICT"),
+        "description": strip_html(first_of(a, "BODY_DYN", "DESCRIPTION")),
+    }
+
+
+def car_from_page_props(page_props, url):
+    return car_from_advert(advert_details(page_props), url)
+
+
+def search_result(page_props):
+    if not isinstance(page_props, dict):
+        return None
+    return page_props.get("searchResult")
+
+
+def rows_found(page_props):
+    sr = search_result(page_props) or {}
+    return to_int(sr.get("rowsFound"))
+
+
+def advert_url(advert, base_url=BASE_URL):
+    seo = first_of(attribute_map(advert), "SEO_URL")
+    if not seo:
+        return None
+    if seo.startswith("http"):
+        return seo
+    seo = seo.lstrip("/")
+    if not seo.startswith("iad/"):
+        seo = "iad/" + seo
+    return f"{base_url}/{seo}"
+
+
+def advert_summaries(page_props):
+    sr = search_result(page_props) or {}
+    return (sr.get("advertSummaryList") or {}).get("advertSummary") or []
+
+
+def search_urls(page_props, base_url=BASE_URL):
+    """URLs aller Ergebnis-Karten, auch ohne Preis/Titel (für den Lebenszyklus)."""
+    urls = (advert_url(advert, base_url) for advert in advert_summaries(page_props))
+    return [u for u in urls if u]
+
+
+def cars_from_search(page_props, base_url=BASE_URL):
+    """Alle Ergebnis-Karten einer Suchseite als car-Dicts. Beschreibung und
+    Features bleiben None: beim Upsert einer Karte behält cars die Werte der
+    Detailseite (COALESCE in db.upsert_set_sql)."""
+    cars = []
+    for advert in advert_summaries(page_props):
+        url = advert_url(advert, base_url)
+        if not url:
+            continue
+        car = car_from_advert(advert, url)
+        if car:
+            car.update(description=None, features_raw=None, features_mask=None)
+            cars.append(car)
+    return cars
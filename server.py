@@ -12,6 +12,9 @@ class ScrapeRequest(BaseModel):
     url: str
     headless: bool = True
     workers: int = 4
+    mode: str = "detail"
+    backend: str = "playwright"
+    incremental: bool = False
 
 @app.get("/health")
 def health():
@@ -21,7 +24,8 @@ def health():
 def start_scrape(req: ScrapeRequest):
     def job():
         os.environ["MAX_WORKERS"] = str(req.workers)
-        run_scrape(req.url, log_cb=print, headless=req.headless)
+        run_scrape(req.url, log_cb=print, headless=req.headless, mode=req.mode, backend=req.backend,
+                   incremental=req.incremental)
 
     threading.Thread(target=job, daemon=True).start()
     return {"status": "started"}
@@ -0,0 +1,228 @@
+import os
+import sys
+import json
+import time
+
+import pandas as pd
+from sqlalchemy import inspect, text
+
+from storage import get_engine, sqlite_url
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.feather as feather
+except ImportError:  # optional: ohne pyarrow liest die Analyse direkt aus der DB
+    pa = pc = feather = None
+
+# Spaltenweiser Schnappschuss der Analyse-Spalten von cars als Arrow-/Feather-
+# Datei (typisiert, LZ4-komprimiert, Marken/Modelle/... als Dictionary). Die
+# Analyse lädt die Datei per Memory-Map statt bei jedem Lauf SELECT * inkl.
+# description über die DB zu ziehen.
+#
+# Aktualisierung inkrementell: aus der DB kommen nur Zeilen mit
+# last_seen >= Wasserstand oder neuer id (Re-Parse mit altem seen_at); die
+# Datei selbst wird danach neu geschrieben. Als inaktiv markierte Inserate
+# kommen über delisted_at mit. Änderungen ohne last_seen-Update
+# (features.py retag, make_model_catalog.py resolve, reparse_archive.py mit
+# altem seen_at auf bestehende Inserate) brauchen --full.
+#
+#   python snapshot.py          # inkrementell
+#   python snapshot.py --full   # komplett neu
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SNAPSHOT_PATH = os.environ.get("CARS_SNAPSHOT", os.path.join(BASE_DIR, "snapshots", "cars.arrow"))
+# "uncompressed" erlaubt echtes Zero-Copy beim Memory-Map, kostet aber Platz
+SNAPSHOT_COMPRESSION = os.environ.get("CARS_SNAPSHOT_COMPRESSION", "lz4")
+FORMAT_VERSION = 1
+
+COLUMN_TYPES = {
+    "id": "Int64",
+    "url": "string",
+    "title": "string",
+    "brand": "category",
+    "model": "category",
+    "variant": "string",
+    "body_type": "category",
+    "year": "Int16",
+    "km": "Int32",
+    "price": "Int32",
+    "power_ps": "Int16",
+    "fuel_type": "category",
+    "transmission": "category",
+    "drive": "category",
+    "seller_type": "category",
+    "location": "string",
+    "features_mask": "Int64",
+    "current_price": "Int32",
+    "active": "Int8",
+    "first_seen": "datetime",
+    "last_seen": "datetime",
+    "price_changed_at": "datetime",
+    "delisted_at": "datetime",
+}
+
+
+def available():
+    return feather is not None
+
+
+def meta_path(path=SNAPSHOT_PATH):
+    return path + ".json"
+
+
+def read_meta(path=SNAPSHOT_PATH):
+    try:
+        with open(meta_path(path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def engine_key(engine):
+    return engine.url.render_as_string(hide_password=True)
+
+
+def _columns(engine):
+    existing = {c["name"] for c in inspect(engine).get_columns("cars")}
+    return [c for c in COLUMN_TYPES if c in existing]
+
+
+def apply_types(df):
+    for col, typ in COLUMN_TYPES.items():
+        if col not in df.columns:
+            continue
+        if typ == "datetime":
+            df[col] = pd.to_datetime(df[col], format="ISO8601", errors="coerce")
+        elif typ == "category":
+            df[col] = df[col].astype("string").astype("category")
+        elif typ == "string":
+            df[col] = df[col].astype("string")
+        else:
+            df[col] = pd.to_numeric(df[col], errors="coerce").round().astype(typ)
+    return df
+
+
+def _changed_at(cols):
+    """Spalten, deren Maximum den Wasserstand bildet."""
+    return [c for c in ("last_seen", "delisted_at") if c in cols]
+
+
+def db_state(engine, cols):
+    """(Wasserstand, max(id)) der DB; alles per Index ohne Scan."""
+    parts = [f"MAX({c})" for c in _changed_at(cols)]
+    with engine.connect() as conn:
+        row = conn.execute(text(f"SELECT {', '.join(parts + ['MAX(id)'])} FROM cars")).one()
+    watermark = max((v for v in row[:-1] if v), default=None)
+    return watermark, row[-1] or 0
+
+
+def is_current(engine, path=SNAPSHOT_PATH):
+    meta = read_meta(path)
+    if not meta or meta.get("version") != FORMAT_VERSION or meta.get("db") != engine_key(engine):
+        return False
+    cols = _columns(engine)
+    if meta.get("columns") != cols or not os.path.exists(path):
+        return False
+    watermark, max_id = db_state(engine, cols)
+    return (watermark or "") <= (meta.get("watermark") or "") and max_id <= meta.get("max_id", 0)
+
+
+def filter_expression(schema, filters):
+    """Filter als UND-Liste von ODER-Gruppen [(spalte, op, wert), ...] ->
+    Arrow-Ausdruck; Textzeitstempel werden zum Spaltentyp gecastet."""
+    ops = {
+        "=": lambda f, v: f == v, "<": lambda f, v: f < v, "<=": lambda f, v: f <= v,
+        ">": lambda f, v: f > v, ">=": lambda f, v: f >= v,
+    }
+    expr = None
+    for group in filters:
+        alt = None
+        for col, op, value in group:
+            field = pc.field(col)
+            if op == "is null":
+                e = field.is_null()
+            elif op == "not null":
+                e = field.is_valid()
+            else:
+                typ = schema.field(col).type
+                if pa.types.is_timestamp(typ):
+                    value = pa.scalar(pd.Timestamp(value), type=typ)
+                e = ops[op](field, value)
+            alt = e if alt is None else alt | e
+        expr = alt if expr is None else expr & alt
+    return expr
+
+
+def load(path=SNAPSHOT_PATH, columns=None, filters=None):
+    """Schnappschuss als DataFrame (Memory-Map, nur die gewünschten Spalten).
+    filters wie bei filter_expression; gefiltert wird in Arrow, pandas sieht
+    nur die passenden Zeilen."""
+    table = feather.read_table(path, columns=columns, memory_map=True)
+    if filters:
+        table = table.filter(filter_expression(table.schema, filters))
+    return table.to_pandas()
+
+
+def _write(df, path, meta):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    tmp = path + ".tmp"
+    feather.write_feather(table, tmp, compression=SNAPSHOT_COMPRESSION)
+    os.replace(tmp, path)
+    with open(meta_path(path) + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=1)
+    os.replace(meta_path(path) + ".tmp", meta_path(path))
+
+
+def update(engine=None, path=SNAPSHOT_PATH, full=False, log=print):
+    """Bringt den Schnappschuss auf den Stand der DB. Gibt die Zahl der aus der
+    DB gelesenen Zeilen zurück (0 = war aktuell)."""
+    if not available():
+        raise RuntimeError("pyarrow fehlt (pip install pyarrow)")
+    engine = engine or get_engine(readonly=True)
+    t0 = time.perf_counter()
+
+    meta = read_meta(path)
+    cols = _columns(engine)
+    if (not meta or meta.get("version") != FORMAT_VERSION or meta.get("db") != engine_key(engine)
+            or meta.get("columns") != cols or not os.path.exists(path)):
+        full = True
+
+    watermark, max_id = db_state(engine, cols)
+    select = f"SELECT {', '.join(cols)} FROM cars"
+    if full:
+        delta = pd.read_sql_query(text(select), engine)
+        df = delta
+    else:
+        if (watermark or "") <= (meta["watermark"] or "") and max_id <= meta["max_id"]:
+            return 0
+        # >= statt >: Zeilen aus derselben Sekunde wie der alte Wasserstand
+        changed = " OR ".join(f"{c} >= :w" for c in _changed_at(cols))
+        delta = pd.read_sql_query(
+            text(f"{select} WHERE {changed} OR id > :max_id"),
+            engine, params={"w": meta["watermark"] or "", "max_id": meta["max_id"]},
+        )
+        old = load(path)
+        df = pd.concat([old[~old["id"].isin(delta["id"])], apply_types(delta.copy())], ignore_index=True)
+
+    df = apply_types(df)
+    _write(df, path, {
+        "version": FORMAT_VERSION,
+        "db": engine_key(engine),
+        "columns": cols,
+        "watermark": watermark,
+        "max_id": int(max_id),
+        "rows": len(df),
+        "written_at": time.time(),
+    })
+    log(f"Snapshot {'neu' if full else 'aktualisiert'}: {len(delta)} Zeilen aus der DB, "
+        f"{len(df)} gesamt ({time.perf_counter() - t0:.1f}s)")
+    return len(delta)
+
+
+if __name__ == "__main__":
+    from market_analysis import DB_PATH
+
+    db = next((a for a in sys.argv[1:] if not a.startswith("--")), DB_PATH)
+    update(get_engine(sqlite_url(db), readonly=True), full="--full" in sys.argv)
@@ -0,0 +1,97 @@
+import os
+import time
+import threading
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+
+from config import DATABASE_URL
+
+# Gemeinsame Engine-Fabrik für Scraper, Analyse und Export. Für SQLite mit
+# WAL: Leser (Analyse, Export) blockieren den Scraper nicht mehr und
+# umgekehrt; gleichzeitige Schreiber warten per busy_timeout statt mit
+# "database is locked" abzubrechen.
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    # in WAL sicher gegen Korruption, nur die letzten Commits gehen bei Stromausfall verloren
+    "synchronous": "NORMAL",
+    "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "15000")),
+    "mmap_size": int(os.environ.get("SQLITE_MMAP_MB", "256")) * 1024 * 1024,
+    # negativ = KiB
+    "cache_size": -int(os.environ.get("SQLITE_CACHE_MB", "64")) * 1024,
+    "temp_store": "MEMORY",
+    # WAL-Datei nach einem Checkpoint wieder auf diese Größe kürzen
+    "journal_size_limit": 64 * 1024 * 1024,
+}
+
+CHECKPOINT_INTERVAL_S = float(os.environ.get("SQLITE_CHECKPOINT_S", "300"))
+
+_engines = {}
+_lock = threading.Lock()
+
+
+def sqlite_url(path):
+    return f"sqlite:///{path}"
+
+
+def is_sqlite(engine):
+    return engine.dialect.name == "sqlite"
+
+
+def _sqlite_on_connect(readonly):
+    def on_connect(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        try:
+            for name, value in SQLITE_PRAGMAS.items():
+                cur.execute(f"PRAGMA {name}={value}")
+            if readonly:
+                cur.execute("PRAGMA query_only=ON")
+        finally:
+            cur.close()
+    return on_connect
+
+
+def get_engine(url=None, readonly=False):
+    """Eine Engine pro (URL, readonly) und Prozess. readonly=True für Analyse
+    und Export: gleiche DB, aber Schreibversuche schlagen fehl."""
+    u = make_url(url or DATABASE_URL)
+    key = (u.render_as_string(hide_password=False), readonly)
+    with _lock:
+        engine = _engines.get(key)
+        if engine is not None:
+            return engine
+
+        if u.get_backend_name() == "sqlite":
+            engine = create_engine(u, future=True, connect_args={"timeout": SQLITE_PRAGMAS["busy_timeout"] / 1000})
+            event.listen(engine, "connect", _sqlite_on_connect(readonly))
+            if not readonly and CHECKPOINT_INTERVAL_S > 0:
+                _start_checkpointer(engine)
+        else:
+            engine = create_engine(u, future=True, pool_pre_ping=True)
+        _engines[key] = engine
+        return engine
+
+
+def checkpoint(engine, mode="PASSIVE"):
+    """WAL in die DB zurückschreiben. PASSIVE wartet auf niemanden; TRUNCATE
+    (z.B. am Ende eines Laufs) leert die WAL-Datei, wenn gerade niemand liest.
+    Gibt (busy, wal_pages, checkpointed_pages) zurück."""
+    if not is_sqlite(engine):
+        return None
+    with engine.connect() as conn:
+        return tuple(conn.exec_driver_sql(f"PRAGMA wal_checkpoint({mode})").one())
+
+
+def _start_checkpointer(engine):
+    # SQLite checkpointet selbst alle 1000 Seiten, aber nur beim Commit und
+    # nur bis zum ältesten offenen Leser; lange Analysen lassen die WAL sonst wachsen
+    def loop():
+        while True:
+            time.sleep(CHECKPOINT_INTERVAL_S)
+            try:
+                checkpoint(engine)
+            except Exception:
+                pass
+
+    threading.Thread(target=loop, name="sqlite-checkpoint", daemon=True).start()
@@ -0,0 +1,56 @@
+import asyncio
+
+from scrapers.adaptive import AdaptiveLimiter
+
+
+def feed(limiter, outcomes, latency=1.0):
+    async def run():
+        for outcome in outcomes:
+            await limiter.acquire()
+            await limiter.release(latency, outcome)
+    asyncio.run(run())
+
+
+def limiter(start=4, lo=1, hi=8):
+    return AdaptiveLimiter(start, lo, hi, lambda m: None, window=4)
+
+
+def test_additive_increase_up_to_max():
+    lim = limiter()
+    feed(lim, ["ok"] * 4 * 10)
+    assert lim.history[:4] == [4, 5, 6, 7]
+    assert lim.limit == 8
+
+
+def test_challenge_halves():
+    lim = limiter(start=8)
+    feed(lim, ["ok", "ok", "ok", "challenge"])
+    assert lim.limit == 4
+    feed(lim, ["timeout", "ok", "ok", "ok"])     # 25 % Timeouts > 10 %
+    assert lim.limit == 2
+    feed(lim, ["error"] * 4 + ["error"] * 4)
+    assert lim.limit == 1                         # nie unter min_workers
+
+
+def test_latency_backoff():
+    lim = limiter(start=4)
+    feed(lim, ["ok"] * 4, latency=1.0)            # Bestwert 1s, +1
+    assert lim.limit == 5
+    feed(lim, ["ok"] * 4, latency=3.0)            # > 2x Bestwert
+    assert lim.limit == 3
+
+
+def test_acquire_blocks_at_limit():
+    lim = limiter(start=2)
+
+    async def run():
+        await lim.acquire()
+        await lim.acquire()
+        third = asyncio.create_task(lim.acquire())
+        await asyncio.sleep(0.01)
+        assert not third.done() and lim.active == 2
+        await lim.release(1.0, "ok")
+        await asyncio.wait_for(third, 1)
+        return lim.active
+
+    assert asyncio.run(run()) == 2
@@ -0,0 +1,55 @@
+import os
+from datetime import datetime
+
+from scrapers import archive
+from reparse_archive import is_stale, parse_file
+
+URL = "https://www.willhaben.at/iad/gebrauchtwagen/d/auto/bmw-320d-123456789/"
+
+
+def advert(price):
+    attrs = [{"name": "HEADING", "values": ["BMW 320d xDrive"]}, {"name": "PRICE", "values": [str(price)]}]
+    return {"advertDetails": {"id": 123456789, "attributes": {"attribute": attrs}}}
+
+
+def test_latest_state_after_a_b_a(tmp_path):
+    for day, price in [(1, 10000), (2, 9000), (3, 10000)]:
+        archive.archive_payload(URL, "next_data", advert(price), str(tmp_path), datetime(2026, 1, day))
+    # gleicher Inhalt wie der jüngste Stand: kein neuer Eintrag, nur neuer Abrufzeitpunkt
+    archive.archive_payload(URL, "next_data", advert(10000), str(tmp_path), datetime(2026, 1, 4))
+
+    paths = list(archive.iter_archive(str(tmp_path), latest_only=False))
+    assert [os.path.basename(p)[:8] for p in paths] == ["20260101", "20260102", "20260104"]
+    latest = list(archive.iter_archive(str(tmp_path)))
+    car, seen_at = parse_file(latest[0])
+    assert car["price"] == 10000
+    assert seen_at == "2026-01-04 00:00:00"
+    assert archive.load_record(latest[0])["fetched_at"] == "20260103T000000"
+
+
+def test_unchanged_refetch_is_reparsed(tmp_path, engine, monkeypatch, capsys):
+    import db
+    import reparse_archive
+
+    # Abruf am 1., derselbe Inhalt am 5. nochmal: last_seen rückt vor
+    for day in (1, 5):
+        archive.archive_payload(URL, "next_data", advert(10000), str(tmp_path), datetime(2026, 1, day))
+        car, _ = parse_file(next(archive.iter_archive(str(tmp_path))))
+        db.insert_car(car, seen_at=f"2026-01-0{day} 00:00:05")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("UPDATE cars SET title = 'alter Parser'")
+
+    monkeypatch.setattr("sys.argv", ["reparse_archive.py", "--dir", str(tmp_path), "--workers", "1"])
+    reparse_archive.main()
+    out = capsys.readouterr().out
+    assert "1/1 Seiten übernommen" in out and "älter als" not in out
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT title FROM cars").scalar() == "BMW 320d xDrive"
+
+
+def test_is_stale():
+    assert is_stale("2026-01-01 00:00:00", "2026-01-02 00:00:00")
+    # Abruf und DB-Schreiben liegen etwas auseinander
+    assert not is_stale("2026-01-01 00:00:00", "2026-01-01 00:00:05")
+    assert not is_stale("2026-01-02 00:00:00", "2026-01-01 00:00:00")
+    assert not is_stale("2026-01-01 00:00:00", None)
@@ -0,0 +1,30 @@
+from scrapers.scrape_willhaben_async import COOKIE_SELECTORS, COOKIE_VISIBLE_TIMEOUT_MS, Consent
+
+
+def report(consent):
+    logs = []
+    consent.report(logs.append)
+    return logs
+
+
+def consent(full_ms, no_banner_ms, quick):
+    c = Consent(context=None)
+    c.full_ms, c.no_banner_ms = full_ms, no_banner_ms
+    c.quick_n, c.quick_ms = len(quick), float(sum(quick))
+    return c
+
+
+def test_saved_against_measured_no_banner_check():
+    (line,) = report(consent(60.0, 60.0, [10, 10]))
+    assert "gemessen 60 ms" in line and "ca. 50 ms/Inserat" in line and "0.1s gespart" in line
+
+
+def test_click_run_is_not_the_baseline():
+    # Banner gefunden: der schnelle Klick darf die Ersparnis nicht kleinrechnen
+    (line,) = report(consent(300.0, None, [20] * 10))
+    baseline = len(COOKIE_SELECTORS) * COOKIE_VISIBLE_TIMEOUT_MS
+    assert f"angenommen {baseline} ms" in line and f"ca. {baseline - 20} ms/Inserat" in line
+
+
+def test_no_report_without_quick_checks():
+    assert report(consent(300.0, None, [])) == []
@@ -0,0 +1,72 @@
+import os
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, text
+
+import db
+import migrations
+from conftest import make_car
+
+# COPY-Pfad von db.insert_cars gegen ein echtes PostgreSQL. Läuft nur mit
+#   PG_DSN=postgresql+psycopg2://user:pw@host/db python -m pytest test_db_postgres.py
+# und arbeitet in einem eigenen Schema, das danach wieder gelöscht wird.
+PG_DSN = os.environ.get("PG_DSN")
+pytestmark = pytest.mark.skipif(not PG_DSN, reason="PG_DSN nicht gesetzt")
+
+
+@pytest.fixture
+def pg(monkeypatch):
+    pytest.importorskip("psycopg2")
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    admin = create_engine(PG_DSN, future=True)
+    with admin.begin() as conn:
+        conn.execute(text(f"CREATE SCHEMA {schema}"))
+    engine = create_engine(PG_DSN, future=True, connect_args={"options": f"-csearch_path={schema}"})
+    try:
+        migrations.migrate(engine, log=lambda msg: None)
+        monkeypatch.setattr(db, "engine", engine)
+        yield engine
+    finally:
+        engine.dispose()
+        with admin.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+        admin.dispose()
+
+
+def rows(engine, sql, **params):
+    with engine.connect() as conn:
+        return [tuple(r) for r in conn.execute(text(sql), params)]
+
+
+def test_copy_merge_inserts_batch(pg):
+    # mehr Zeilen als UPSERT_CHUNK, Texte mit Komma/Quote/Zeilenumbruch
+    cars = [make_car(i, title=f'VW "Golf", {i}', description="Leder\nNavi") for i in range(db.UPSERT_CHUNK + 20)]
+    assert db.insert_cars(cars, seen_at="2026-01-01 10:00:00") == len(cars)
+    assert rows(pg, "SELECT COUNT(*) FROM cars") == [(len(cars),)]
+    assert rows(pg, "SELECT title, description FROM cars WHERE url = :u", u=cars[7]["url"]) == \
+        [('VW "Golf", 7', "Leder\nNavi")]
+    assert rows(pg, "SELECT COUNT(*) FROM price_history") == [(len(cars),)]
+
+
+def test_on_conflict_updates_and_keeps_detail_fields(pg):
+    car = make_car(1, description="Leder", features_raw=["leder"])
+    db.insert_cars([car], seen_at="2026-01-01 10:00:00")
+    # Karte aus der Ergebnisliste: neuer km-Stand, keine Beschreibung/Features
+    card = {**car, "km": 91000, "description": None, "features_raw": None, "features_mask": None}
+    db.insert_cars([card], seen_at="2026-01-02 10:00:00")
+    (km, description, features_raw, first_seen, last_seen), = rows(
+        pg, "SELECT km, description, features_raw, first_seen, last_seen FROM cars WHERE url = :u", u=car["url"])
+    assert (km, description) == (91000, "Leder") and "leder" in features_raw
+    assert (str(first_seen), str(last_seen)) == ("2026-01-01 10:00:00", "2026-01-02 10:00:00")
+
+
+def test_price_history_on_change_only(pg):
+    url = make_car(2)["url"]
+    db.insert_cars([make_car(2, price=9000)], seen_at="2026-01-01 10:00:00")
+    db.insert_cars([make_car(2, price=9000)], seen_at="2026-01-02 10:00:00")
+    db.insert_cars([make_car(2, price=8500), make_car(3)], seen_at="2026-01-03 10:00:00")
+    history = rows(pg, "SELECT ph.price, ph.seen_at FROM price_history ph JOIN cars c ON c.id = ph.car_id "
+                       "WHERE c.url = :u ORDER BY ph.seen_at", u=url)
+    assert [(p, str(t)) for p, t in history] == [(9000, "2026-01-01 10:00:00"), (8500, "2026-01-03 10:00:00")]
+    assert rows(pg, "SELECT current_price FROM cars WHERE url = :u", u=url) == [(8500,)]
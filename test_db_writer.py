@@ -0,0 +1,90 @@
+import time
+import asyncio
+
+import pytest
+
+from scrapers.db_writer import DbWriter
+
+
+def car(i):
+    return {"url": f"https://www.willhaben.at/iad/gebrauchtwagen/d/auto/test-{100000 + i}/", "price": 1000 + i}
+
+
+class Recorder:
+    def __init__(self, fail=lambda batch: False):
+        self.batches = []
+        self.fail = fail
+
+    def __call__(self, batch):
+        if self.fail(batch):
+            raise RuntimeError("DB weg")
+        self.batches.append(list(batch))
+
+
+def test_batches_and_flush_on_close():
+    write, logs = Recorder(), []
+    writer = DbWriter(logs.append, write=write, batch_size=10, flush_ms=60_000).start()
+    for i in range(25):
+        writer(car(i))
+    # zwei volle Blöcke sofort, der Rest erst bei close (flush_ms ist lang)
+    deadline = time.monotonic() + 5
+    while len(write.batches) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert [len(b) for b in write.batches] == [10, 10]
+    writer.close()
+    assert [len(b) for b in write.batches] == [10, 10, 5]
+    assert [c["url"] for b in write.batches for c in b] == [car(i)["url"] for i in range(25)]
+    assert writer.written == 25 and writer.batches == 3 and "25 Inserate in 3 Batches" in logs[-1]
+
+
+def test_flush_after_timeout():
+    write = Recorder()
+    writer = DbWriter(lambda m: None, write=write, batch_size=100, flush_ms=20).start()
+    writer(car(1))
+    deadline = time.monotonic() + 5
+    while not write.batches and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert write.batches == [[car(1)]]
+    writer.close()
+
+
+def test_failed_batch_is_retried_per_car_and_reported():
+    # Block schlägt fehl, einzeln nur car(3)
+    write, logs = Recorder(fail=lambda b: len(b) > 1 or b[0]["url"] == car(3)["url"]), []
+    writer = DbWriter(logs.append, write=write, batch_size=5, flush_ms=60_000).start()
+    for i in range(5):
+        writer(car(i))
+    writer.close()
+    assert writer.written == 4 and writer.errors == 1
+    assert any("Batch mit 5 Inseraten fehlgeschlagen" in m for m in logs)
+    assert any(car(3)["url"] in m and "DB weg" in m for m in logs)
+    assert writer.failed is None
+
+
+def test_thread_abort_is_reported_and_rejects_new_cars():
+    logs = []
+    writer = DbWriter(logs.append, write=Recorder(fail=lambda b: True), batch_size=1, flush_ms=10).start()
+    writer("kein dict")   # Fehlerpfad selbst scheitert (car.get) -> Thread bricht ab
+    writer._thread.join(5)
+    assert isinstance(writer.failed, AttributeError)
+    assert any("Writer-Thread abgebrochen" in m for m in logs)
+    with pytest.raises(RuntimeError, match="abgebrochen"):
+        writer(car(1))
+    writer.close()
+
+
+def test_submit_after_close():
+    write = Recorder()
+    writer = DbWriter(lambda m: None, write=write).start()
+
+    async def run():
+        await writer.submit(car(1))
+        await asyncio.to_thread(writer.close)
+        with pytest.raises(RuntimeError, match="geschlossen"):
+            await writer.submit(car(2))
+
+    asyncio.run(run())
+    with pytest.raises(RuntimeError, match="geschlossen"):
+        writer(car(3))
+    assert write.batches == [[car(1)]]
+    writer.close()   # zweites close ist harmlos
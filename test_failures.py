@@ -0,0 +1,41 @@
+from sqlalchemy import text
+
+import db
+from scrapers.retry import RetryQueue
+from scrapers.scrape_willhaben_async import run_sharded
+
+
+def test_record_sums_attempts_and_purges(engine):
+    db.record_failures({"a": (4, "timeout"), "b": (4, "timeout")})
+    db.record_failures({"a": (4, "503")})
+    with engine.connect() as conn:
+        rows = dict(conn.execute(text("SELECT url, attempts FROM scrape_failures")).all())
+    assert rows == {"a": 8, "b": 4}
+
+    assert db.purge_failures(max_attempts=8) == 1
+    assert db.load_failures() == ["b"]
+
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE scrape_failures SET failed_at = '2020-01-01 00:00:00'"))
+    assert db.purge_failures(max_attempts=100, max_age_days=14) == 1
+    assert db.load_failures() == []
+
+
+def crashing_shard(shard_id, urls, out_q, headless, engine):
+    """Speichert das erste Auto und stirbt dann ohne "done"."""
+    import os
+    out_q.put(("car", shard_id, {"url": urls[0]}))
+    out_q.close()
+    out_q.join_thread()
+    os._exit(3)
+
+
+def test_dead_shard_urls_go_to_dead_letter():
+    urls = [f"https://www.willhaben.at/iad/gebrauchtwagen/d/auto/test-{100000 + i}/" for i in range(6)]
+    saved, logs = [], []
+    retry = RetryQueue(logs.append)
+    run_sharded(urls, 2, logs.append, True, "json", retry, sink=saved.append, target=crashing_shard)
+
+    assert sorted(c["url"] for c in saved) == sorted([urls[0], urls[1]])
+    assert sorted(retry.dead) == sorted(urls[2:])
+    assert all(error.startswith("Shard-Prozess beendet") for _, error in retry.dead.values())
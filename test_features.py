@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from features import (
+    FEATURE_RULES, _compile_batch, _variants, extract_features, feature_mask, mask_to_features, tag_texts,
+)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("BMW 320d xDrive20d Touring", ["allrad"]),
+    ("X5 XDRIVE", ["allrad"]),
+    ("VW Passat 4MOTION-Paket", ["allrad"]),
+    ("Golf 4Motion", ["allrad"]),
+    ("Audi A4 quattro", ["allrad"]),
+    ("Allradantrieb", ["allrad"]),
+    ("ACC, Sitzheizung", ["acc", "sitzheizung"]),
+    ("Accessoires inklusive", []),
+    ("Lederausstattung", []),
+    ("Matrix-LED", ["led"]),
+    ("S-Line", ["sportpaket"]),
+    ("sline", ["sportpaket"]),
+    ("s  line", []),
+    ("Apple CarPlay", ["carplay"]),
+    ("Android-Auto", ["android_auto"]),
+    ("Navigationssystem", ["navi"]),
+    ("AHK abnehmbar", ["anhängerkupplung"]),
+    ("Einparkhilfe hinten", ["parkassist"]),
+])
+def test_extract_features(text, expected):
+    assert extract_features(text, None) == expected
+    assert mask_to_features(int(tag_texts([text])[0])) == expected
+
+
+def test_title_and_description():
+    assert extract_features("BMW 320d", "xDrive, Navi Professional") == ["allrad", "navi"]
+
+
+def test_batch_matches_regex():
+    # Needle-Varianten mit Trennern, Satzzeichen und Zeichen außerhalb latin-1
+    rnd = np.random.default_rng(7)
+    pieces = [v for needles in FEATURE_RULES.values() for n in needles for v in _variants(n.strip("*"))]
+    pieces += ["x", "s", "-", " ", "\n", "•", "€", "Ä", "ß", "_", "4", "K", "č", "(", ".", "ine", "LED", "XDrive"]
+    texts = ["".join(rnd.choice(pieces, size=rnd.integers(1, 7))) for _ in range(5000)]
+    assert tag_texts(texts).tolist() == [feature_mask(t.lower()) for t in texts]
+
+
+def test_batch_offsets_per_row():
+    texts = ["navi", None, "", "kein treffer", "ahk"] * 3
+    masks = tag_texts(texts, block_rows=4).tolist()
+    assert masks == [feature_mask((t or "").lower()) for t in texts]
+    assert tag_texts([]).tolist() == []
+
+
+def test_rejects_short_needles():
+    with pytest.raises(ValueError):
+        _compile_batch({"acc": ["ab"]})
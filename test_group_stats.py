@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+from group_stats import backoff, group_cube, group_stats
+from market_analysis import STAT_COLUMNS, fill_level0
+
+LEVELS = [["brand", "model", "year"], ["brand", "model"], ["brand"]]
+
+
+def frame(n=500, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "brand": rng.choice(["VW", "BMW", "Audi"], n),
+        "model": rng.choice(["A", "B", "C", None], n),
+        "year": rng.integers(2010, 2020, n).astype(float),
+        "price": rng.uniform(3000, 40000, n),
+        "km": rng.uniform(0, 250000, n),
+    })
+    df.loc[::17, "price"] = np.nan
+    return df
+
+
+def test_cube_matches_group_stats():
+    df = frame()
+    codes, cube = group_cube(df, LEVELS)
+    for level, cols in enumerate(LEVELS):
+        _, agg = group_stats(df, cols)
+        part = cube[cube["level"] == level].reset_index(drop=True)
+        pd.testing.assert_frame_equal(part[cols], agg[cols], check_dtype=False)
+        np.testing.assert_allclose(part[STAT_COLUMNS].to_numpy(float), agg[STAT_COLUMNS].to_numpy(float))
+    # Zeilen mit NaN im Modell haben nur auf Stufe "brand" einen Code
+    no_model = df["model"].isna().to_numpy()
+    assert (codes[no_model, 0] == -1).all() and (codes[no_model, 2] >= 0).all()
+
+
+def test_backoff_takes_finest_level_with_enough_data():
+    df = frame()
+    codes, cube = group_cube(df, LEVELS)
+    chosen = backoff(codes, cube, min_n=8)
+    n = cube["n"].to_numpy()
+    for row in range(len(df)):
+        ok = [c for c in codes[row] if c >= 0 and n[c] >= 8]
+        assert chosen[row] == (ok[0] if ok else -1)
+
+
+def test_fill_level0_joins_on_keys():
+    df = frame()
+    cols = LEVELS[0]
+    _, cube = group_cube(df, LEVELS)
+    _, agg = group_stats(df, cols)
+    # andere Reihenfolge, eine Gruppe fehlt, geänderte Werte
+    shuffled = agg.sample(frac=1, random_state=1).iloc[1:].reset_index(drop=True)
+    shuffled["median_price"] = shuffled["median_price"] + 1
+    missing = agg.merge(shuffled[cols], on=cols, how="left", indicator=True)["_merge"] == "left_only"
+
+    out = fill_level0(cube.copy(), shuffled, cols)
+    part = out[out["level"] == 0].reset_index(drop=True)
+    assert (part["n"][missing] == 0).all() and part["median_price"][missing].isna().all()
+    np.testing.assert_allclose(part["median_price"][~missing], agg["median_price"][~missing] + 1)
+    assert (out.loc[out["level"] > 0, "median_price"] == cube.loc[cube["level"] > 0, "median_price"]).all()
@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import hedonic
+
+REF_YEAR = 2026
+
+
+def frame(families=6, rows=40, seed=3):
+    rng = np.random.default_rng(seed)
+    n = families * rows
+    fam = np.repeat(np.arange(families), rows)
+    ps = rng.choice(np.arange(70, 250, 10), n).astype(float)
+    ps[rng.random(n) < 0.1] = np.nan
+    df = pd.DataFrame({
+        "brand": [f"Marke{f % 2}" for f in fam],
+        "model": [f"M{f}" for f in fam],
+        "year": rng.integers(2008, 2025, n),
+        "km": rng.integers(0, 250_000, n),
+        "power_ps": ps,
+        "features_mask": rng.integers(0, 1 << len(hedonic.FEATURE_BITS), n),
+    })
+    log_price = (9.5 + 0.1 * fam - 0.07 * (REF_YEAR - df["year"]) - 0.2 * df["km"] / 1e5
+                 + 0.25 * np.nan_to_num(ps, nan=150) / 100 + rng.normal(0, 0.05, n))
+    df["price"] = np.exp(log_price).round()
+    return df
+
+
+def ridge(sub, lam):
+    """Referenz je Familie: Ridge über ein erweitertes lstsq (Achsenabschnitt frei)."""
+    ps_mean = np.nanmean(sub["power_ps"].to_numpy(float)) / 100
+    X = hedonic.design_matrix(sub, REF_YEAR, ps_fill=ps_mean)
+    y = np.log(sub["price"].to_numpy(float))
+    reg = np.sqrt(lam) * np.eye(X.shape[1])[1:]
+    coef, *_ = np.linalg.lstsq(np.vstack([X, reg]), np.concatenate([y, np.zeros(len(reg))]), rcond=None)
+    return coef, ps_mean
+
+
+@pytest.mark.parametrize("lam", [0.0, hedonic.RIDGE_LAMBDA])
+def test_fit_matches_per_family_solve(lam):
+    df = frame()
+    models = hedonic.fit(df, ref_year=REF_YEAR, lam=lam)
+    assert len(models) == 6 and (models["n"] == 40).all()
+    for row in models.to_dict("records"):
+        sub = df[(df["brand"] == row["brand"]) & (df["model"] == row["model"])]
+        coef, ps_mean = ridge(sub, lam)
+        np.testing.assert_allclose(row["coef"], coef, rtol=1e-6, atol=1e-8)
+        assert row["ps_mean"] == pytest.approx(ps_mean)
+    # Alter und km drücken den Preis
+    effects = hedonic.summary(models)
+    assert (effects["pct_per_year"] < 0).all() and (effects["pct_per_100k_km"] < 0).all()
+
+
+def test_small_family_is_not_fitted():
+    df = frame()
+    df = df[(df["model"] != "M5") | (df.index % 40 < hedonic.MIN_FAMILY_N - 1)]
+    assert "M5" not in set(hedonic.fit(df, ref_year=REF_YEAR)["model"])
+
+
+def test_predict_unknown_family_is_nan():
+    df = frame()
+    models = hedonic.fit(df, ref_year=REF_YEAR)
+    new = pd.concat([df.head(3), df.head(2).assign(brand="Unbekannt", model="X")], ignore_index=True)
+    fair = hedonic.predict(new, models)
+    assert fair.index.equals(new.index)
+    assert fair[:3].notna().all() and fair[3:].isna().all()
+    # Skalar-Pfad stimmt mit predict überein; fehlende PS -> Familienmittel
+    model = models.iloc[0]
+    car = df[(df["brand"] == model["brand"]) & (df["model"] == model["model"])].iloc[0].to_dict()
+    car["power_ps"] = None
+    expected = hedonic.predict(pd.DataFrame([car]), models).iloc[0]
+    assert hedonic.fair_price(car, model) == pytest.approx(expected)
+    assert hedonic.fair_price({**car, "year": None}, model) is None
+
+
+def test_empty_input():
+    empty = frame().head(0)
+    models = hedonic.fit(empty, ref_year=REF_YEAR)
+    assert models.empty
+    assert hedonic.predict(frame().head(3), models).isna().all()
+    assert hedonic.summary(models).empty
+
+
+def test_save_load_round_trip(engine):
+    df = frame()
+    models = hedonic.fit(df, ref_year=REF_YEAR)
+    assert hedonic.available(engine)
+    assert hedonic.save(engine, models) == len(models)
+    loaded = hedonic.load(engine).sort_values(["brand", "model"]).reset_index(drop=True)
+    models = models.sort_values(["brand", "model"]).reset_index(drop=True)
+    pd.testing.assert_frame_equal(loaded[["brand", "model", "n", "ref_year"]],
+                                  models[["brand", "model", "n", "ref_year"]], check_dtype=False)
+    np.testing.assert_allclose(np.stack(loaded["coef"]), np.stack(models["coef"]), atol=1e-7)
+    np.testing.assert_allclose(hedonic.predict(df, loaded), hedonic.predict(df, models), rtol=1e-6)
+
+    # neu speichern ersetzt, leere Modelle leeren die Tabelle
+    assert hedonic.save(engine, models.head(0)) == 0
+    assert hedonic.load(engine).empty
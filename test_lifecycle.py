@@ -0,0 +1,101 @@
+import asyncio
+
+from sqlalchemy import text
+
+import db
+from conftest import make_car
+from scrapers.lifecycle import SearchRun
+from scrapers.scrape_willhaben_async import collect_cards
+
+START_URL = "https://www.willhaben.at/iad/gebrauchtwagen/auto/gebrauchtwagenboerse?CAR_MODEL/MAKE=1065"
+
+
+def run(urls, at, rows_found=None):
+    search_run = SearchRun(START_URL, lambda m: None)
+    search_run.started_at = at
+    search_run.expect(rows_found if rows_found is not None else len(urls))
+    search_run.add(urls)
+    search_run.finish()
+
+
+def active(engine):
+    with engine.connect() as conn:
+        return {r.url: (r.active, r.delisted_at) for r in conn.execute(text("SELECT url, active, delisted_at FROM cars"))}
+
+
+def seed(engine, n, at):
+    cars = [make_car(i) for i in range(n)]
+    db.insert_cars(cars, seen_at=at)
+    return [c["url"] for c in cars]
+
+
+def test_mark_delisted_after_complete_run(engine):
+    urls = seed(engine, 5, "2026-01-01 10:00:00")
+    run(urls, "2026-01-01 10:00:00")
+    run(urls[1:], "2026-01-02 10:00:00")
+    state = active(engine)
+    assert state[urls[0]] == (0, state[urls[0]][1]) and state[urls[0]][1] is not None
+    assert all(state[u][0] == 1 for u in urls[1:])
+
+    # wieder aufgetaucht -> aktiv
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE cars SET delisted_at = '2026-01-02 10:00:00' WHERE url = :u"), {"u": urls[0]})
+    db.insert_cars([make_car(0)], seen_at="2026-01-03 10:00:00")
+    assert active(engine)[urls[0]] == (1, None)
+
+
+def test_short_run_delists_nothing(engine):
+    urls = seed(engine, 200, "2026-01-01 10:00:00")
+    run(urls, "2026-01-01 10:00:00")
+    # 10 von 200 fehlen, rowsFound sagt weiter 200: Seiten verloren, nicht verkauft
+    run(urls[10:], "2026-01-02 10:00:00", rows_found=200)
+    assert all(a == 1 for a, _ in active(engine).values())
+    # innerhalb der Toleranz (2 von 200) gilt der Lauf als vollständig
+    run(urls[2:], "2026-01-03 10:00:00", rows_found=200)
+    assert sum(a == 0 for a, _ in active(engine).values()) == 2
+
+
+def advert(i, price=True):
+    attrs = [{"name": "SEO_URL", "values": [f"gebrauchtwagen/d/auto/test-{i}/"]},
+             {"name": "HEADING", "values": [f"VW Golf {i}"]}]
+    if price:
+        attrs.append({"name": "PRICE", "values": ["15000"]})
+    return {"id": str(i), "attributes": {"attribute": attrs}}
+
+
+def test_cards_without_price_are_recorded(engine):
+    props = {"searchResult": {"rowsFound": 3, "advertSummaryList": {
+        "advertSummary": [advert(1), advert(2, price=False), advert(3)]}}}
+    search_run = SearchRun(START_URL, lambda m: None)
+
+    async def load(url):
+        raise AssertionError("nur eine Seite")
+
+    cards = asyncio.run(collect_cards(load, START_URL, props, lambda m: None, search_run))
+    search_run.add(cards)
+    assert len(cards) == 3 and sum(c is None for c in cards.values()) == 1
+    assert len(search_run.urls) == 3 and not search_run.missing()
+
+
+def test_analysis_query_filters_on_active(engine):
+    import market_analysis as ma
+    from sqlalchemy import inspect
+
+    db.insert_cars([make_car(i) for i in range(4)])
+    old = "2020-01-01 00:00:00"
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE cars SET active = 0, delisted_at = datetime('now') WHERE url = :u"),
+                     {"u": make_car(1)["url"]})
+        conn.execute(text("UPDATE cars SET active = 0, delisted_at = :t WHERE url = :u"), {"t": old, "u": make_car(2)["url"]})
+        conn.execute(text("UPDATE cars SET last_seen = :t WHERE url = :u"), {"t": old, "u": make_car(3)["url"]})
+
+    df = ma.load_filtered(engine)
+    # aktiv + kürzlich verschwunden (Standzeit); alt verschwunden und lange nicht gesehen nicht
+    assert sorted(int(km) - 80000 for km in df["km"]) == [0, 1]   # make_car: km = 80000 + i
+
+    cols = [c["name"] for c in inspect(engine).get_columns("cars")]
+    where, params = ma.filter_sql(ma.analysis_filters(cols))
+    assert "active = " in where
+    with engine.connect() as conn:
+        plan = " ".join(str(r) for r in conn.execute(text(f"EXPLAIN QUERY PLAN SELECT id FROM cars WHERE {where}"), params))
+    assert "idx_cars_active_last_seen" in plan
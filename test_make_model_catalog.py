@@ -0,0 +1,51 @@
+import pytest
+from sqlalchemy import text
+
+import make_model_catalog
+from conftest import make_car
+from make_model_catalog import Catalog
+
+DATA = {"fetched_at": 1, "makes": [
+    {"id": 1, "name": "BMW", "models": [{"id": 10, "name": "3er-Reihe"}, {"id": 11, "name": "X5"}]},
+    {"id": 2, "name": "Mercedes-Benz", "models": [{"id": 20, "name": "C-Klasse"}]},
+    {"id": 3, "name": "VW", "models": [{"id": 30, "name": "Golf"}, {"id": 31, "name": "Golf Variant"}]},
+]}
+
+
+@pytest.mark.parametrize("title, expected", [
+    ("BMW 320d Touring", ("BMW", "3er-Reihe")),
+    ("BMW 3er Touring", ("BMW", "3er-Reihe")),
+    ("Mercedes-Benz C 220 d", ("Mercedes-Benz", "C-Klasse")),
+    ("Mercedes C220d", ("Mercedes-Benz", "C-Klasse")),
+    ("Volkswagen Golf Variant", ("VW", "Golf")),
+    ("Neuer BMW X5 xDrive", ("BMW", "X5")),
+    ("Skoda Octavia", ("Skoda", "Octavia")),    # unbekannt: erstes/zweites Wort
+])
+def test_split_title_without_catalog(title, expected):
+    assert Catalog().split_title(title) == expected
+
+
+@pytest.mark.parametrize("title, expected", [
+    ("BMW 320d Touring", ("BMW", "3er-Reihe")),
+    ("VW Golf Variant 2.0 TDI", ("VW", "Golf Variant")),
+    ("Mercedes C 200", ("Mercedes-Benz", "C-Klasse")),
+    ("Skoda Octavia", (None, None)),
+])
+def test_resolve_with_catalog(title, expected):
+    assert Catalog(DATA).resolve(title) == expected
+
+
+def test_resolve_all_without_catalog(engine, monkeypatch):
+    monkeypatch.setattr(make_model_catalog, "_catalog", Catalog())
+    import db
+    db.insert_cars([
+        make_car(1, title="BMW 320d Touring", brand="BMW", model="320d"),
+        make_car(2, title="Skoda Octavia Combi", brand="Skoda", model="Octavia"),
+    ])
+    logs = []
+    res = make_model_catalog.resolve_all(engine, log=logs.append)
+    assert res["rows"] == 2 and res["changed"] == 1
+    assert "Katalog leer" in logs[0]
+    with engine.connect() as conn:
+        rows = dict(conn.execute(text("SELECT title, model FROM cars")).all())
+    assert rows == {"BMW 320d Touring": "3er-Reihe", "Skoda Octavia Combi": "Octavia"}
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+import db
+import market_stats
+from conftest import make_car
+from quantile_sketch import KLLSketch
+
+
+def test_sketch_exact_up_to_k():
+    values = np.random.default_rng(1).normal(20000, 5000, 200)
+    sk = KLLSketch.from_values(values)
+    assert sk.exact()
+    np.testing.assert_allclose(sk.quantiles([0.25, 0.5, 0.75]), np.quantile(values, [0.25, 0.5, 0.75]))
+
+
+def test_sketch_merge_and_bytes():
+    rng = np.random.default_rng(2)
+    a, b = rng.uniform(0, 1, 30000), rng.uniform(0, 1, 20000)
+    sk = KLLSketch.from_values(a, rng=np.random.default_rng(3)).merge(KLLSketch.from_values(b))
+    assert sk.n == 50000 and not sk.exact()
+    # Rangfehler ~1.7/k
+    both = np.sort(np.concatenate([a, b]))
+    for q, v in zip([0.1, 0.5, 0.9], sk.quantiles([0.1, 0.5, 0.9])):
+        assert abs(np.searchsorted(both, v) / len(both) - q) < 0.02
+    back = KLLSketch.from_bytes(sk.to_bytes())
+    assert back.n == sk.n
+    np.testing.assert_array_equal(back.quantiles([0.1, 0.5, 0.9]), sk.quantiles([0.1, 0.5, 0.9]))
+
+
+def test_empty_store_types(engine):
+    stored = market_stats.read_stats(engine)
+    assert stored.empty
+    assert stored["n"].dtype == np.int64 and stored["median_price"].dtype == np.float64
+    assert market_stats.load_current(engine, market_stats.KEY_COLUMNS, log=lambda m: None) is None
+
+    keys = pd.DataFrame({"brand": ["VW"], "model": ["Golf"], "year_bucket": [2018.0], "ps_bucket": [110.0],
+                         "transmission": ["Schaltgetriebe"], "fuel_type": ["Diesel"], "drive": ["Front"]})
+    joined = market_stats.join_keys(keys, stored)
+    assert joined["n"].tolist() == [0] and joined["n"].dtype == np.int64
+    assert joined["median_price"].dtype == np.float64
+
+
+def test_incremental_matches_exact(engine):
+    db.insert_cars([make_car(i) for i in range(30)] + [make_car(i, model="Polo") for i in range(30, 40)])
+    market_stats.update(engine, full=True, log=lambda m: None)
+
+    # neuer Wagen, Preisänderung, Inserat weg
+    db.insert_cars([make_car(50), make_car(3, price=9999)])
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE cars SET active = 0, delisted_at = datetime('now') WHERE url = :u"),
+                     {"u": make_car(35)["url"]})
+    market_stats.update(engine, log=lambda m: None)
+
+    assert market_stats.check(engine, log=lambda m: None)
+    stored = market_stats.read_stats(engine).set_index("model")
+    assert stored.loc["Golf", "n"] == 31 and stored.loc["Polo", "n"] == 9
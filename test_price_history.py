@@ -0,0 +1,45 @@
+from sqlalchemy import text
+
+import db
+from conftest import make_car
+
+
+def history(engine, url):
+    with engine.connect() as conn:
+        return [tuple(r) for r in conn.execute(text(
+            "SELECT ph.price, ph.seen_at FROM price_history ph JOIN cars c ON c.id = ph.car_id "
+            "WHERE c.url = :url ORDER BY ph.seen_at"), {"url": url})]
+
+
+def current(engine, url):
+    with engine.connect() as conn:
+        return tuple(conn.execute(text(
+            "SELECT price, current_price, price_changed_at, first_seen, last_seen FROM cars WHERE url = :url"),
+            {"url": url}).one())
+
+
+def test_price_change_recorded_once(engine):
+    url = make_car(1)["url"]
+    db.insert_cars([make_car(1, price=15000)], seen_at="2026-01-01 10:00:00")
+    db.insert_cars([make_car(1, price=15000)], seen_at="2026-01-02 10:00:00")
+    db.insert_cars([make_car(1, price=14500)], seen_at="2026-01-03 10:00:00")
+    assert history(engine, url) == [(15000, "2026-01-01 10:00:00"), (14500, "2026-01-03 10:00:00")]
+    assert current(engine, url) == (14500, 14500, "2026-01-03 10:00:00", "2026-01-01 10:00:00", "2026-01-03 10:00:00")
+
+
+def test_batch_duplicates_and_missing_price(engine):
+    url = make_car(2)["url"]
+    # doppelte URL im Batch: der letzte Stand zählt
+    db.insert_cars([make_car(2, price=9000), make_car(2, price=9500)], seen_at="2026-01-01 10:00:00")
+    assert history(engine, url) == [(9500, "2026-01-01 10:00:00")]
+    # ohne Preis: keine Historie, current_price bleibt
+    db.insert_cars([make_car(2, price=None)], seen_at="2026-01-02 10:00:00")
+    assert history(engine, url) == [(9500, "2026-01-01 10:00:00")]
+    assert current(engine, url)[1] == 9500
+
+
+def test_reparse_never_moves_last_seen_back(engine):
+    url = make_car(3)["url"]
+    db.insert_cars([make_car(3)], seen_at="2026-01-05 10:00:00")
+    db.insert_cars([make_car(3)], seen_at="2026-01-01 10:00:00")
+    assert current(engine, url)[4] == "2026-01-05 10:00:00"
@@ -0,0 +1,126 @@
+import json
+import asyncio
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+import pytest
+
+from scrapers.http_fetch import HttpFetcher
+from scrapers.retry import RetryQueue
+from scrapers.scrape_willhaben_async import SEARCH_ROWS, collect_cards, scrape_http
+from scrapers.willhaben_json import search_urls
+from tools.replay_server import make_handler, record
+from willhaben_url import with_page
+
+START_URL = "https://www.willhaben.at/iad/gebrauchtwagen/auto/gebrauchtwagenboerse?sort=1&CAR_MODEL/MAKE=1065"
+TOTAL = 200
+
+
+def advert(i):
+    return {"id": str(i), "attributes": {"attribute": [
+        {"name": "SEO_URL", "values": [f"gebrauchtwagen/d/auto/vw-golf-{100000 + i}/"]},
+        {"name": "HEADING", "values": [f"VW Golf {i}"]},
+        {"name": "PRICE", "values": [str(10000 + i)]},
+        {"name": "YEAR_MODEL", "values": ["2018"]},
+        {"name": "MILEAGE", "values": ["80000"]},
+    ]}}
+
+
+def page(page_props):
+    data = json.dumps({"props": {"pageProps": page_props}})
+    return f'<html><script id="__NEXT_DATA__" type="application/json">{data}</script></html>'
+
+
+class Site(BaseHTTPRequestHandler):
+    """Stand-in für willhaben.at: Suche mit page/rows (höchstens max_rows je
+    Seite), Detailseiten je Inserat."""
+    max_rows = 1000
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if parts.path.endswith("/gebrauchtwagenboerse"):
+            q = parse_qs(parts.query)
+            rows, n = min(int(q["rows"][0]), self.max_rows), int(q["page"][0])
+            ads = [advert(i) for i in range((n - 1) * rows, min(n * rows, TOTAL))]
+            body = page({"searchResult": {"rowsFound": TOTAL, "advertSummaryList": {"advertSummary": ads}}})
+        else:
+            i = int(parts.path.rstrip("/").rsplit("-", 1)[1]) - 100000
+            detail = advert(i)
+            detail["attributes"]["attribute"].append({"name": "DESCRIPTION", "values": ["Leder"]})
+            body = page({"advertDetails": detail})
+        body = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start(handler):
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, f"http://127.0.0.1:{httpd.server_address[1]}"
+
+
+@pytest.fixture(params=[1000, 30], ids=["rows", "capped"])
+def replay(request, tmp_path):
+    """Seiten vom Stand-in aufzeichnen und über tools/replay_server.py
+    ausliefern; "capped" liefert weniger Zeilen als SEARCH_ROWS je Seite."""
+    site = type("CappedSite", (Site,), {"max_rows": request.param})
+    origin, origin_url = start(site)
+    record(START_URL, str(tmp_path), details=TOTAL, base_url=origin_url)
+    origin.shutdown()
+    httpd, url = start(make_handler(str(tmp_path)))
+    yield url
+    httpd.shutdown()
+
+
+def test_collect_cards_pages_disjoint_and_complete(replay):
+    loaded = []
+
+    async def run():
+        fetcher = HttpFetcher(base_url=replay)
+
+        async def load(url):
+            props = await fetcher.fetch_page_props(url)
+            loaded.append((url, search_urls(props)))
+            return props
+
+        try:
+            first = await fetcher.fetch_page_props(with_page(START_URL, 1, rows=SEARCH_ROWS))
+            return search_urls(first), await collect_cards(load, START_URL, first, lambda m: None)
+        finally:
+            fetcher.close()
+
+    first, cards = asyncio.run(run())
+    pages = [first] + [urls for _, urls in loaded]
+    seen = [u for urls in pages for u in urls]
+    # jede Seite 2..N genau einmal, keine Karte doppelt, keine fehlt
+    assert len({url for url, _ in loaded}) == len(loaded) == len(pages) - 1
+    assert all(pages)
+    assert len(seen) == len(set(seen)) == TOTAL
+    assert set(cards) == set(seen) and all(cards.values())
+
+
+def test_scrape_http_against_replay(replay):
+    cars = []
+    log = []
+
+    async def run():
+        fetcher = HttpFetcher(base_url=replay)
+        retry = RetryQueue(log.append)
+        try:
+            fallback = await scrape_http(fetcher, START_URL, log.append, "detail", retry, sink=cars.append)
+        finally:
+            fetcher.close()
+        return fallback, retry
+
+    fallback, retry = asyncio.run(run())
+    assert fallback == [] and not retry.dead and not retry.gone
+    assert len(cars) == TOTAL
+    assert {c["price"] for c in cars} == {10000 + i for i in range(TOTAL)}
+    assert all(c["description"] == "Leder" for c in cars)
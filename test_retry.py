@@ -0,0 +1,73 @@
+import asyncio
+import random
+
+import pytest
+
+from scrapers import retry as retry_mod
+from scrapers.retry import PRIO_DEAD_LETTER, RetryQueue, backoff_delay
+
+
+@pytest.mark.parametrize("attempt", range(8))
+def test_backoff_delay_bounds(attempt):
+    random.seed(attempt)
+    base = min(60.0, 2.0 * 2 ** attempt)
+    for _ in range(50):
+        assert 0.5 * base <= backoff_delay(attempt, base=2.0, cap=60.0) <= 1.5 * base
+
+
+def drain(q, handle):
+    """Ein Worker: holt bis zum Stop-Eintrag, handle(url, attempt) -> Exception oder None."""
+    async def worker():
+        while True:
+            _, _, url, attempt = await q.get()
+            if url is None:
+                q.queue.task_done()
+                return
+            error = handle(url, attempt)
+            if error is None:
+                q.done(url)
+            else:
+                q.failed(url, attempt, error)
+
+    async def run():
+        task = asyncio.create_task(worker())
+        await q.join()
+        q.stop(1)
+        await task
+
+    return run()
+
+
+def test_retry_then_dead_letter(monkeypatch):
+    monkeypatch.setattr(retry_mod, "backoff_delay", lambda attempt: 0.0)
+    calls = []
+
+    def handle(url, attempt):
+        calls.append((url, attempt))
+        if url == "kaputt" or attempt == 0:
+            return RuntimeError("503")
+        return None
+
+    async def main():
+        q = RetryQueue(lambda m: None, max_attempts=3)
+        q.put("kaputt")
+        q.put("wackelig")
+        await drain(q, handle)
+        return q
+
+    q = asyncio.run(main())
+    assert q.succeeded == {"wackelig"}
+    assert q.dead == {"kaputt": (3, "503")}
+    assert [a for u, a in calls if u == "kaputt"] == [0, 1, 2]
+    assert q.retries == 3
+
+
+def test_dead_letter_first_retries_last():
+    async def main():
+        q = RetryQueue(lambda m: None)
+        q.put("neu")
+        q.put("wiederholt", priority=1, attempt=1)
+        q.put("dead", priority=PRIO_DEAD_LETTER)
+        return [(await q.get())[2] for _ in range(3)]
+
+    assert asyncio.run(main()) == ["dead", "neu", "wiederholt"]
@@ -0,0 +1,74 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+import db
+from conftest import make_car
+from scrapers.scrape_willhaben_async import select_and_touch, select_for_detail
+
+
+def ago(hours):
+    return (datetime.utcnow() - timedelta(hours=hours)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def test_select_for_detail():
+    cards = {"neu": {"price": 1000}, "teurer": {"price": 1200}, "gleich": {"price": 1000},
+             "alt": {"price": 1000}, "nur_link": None, "kaputt": {"price": 1000}, "ohne_preis": {"price": None}}
+    known = {"teurer": (1000, ago(1)), "gleich": (1000, ago(1)), "alt": (1000, ago(100)),
+             "nur_link": (1000, ago(1)), "kaputt": (1000, "kein datum"), "ohne_preis": (None, ago(1))}
+    fetch, unchanged = select_for_detail(cards, known, refresh_age_hours=72)
+    assert sorted(fetch) == ["alt", "kaputt", "neu", "teurer"]
+    assert sorted(unchanged) == ["gleich", "nur_link", "ohne_preis"]
+
+
+def card(car):
+    return {**car, "description": None, "features_raw": None, "features_mask": None}
+
+
+def test_list_mode_saves_cards_and_keeps_detail_data(engine):
+    detail = make_car(1, description="Leder, Navi", features_raw=["leder", "navi"])
+    db.insert_cars([detail, make_car(2)])
+    cards = {
+        detail["url"]: card({**detail, "price": 14000, "km": 85000}),
+        make_car(2)["url"]: card(make_car(2)),
+        make_car(3)["url"]: card(make_car(3)),
+    }
+    fetch = asyncio.run(select_and_touch(cards, lambda m: None, sink=db.insert_car))
+
+    # Preis geändert + neu -> Detailseite, unverändert -> nur Karte
+    assert sorted(fetch) == sorted([detail["url"], make_car(3)["url"]])
+    with engine.connect() as conn:
+        rows = {r.url: r for r in conn.execute(text("SELECT url, price, km, description, features_raw, features_mask FROM cars"))}
+    assert len(rows) == 3
+    row = rows[detail["url"]]
+    assert (row.price, row.km) == (14000, 85000)
+    assert row.description == "Leder, Navi" and "navi" in row.features_raw and row.features_mask
+    assert rows[make_car(3)["url"]].features_raw is None
+
+
+def test_detail_mode_does_not_write_cards(engine):
+    cards = {make_car(1)["url"]: card(make_car(1))}
+    fetch = asyncio.run(select_and_touch(cards, lambda m: None))
+    assert fetch == [make_car(1)["url"]]
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM cars")).scalar() == 0
+
+
+def test_card_upsert_keeps_detail_fields(engine):
+    detail = make_car(5, variant="Variant", body_type="Kombi", seller_type="händler", location="Wien",
+                      description="Leder", features_raw=["leder"])
+    db.insert_cars([detail])
+    fields = ["title", "variant", "body_type", "year", "km", "power_ps", "fuel_type", "transmission", "drive",
+              "seller_type", "location", "description", "features_raw", "features_mask"]
+    with engine.connect() as conn:
+        before = conn.execute(text(f"SELECT {', '.join(fields)} FROM cars")).one()
+
+    # Suchergebnis-Karte nur mit Preis: alles andere fehlt
+    sparse = card({"platform": "willhaben", "url": detail["url"], "price": 14000,
+                   **{f: None for f in fields if f not in ("description", "features_raw", "features_mask")}})
+    db.insert_cars([sparse])
+    with engine.connect() as conn:
+        after = conn.execute(text(f"SELECT price, {', '.join(fields)} FROM cars")).one()
+    assert after[0] == 14000
+    assert tuple(after[1:]) == tuple(before)
@@ -0,0 +1,75 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+
+import db
+import snapshot
+from conftest import make_car
+
+pytestmark = pytest.mark.skipif(not snapshot.available(), reason="pyarrow fehlt")
+
+
+def minutes_ago(m):
+    return (datetime.utcnow() - timedelta(minutes=m)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+@pytest.fixture
+def snap(engine):
+    for path in (snapshot.SNAPSHOT_PATH, snapshot.meta_path()):
+        if os.path.exists(path):
+            os.remove(path)
+    for i in range(5):
+        db.insert_cars([make_car(i)], seen_at=minutes_ago(20 - i))
+    assert snapshot.update(engine, log=lambda m: None) == 5
+    return engine
+
+
+def test_watermark_and_incremental_update(snap):
+    assert snapshot.is_current(snap)
+    assert snapshot.update(snap, log=lambda m: None) == 0
+
+    db.insert_cars([make_car(1, price=9999)])                       # last_seen rückt vor
+    db.insert_cars([make_car(7)], seen_at=minutes_ago(60))          # neue id, alter Zeitpunkt
+    assert not snapshot.is_current(snap)
+    # nur die geänderten Zeilen kommen aus der DB, dazu die Sekunde des alten
+    # Wasserstands (>=): car 4
+    assert snapshot.update(snap, log=lambda m: None) == 3
+    assert snapshot.is_current(snap)
+
+    df = snapshot.load().set_index("url")
+    assert len(df) == 6 and df.loc[make_car(1)["url"], "price"] == 9999
+    assert snapshot.read_meta()["rows"] == 6
+
+    # Schema-/DB-Wechsel erzwingt einen kompletten Neuaufbau
+    meta = snapshot.read_meta()
+    snapshot._write(snapshot.load(), snapshot.SNAPSHOT_PATH, {**meta, "columns": meta["columns"][:-1]})
+    assert not snapshot.is_current(snap)
+
+
+def test_load_with_filters(snap):
+    with snap.begin() as conn:
+        conn.execute(text("UPDATE cars SET active = 0, delisted_at = :t WHERE url = :u"),
+                     {"t": minutes_ago(1), "u": make_car(4)["url"]})
+    snapshot.update(snap, log=lambda m: None)
+    filters = [[("price", ">", 15010)], [("active", "=", 1), ("delisted_at", ">=", minutes_ago(5))],
+               [("last_seen", ">=", minutes_ago(30)), ("last_seen", "is null", None)]]
+    columns = ["url", "price", "active", "delisted_at", "last_seen"]
+    df = snapshot.load(columns=columns, filters=filters)
+    # 15010 zu billig; 15040 inaktiv, aber kürzlich verschwunden
+    assert sorted(df["price"]) == [15020, 15030, 15040]
+    assert list(df.columns) == columns
+
+
+def test_analysis_frame_sees_db_update_not_stale_snapshot(snap):
+    import market_analysis
+
+    db_path = snap.url.database
+    before = market_analysis.load_analysis_frame(db_path)
+    assert 15010 in set(before["price"])
+
+    db.insert_cars([make_car(1, price=12345)])
+    after = market_analysis.load_analysis_frame(db_path)
+    assert 12345 in set(after["price"]) and 15010 not in set(after["price"])
+    assert snapshot.is_current(snap)
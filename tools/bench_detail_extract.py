@@ -0,0 +1,110 @@
+import os
+import sys
+import time
+import asyncio
+import inspect
+import sqlite3
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from playwright.async_api import async_playwright
+from scrapers.scrape_willhaben_async import (
+    REAL_UA, accept_cookies, block_resources, extract_car_dom, extract_car_json,
+)
+
+# Vergleicht DOM- und JSON-Extraktion auf denselben geladenen Detailseiten:
+# gezählt werden Playwright-Round-Trips (jeder awaitete Page/ElementHandle-Call)
+# und die reine Extraktionszeit pro Inserat.
+
+
+class CountingProxy:
+    def __init__(self, target, counter):
+        self._target = target
+        self._counter = counter
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            res = attr(*args, **kwargs)
+            if inspect.isawaitable(res):
+                self._counter[0] += 1
+                res = await res
+            return self._wrap(res)
+
+        return call
+
+    def _wrap(self, res):
+        if isinstance(res, list):
+            return [CountingProxy(r, self._counter) for r in res]
+        if res is not None and hasattr(res, "inner_text"):
+            return CountingProxy(res, self._counter)
+        return res
+
+
+async def measure(extract, page, url):
+    counter = [0]
+    t0 = time.perf_counter()
+    car = await extract(CountingProxy(page, counter), url)
+    return counter[0], time.perf_counter() - t0, car is not None
+
+
+def urls_from_db(db_path, limit):
+    con = sqlite3.connect(db_path)
+    rows = con.execute(
+        "SELECT url FROM cars WHERE url LIKE 'https://www.willhaben.at/%' ORDER BY last_seen DESC LIMIT ?",
+        (limit,),
+    ).fetchall()
+    con.close()
+    return [r[0] for r in rows]
+
+
+async def run(urls):
+    stats = {"dom": [], "json": []}
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True, args=["--disable-blink-features=AutomationControlled"])
+        context = await browser.new_context(user_agent=REAL_UA, locale="de-AT", timezone_id="Europe/Vienna")
+        await context.route("**/*", block_resources)
+        page = await context.new_page()
+
+        for i, url in enumerate(urls, start=1):
+            await page.goto(url, wait_until="domcontentloaded", timeout=30000)
+            await accept_cookies(page)
+            for name, fn in (("json", extract_car_json), ("dom", extract_car_dom)):
+                trips, secs, ok = await measure(fn, page, url)
+                stats[name].append((trips, secs, ok))
+            print(f"{i}/{len(urls)} json={stats['json'][-1][0]} trips / dom={stats['dom'][-1][0]} trips  {url}")
+
+        await browser.close()
+
+    print()
+    print(f"{'Pfad':<6}{'Inserate':>10}{'ok':>6}{'Trips/Ad':>12}{'ms/Ad':>10}")
+    for name in ("dom", "json"):
+        rows = stats[name]
+        if not rows:
+            continue
+        n = len(rows)
+        trips = sum(r[0] for r in rows) / n
+        ms = sum(r[1] for r in rows) / n * 1000
+        ok = sum(1 for r in rows if r[2])
+        print(f"{name:<6}{n:>10}{ok:>6}{trips:>12.1f}{ms:>10.1f}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark DOM- vs. JSON-Extraktion auf Detailseiten")
+    ap.add_argument("urls", nargs="*", help="Detail-URLs (sonst aus der DB)")
+    ap.add_argument("--limit", type=int, default=20)
+    ap.add_argument("--db", default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "auto_deal.db"))
+    args = ap.parse_args()
+
+    urls = args.urls or urls_from_db(args.db, args.limit)
+    if not urls:
+        raise SystemExit("Keine URLs gefunden.")
+    asyncio.run(run(urls))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from features import FEATURE_RULES, FEATURE_NAMES, feature_mask, tag_texts
+
+# Vergleicht das alte Feature-Tagging (any(needle in blob) pro Regel) mit
+# feature_mask (Regex, ein Inserat pro Aufruf, wie im Scraper) und dem
+# NumPy-Batch tag_texts (retag). Texte sind synthetisch und schon
+# kleingeschrieben, Länge ähnlich echter Beschreibungen.
+#
+#   python tools/bench_features.py --rows 1000000
+
+WORDS = (
+    "gepflegt scheckheft service neu reifen winterreifen sommerreifen klima "
+    "klimaautomatik tempomat nichtraucher garagenfahrzeug pickerl unfallfrei "
+    "finanzierung möglich eintausch leasing garantie accessoires kommission "
+    "lederausstattung panoramadach elektrische fensterheber zentralverriegelung "
+    "bluetooth freisprecheinrichtung usb regensensor lichtsensor tagfahrlicht "
+    "alufelgen sportsitze multifunktionslenkrad"
+).split()
+HITS = (
+    "navi", "navigationssystem", "werksnavi", "led", "matrix-led", "bi-xenon",
+    "sitzheizung", "vordersitzheizung", "quattro", "xdrive", "allradantrieb",
+    "s-line", "m paket", "acc", "adaptiver tempomat", "ahk", "anhängerkupplung",
+    "apple carplay", "android auto", "pdc", "parkpilot", "einparkhilfe",
+)
+
+
+def old_rules():
+    return {k: [n.strip("*") for n in v] for k, v in FEATURE_RULES.items()}
+
+
+def old_extract(blob, rules):
+    return [k for k, needles in rules.items() if any(n in blob for n in needles)]
+
+
+def make_texts(n, words=120, seed=1):
+    rnd = random.Random(seed)
+    out = []
+    for _ in range(n):
+        w = rnd.choices(WORDS, k=words)
+        for _ in range(rnd.randint(0, 4)):
+            w.insert(rnd.randrange(len(w)), rnd.choice(HITS))
+        out.append(" ".join(w))
+    return out
+
+
+def timed(label, fn, mb):
+    t0 = time.perf_counter()
+    res = fn()
+    dt = time.perf_counter() - t0
+    print(f"{label:<28} {dt:8.2f}s  {mb / dt:7.1f} MB/s")
+    return res
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=200_000)
+    args = ap.parse_args()
+
+    texts = make_texts(args.rows)
+    mb = sum(len(t) for t in texts) / 1e6
+    print(f"{args.rows} Zeilen, {mb:.0f} MB Text, {len(FEATURE_NAMES)} Features")
+
+    rules = old_rules()
+    timed("alt: any(n in blob)", lambda: [old_extract(t, rules) for t in texts], mb)
+    per_row = timed("neu: feature_mask pro Zeile", lambda: [feature_mask(t) for t in texts], mb)
+    batch = timed("neu: tag_texts (Batch)", lambda: tag_texts(texts), mb)
+
+    assert per_row == batch.tolist()
+
+
+if __name__ == "__main__":
+    main()
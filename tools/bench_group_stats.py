@@ -0,0 +1,124 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from group_stats import group_stats, group_cube, backoff, attach
+
+# Vergleicht die alte Gruppenstatistik aus market_analysis (groupby().agg mit
+# lambda-Quantilen + merge zurück) mit group_stats/attach auf einer
+# synthetischen Tabelle mit den Gruppenspalten der Marktanalyse.
+#
+#   python tools/bench_group_stats.py --rows 1000000
+#   python tools/bench_group_stats.py --cube   # Back-off-Stufen: group_cube vs. group_stats je Stufe
+
+GROUP_COLS = ["brand", "model", "year_bucket", "ps_bucket", "transmission", "fuel_type", "drive"]
+STAT_COLS = ["n", "median_price", "q25", "q75", "median_km"]
+LEVELS = [
+    GROUP_COLS,
+    ["brand", "model", "year_bucket", "ps_bucket", "fuel_type"],
+    ["brand", "model", "year_bucket", "fuel_type"],
+    ["brand", "model", "year_bucket"],
+]
+
+
+def make_frame(n, seed=1):
+    rng = np.random.default_rng(seed)
+    brands = [f"Marke{i}" for i in range(40)]
+    brand = rng.integers(0, len(brands), n)
+    model = rng.integers(0, 12, n)
+    year = rng.integers(2005, 2025, n)
+    return pd.DataFrame({
+        "brand": pd.Categorical.from_codes(brand, brands),
+        "model": pd.Categorical([f"M{b}-{m}" for b, m in zip(brand, model)]),
+        "year_bucket": (year // 2) * 2,
+        "ps_bucket": rng.choice(np.arange(60, 300, 10), n),
+        "transmission": pd.Categorical(rng.choice(["Manuell", "Automatik"], n)),
+        "fuel_type": pd.Categorical(rng.choice(["Diesel", "Benzin", "Elektro", "Hybrid"], n)),
+        "drive": pd.Categorical(rng.choice(["Front", "Allrad"], n, p=[0.8, 0.2])),
+        "price": rng.lognormal(9.8, 0.5, n).round(),
+        "km": rng.integers(0, 300_000, n).astype(float),
+    })
+
+
+def legacy(df):
+    agg = df.groupby(GROUP_COLS, observed=True).agg(
+        n=("price", "count"),
+        median_price=("price", "median"),
+        q25=("price", lambda s: s.quantile(0.25)),
+        q75=("price", lambda s: s.quantile(0.75)),
+        median_km=("km", "median"),
+    ).reset_index()
+    return agg, df.merge(agg, on=GROUP_COLS, how="inner")
+
+
+def vectorized(df):
+    codes, agg = group_stats(df, GROUP_COLS)
+    return agg, attach(df, codes, agg, STAT_COLS)
+
+
+def timed(fn, df):
+    t0 = time.perf_counter()
+    out = fn(df)
+    return out, time.perf_counter() - t0
+
+
+def per_level(df):
+    return [group_stats(df, cols) for cols in LEVELS]
+
+
+def bench_cube(df, min_n=8):
+    (codes, cube), t_cube = timed(lambda d: group_cube(d, LEVELS), df)
+    levels, t_loop = timed(per_level, df)
+    print(f"{len(df)} Zeilen, {len(LEVELS)} Stufen, {len(cube)} Gruppen")
+    print(f"group_cube        {t_cube:7.2f}s")
+    print(f"group_stats/Stufe {t_loop:7.2f}s")
+    for level, (_, stats) in enumerate(levels):
+        sub = cube[cube["level"] == level]
+        for col in STAT_COLS:
+            diff = np.nanmax(np.abs(sub[col].to_numpy(float) - stats[col].to_numpy(float)), initial=0)
+            assert diff < 1e-6, (level, col, diff)
+    print("Ergebnisse identisch")
+
+    chosen, t_back = timed(lambda c: backoff(c, cube, min_n), codes)
+    full = (cube["n"].to_numpy()[np.maximum(codes[:, 0], 0)] >= min_n) & (codes[:, 0] >= 0)
+    used = np.bincount(cube["level"].to_numpy()[chosen[chosen >= 0]], minlength=len(LEVELS))
+    print(f"backoff           {t_back:7.2f}s")
+    print(f"bewertbar mit n >= {min_n}: volle Gruppe {full.mean():.1%}, mit Back-off {(chosen >= 0).mean():.1%} "
+          f"(je Stufe {', '.join(str(int(u)) for u in used)})")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--skip-legacy", action="store_true")
+    ap.add_argument("--cube", action="store_true")
+    args = ap.parse_args()
+
+    df = make_frame(args.rows)
+    if args.cube:
+        bench_cube(df)
+        return
+    (agg_new, merged_new), t_new = timed(vectorized, df)
+    print(f"{args.rows} Zeilen, {len(agg_new)} Gruppen")
+    print(f"group_stats  {t_new:7.2f}s")
+    if args.skip_legacy:
+        return
+
+    (agg_old, merged_old), t_old = timed(legacy, df)
+    print(f"lambda+merge {t_old:7.2f}s  ({t_old / t_new:.0f}x)")
+
+    for col in STAT_COLS:
+        diff = np.nanmax(np.abs(agg_old[col].to_numpy(float) - agg_new[col].to_numpy(float)))
+        assert diff < 1e-6, (col, diff)
+    assert len(merged_old) == len(merged_new)
+    print("Ergebnisse identisch")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hedonic
+from features import FEATURE_BITS
+
+# Fit-Zeit des Preismodells (hedonic.fit, alle Familien gestapelt) gegen eine
+# Schleife mit einem np.linalg.solve pro Familie, auf synthetischen Daten.
+#
+#   python tools/bench_hedonic.py --families 500 --rows 200
+
+
+def make_frame(families, rows, seed=1):
+    rng = np.random.default_rng(seed)
+    n = families * rows
+    fam = np.repeat(np.arange(families), rows)
+    year = rng.integers(2005, 2025, n)
+    km = rng.integers(0, 300_000, n)
+    ps = rng.choice(np.arange(60, 300, 10), n).astype(float)
+    ps[rng.random(n) < 0.05] = np.nan
+    mask = rng.integers(0, 1 << len(FEATURE_BITS), n)
+    base = rng.normal(10.3, 0.3, families)[fam]
+    log_price = (base - 0.08 * (2025 - year) - 0.15 * km / 1e5 + 0.2 * np.nan_to_num(ps, nan=150) / 100
+                 + 0.03 * np.unpackbits(mask.astype(">u2").view(np.uint8).reshape(n, 2), axis=1).sum(1)
+                 + rng.normal(0, 0.1, n))
+    return pd.DataFrame({
+        "brand": pd.Categorical([f"Marke{f // 10}" for f in fam]),
+        "model": pd.Categorical([f"M{f}" for f in fam]),
+        "year": year, "km": km, "power_ps": ps, "features_mask": mask,
+        "price": np.exp(log_price).round(),
+    })
+
+
+def loop_fit(df, models):
+    """Referenz: jede Familie einzeln (gleiche Merkmale, gleiche Ridge-Strafe)."""
+    penalty = hedonic.RIDGE_LAMBDA * np.eye(len(hedonic.COLUMNS))
+    penalty[0, 0] = 0.0
+    out = []
+    for (brand, model), sub in df.groupby(hedonic.FAMILY_COLUMNS, observed=True, sort=True):
+        ps_mean = np.nanmean(sub["power_ps"].to_numpy(float)) / 100
+        X = hedonic.design_matrix(sub, int(models["ref_year"].iloc[0]), ps_fill=ps_mean)
+        y = np.log(sub["price"].to_numpy(float))
+        out.append(np.linalg.solve(X.T @ X + penalty, X.T @ y))
+    return np.stack(out)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--families", type=int, default=500)
+    ap.add_argument("--rows", type=int, default=200, help="Zeilen je Familie")
+    args = ap.parse_args()
+
+    df = make_frame(args.families, args.rows)
+    t0 = time.perf_counter()
+    models = hedonic.fit(df)
+    t_batch = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    ref = loop_fit(df, models)
+    t_loop = time.perf_counter() - t0
+
+    print(f"{args.families} Familien, {len(df)} Zeilen, {len(hedonic.COLUMNS)} Merkmale")
+    print(f"hedonic.fit (gestapelt) {t_batch:7.3f}s")
+    print(f"Schleife je Familie     {t_loop:7.3f}s  ({t_loop / t_batch:.0f}x)")
+    diff = np.abs(np.stack(models["coef"].to_numpy()) - ref).max()
+    assert diff < 1e-8, diff
+    print(f"Koeffizienten identisch (max. Abweichung {diff:.1e}), Median-RMSE {models['rmse'].median():.3f}")
+
+    t0 = time.perf_counter()
+    fair = hedonic.predict(df, models)
+    print(f"predict {len(df)} Zeilen  {time.perf_counter() - t0:7.3f}s, "
+          f"Median price/fair {np.median(df['price'] / fair):.3f}")
+
+
+if __name__ == "__main__":
+    main()
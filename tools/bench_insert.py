@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import contextlib
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+
+import db
+import init_db
+import migrate_db_sqlite
+
+# Schreibpfad vorher/nachher auf einer frischen SQLite-DB:
+#   legacy: insert_car wie bisher, pro Auto Upsert + SELECT id + SELECT letzter
+#           Preis aus price_history + evtl. INSERT, je eigene Transaktion
+#   batch:  db.insert_cars (Upsert mit RETURNING, current_price in cars)
+# Zwei Durchgänge: alle Autos neu, dann erneut mit 10 % Preisänderungen.
+#
+#   python tools/bench_insert.py --rows 100000
+
+
+def legacy_insert_car(engine, car, seen_at):
+    row = db.car_params(car)
+    with engine.begin() as conn:
+        conn.execute(db.upsert_cars_sql(1), {"seen_at": seen_at, **{f"{c}_0": row.get(c) for c in db.CAR_COLUMNS}}).all()
+        car_id = conn.execute(text("SELECT id FROM cars WHERE url=:url"), {"url": car["url"]}).scalar_one()
+        last_price = conn.execute(text("""
+            SELECT price FROM price_history WHERE car_id=:car_id
+            ORDER BY seen_at DESC LIMIT 1
+        """), {"car_id": car_id}).scalar()
+        if car.get("price") is not None and (last_price is None or int(last_price) != int(car["price"])):
+            conn.execute(text("INSERT INTO price_history (car_id, price) VALUES (:car_id, :price)"),
+                         {"car_id": car_id, "price": car["price"]})
+
+
+def make_cars(n, seed=1):
+    rnd = random.Random(seed)
+    cars = []
+    for i in range(n):
+        cars.append({
+            "platform": "willhaben", "external_id": str(i),
+            "url": f"https://www.willhaben.at/iad/gebrauchtwagen/d/auto/bench-{i}/",
+            "title": "VW Golf 1.6 TDI", "brand": "VW", "model": "Golf",
+            "year": rnd.randint(2010, 2023), "km": rnd.randint(0, 250_000),
+            "price": rnd.randint(3000, 40000), "power_ps": 115,
+            "features_raw": ["navi", "led"], "description": "gepflegt " * 40,
+        })
+    return cars
+
+
+def fresh_db(path, with_history_index):
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        init_db.DATABASE_URL = f"sqlite:///{path}"
+        init_db.init_db()
+        migrate_db_sqlite.DB_PATH = path
+        migrate_db_sqlite.main()
+    engine = create_engine(f"sqlite:///{path}", future=True)
+    if not with_history_index:
+        with engine.begin() as conn:
+            conn.execute(text("DROP INDEX IF EXISTS idx_price_history_car_seen"))
+    return engine
+
+
+def run(label, engine, cars, write):
+    changed = [dict(c, price=c["price"] + 100) if i % 10 == 0 else c for i, c in enumerate(cars)]
+    for name, batch in [("neu", cars), ("update", changed)]:
+        t0 = time.perf_counter()
+        write(engine, batch)
+        dt = time.perf_counter() - t0
+        print(f"{label:<8} {name:<7} {len(batch):>7} Zeilen  {dt:7.1f}s  {len(batch) / dt:9.0f} Zeilen/s")
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT COUNT(*) FROM price_history")).scalar()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--batch", type=int, default=2000, help="Autos pro insert_cars-Aufruf")
+    args = ap.parse_args()
+
+    cars = make_cars(args.rows)
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = fresh_db(os.path.join(tmp, "legacy.db"), with_history_index=False)
+        seen_at = db.utc_now()
+        n_legacy = run("legacy", engine, cars, lambda e, batch: [legacy_insert_car(e, c, seen_at) for c in batch])
+
+        engine = fresh_db(os.path.join(tmp, "batch.db"), with_history_index=True)
+        db.engine = engine
+
+        def write(e, batch):
+            for i in range(0, len(batch), args.batch):
+                db.insert_cars(batch[i:i + args.batch])
+
+        n_batch = run("batch", engine, cars, write)
+        print(f"price_history: legacy {n_legacy}, batch {n_batch}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import os
+import sys
+import json
+import hashlib
+import math
+import argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Lokaler Ersatz für willhaben.at: spielt aufgezeichnete Such- und Detailseiten ab.
+#
+# Suchseiten werden mit denselben URLs (with_page, rows=SEARCH_ROWS) wie vom
+# Scraper aufgezeichnet, sonst findet der Abruf sie nicht.
+#
+#   python tools/replay_server.py record "<such-url>" --dir recorded --details 20
+#   python tools/replay_server.py serve --dir recorded --port 8765
+#   WILLHABEN_BASE_URL=http://127.0.0.1:8765 FETCH_BACKEND=http python batch_run_urls.py
+
+
+def key_for(url):
+    """Pfad + sortierte Query: gleiche Parameter in anderer Reihenfolge treffen
+    dieselbe Aufzeichnung, andere page/rows nicht."""
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return parts.path + ("?" + query if query else "")
+
+
+def file_for(key):
+    return hashlib.sha1(key.encode("utf-8")).hexdigest() + ".html"
+
+
+def load_index(directory):
+    path = os.path.join(directory, "index.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        # ältere Aufzeichnungen mit unsortierter Query
+        return {key_for(key): entry for key, entry in json.load(f).items()}
+
+
+def record(start_url, directory, pages=None, details=20, base_url=None):
+    """Zeichnet die Suchseiten 1..pages (ohne pages: alle laut rowsFound) und
+    bis zu `details` Detailseiten auf."""
+    from scrapers.http_fetch import HttpFetcher, HTTP_BASE_URL, page_props_from_html
+    from scrapers.scrape_willhaben_async import SEARCH_ROWS
+    from scrapers.willhaben_json import rows_found, search_urls
+    from willhaben_url import with_page
+
+    os.makedirs(directory, exist_ok=True)
+    index = load_index(directory)
+    fetcher = HttpFetcher(base_url=base_url or HTTP_BASE_URL)
+
+    def save(url):
+        status, html = fetcher.get(url)
+        key = key_for(url)
+        index[key] = {"file": file_for(key), "status": status}
+        with open(os.path.join(directory, file_for(key)), "w", encoding="utf-8") as f:
+            f.write(html)
+        print(f"{status} {url}")
+        return html
+
+    detail_urls = []
+    n, last = 1, pages or 1
+    while n <= last:
+        # dieselbe URL wie scrape_http/collect_cards
+        page_props = page_props_from_html(save(with_page(start_url, n, rows=SEARCH_ROWS)))
+        urls = search_urls(page_props)
+        if not urls:
+            break
+        if n == 1 and not pages:
+            total = rows_found(page_props) or len(urls)
+            last = math.ceil(total / len(urls))
+        detail_urls.extend(urls)
+        n += 1
+
+    for url in detail_urls[:details]:
+        save(url)
+
+    fetcher.close()
+    with open(os.path.join(directory, "index.json"), "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    print(f"{len(index)} Seiten in {directory}")
+
+
+def make_handler(directory):
+    index = load_index(directory)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            entry = index.get(key_for(self.path))
+            if entry is None:
+                self.send_error(404)
+                return
+            with open(os.path.join(directory, entry["file"]), "rb") as f:
+                body = f.read()
+            self.send_response(entry.get("status", 200))
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+def serve(directory, host, port):
+    httpd = ThreadingHTTPServer((host, port), make_handler(directory))
+    print(f"Replay-Server auf http://{host}:{port} ({directory})")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    httpd.server_close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Aufgezeichnete Willhaben-Seiten lokal ausliefern")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    rec = sub.add_parser("record")
+    rec.add_argument("url")
+    rec.add_argument("--dir", default="recorded")
+    rec.add_argument("--pages", type=int, default=None, help="Suchseiten (Standard: alle laut Trefferzahl)")
+    rec.add_argument("--details", type=int, default=20)
+
+    srv = sub.add_parser("serve")
+    srv.add_argument("--dir", default="recorded")
+    srv.add_argument("--host", default="127.0.0.1")
+    srv.add_argument("--port", type=int, default=8765)
+
+    args = ap.parse_args()
+    if args.cmd == "record":
+        record(args.url, args.dir, args.pages, args.details)
+    else:
+        serve(args.dir, args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
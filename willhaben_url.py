@@ -1,4 +1,4 @@
-from urllib.parse import urlencode, urlparse, parse_qs
+from urllib.parse import urlencode, urlparse, urlunparse, parse_qs, parse_qsl
 
 BASE = "https://www.willhaben.at/iad/gebrauchtwagen/auto/gebrauchtwagenboerse"
 
@@ -53,3 +53,23 @@ def build_search_url(
         params.append(("PRICE_TO", str(price_to)))
 
     return f"{BASE}?{urlencode(params)}"
+
+
+def with_page(url: str, page: int, rows: int | None = None) -> str:
+    """Setzt page (und optional rows) in einer bestehenden Such-URL."""
+    parsed = urlparse(url)
+    params = [(k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True) if k not in ("page", "rows")]
+    params.append(("rows", str(rows) if rows is not None else (parse_qs(parsed.query).get("rows") or ["30"])[0]))
+    params.append(("page", str(page)))
+    return urlunparse(parsed._replace(query=urlencode(params)))
+
+
+# Parameter, die nur Darstellung/Sitzung betreffen und die Treffermenge nicht ändern
+VOLATILE_PARAMS = ("page", "rows", "sfId", "isNavigation")
+
+def search_key(url: str) -> str:
+    """Stabile Kennung einer Suche: Pfad + sortierte Filterparameter ohne
+    Paginierung und sfId, z.B. für search_listings."""
+    parsed = urlparse(url)
+    params = sorted((k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True) if k not in VOLATILE_PARAMS)
+    return urlunparse(parsed._replace(scheme="", netloc="", query=urlencode(params), fragment="")).lstrip("/")